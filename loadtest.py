@@ -0,0 +1,660 @@
+"""Lasttest für den Insurance Bot.
+
+Simuliert N gleichzeitige Mitarbeiter, die Slash-Commands gegen die echten
+Handler aus main.py ausführen, während parallel das Mahnungs-System läuft.
+Die Discord-HTTP-Schicht wird komplett im Prozess nachgebildet (inkl.
+Rate-Limits pro Route und 429-Antworten), es wird also weder ein Token noch
+eine Netzwerkverbindung benötigt.
+
+Beispiel:
+    python loadtest.py --users 25 --ops 40 --mix create=5,archive=3,remind=1
+    python loadtest.py --rate-scale 10   # Rate-Limit-Fenster 10x verkürzt
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+_snowflakes = itertools.count(1_100_000_000_000_000_000)
+
+def next_snowflake():
+    return next(_snowflakes)
+
+# Gefälschte Discord-HTTP-Schicht
+class RouteBucket:
+    """Token-Bucket für eine einzelne Route (z.B. Nachrichten in einem Channel)"""
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def acquire(self, now):
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining <= 0:
+            return self.reset_at - now
+        self.remaining -= 1
+        return 0.0
+
+class FakeDiscordHTTP:
+    """Bildet die REST-API mit Latenz, Rate-Limits pro Route und 429-Antworten nach"""
+
+    # (Anzahl, Sekunden) – angelehnt an die realen Discord-Limits
+    ROUTE_LIMITS = {
+        "POST /channels/{channel_id}/messages": (5, 5.0),
+        "PATCH /channels/{channel_id}/messages/{message_id}": (5, 5.0),
+        "DELETE /channels/{channel_id}": (5, 5.0),
+        "POST /interactions/{interaction_id}/callback": (1, 1.0),
+        "POST /webhooks/{application_id}/{token}": (5, 2.0),
+        "PATCH /webhooks/{application_id}/{token}/messages/@original": (5, 2.0),
+    }
+    GLOBAL_LIMIT = (50, 1.0)
+
+    def __init__(self, latency_ms=(40, 120), rate_limits=True, rate_scale=1.0):
+        self.latency_ms = latency_ms
+        self.rate_limits = rate_limits
+        self.rate_scale = rate_scale
+        self.buckets = {}
+        self.global_bucket = RouteBucket(self.GLOBAL_LIMIT[0], self.GLOBAL_LIMIT[1] / rate_scale)
+        self.requests = Counter()
+        self.responses_429 = Counter()
+
+    async def request(self, method, path, major_id, global_limit=True):
+        route = f"{method} {path}"
+        while True:
+            self.requests[route] += 1
+            await asyncio.sleep(random.uniform(*self.latency_ms) / 1000)
+            if not self.rate_limits:
+                return
+            now = time.monotonic()
+            retry_after = 0.0
+            if global_limit:
+                retry_after = self.global_bucket.acquire(now)
+            if not retry_after:
+                limit, per = self.ROUTE_LIMITS.get(route, (10, 1.0))
+                bucket = self.buckets.get((route, major_id))
+                if bucket is None:
+                    bucket = self.buckets[(route, major_id)] = RouteBucket(limit, per / self.rate_scale)
+                retry_after = bucket.acquire(now)
+            if not retry_after:
+                return
+            # 429 – wie discord.py: warten und erneut versuchen
+            self.responses_429[route] += 1
+            await asyncio.sleep(retry_after)
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None, view=None):
+        self.id = next_snowflake()
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.created_at = datetime.now()
+
+    async def edit(self, content=None, embed=None, view=None):
+        await self.channel.http.request("PATCH", "/channels/{channel_id}/messages/{message_id}", self.channel.id)
+        if embed is not None:
+            self.embed = embed
+
+    async def delete(self):
+        await self.channel.http.request("DELETE", "/channels/{channel_id}/messages/{message_id}", self.channel.id)
+        self.channel.messages.pop(self.id, None)
+
+class MissingMessage:
+    """Gelöschte Nachricht: Edits schlagen wie bei Discord mit 404 fehl"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def edit(self, content=None, embed=None, view=None):
+        import discord
+        await self.channel.http.request("PATCH", "/channels/{channel_id}/messages/{message_id}", self.channel.id)
+        raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+
+class FakeTextChannel:
+    def __init__(self, http, guild, name, category=None):
+        self.http = http
+        self.guild = guild
+        self.id = next_snowflake()
+        self.name = name
+        self.category = category
+        self.messages = {}
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    async def send(self, content=None, *, embed=None, view=None, **kwargs):
+        await self.http.request("POST", "/channels/{channel_id}/messages", self.id)
+        message = FakeMessage(self, content, embed, view)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or MissingMessage(self)
+
+    async def fetch_message(self, message_id):
+        await self.http.request("GET", "/channels/{channel_id}/messages/{message_id}", self.id)
+        return self.messages[message_id]
+
+    async def delete(self, reason=None):
+        await self.http.request("DELETE", "/channels/{channel_id}", self.id)
+        self.guild.channels.pop(self.id, None)
+
+class FakeRole:
+    def __init__(self, name):
+        self.id = next_snowflake()
+        self.name = name
+
+class FakePermissions:
+    administrator = True
+
+class FakeMember:
+    def __init__(self, name):
+        self.id = next_snowflake()
+        self.name = name
+        self.display_name = name
+        self.roles = []
+        self.guild_permissions = FakePermissions()
+        self.display_avatar = None
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    async def add_roles(self, *roles):
+        self.roles.extend(roles)
+
+    def __str__(self):
+        return self.name
+
+class FakeGuild:
+    def __init__(self, http):
+        self.http = http
+        self.id = next_snowflake()
+        self.name = "Lasttest"
+        self.channels = {}
+        self.threads = {}
+        self.members = {}
+        self.roles = []
+        self.categories = []
+        self.icon = None
+
+    def add_text_channel(self, name):
+        channel = FakeTextChannel(self.http, self, name)
+        self.channels[channel.id] = channel
+        return channel
+
+    def add_member(self, name):
+        member = FakeMember(name)
+        self.members[member.id] = member
+        return member
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_thread(self, thread_id):
+        return self.threads.get(thread_id)
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    async def query_members(self, *, user_ids, limit=5, cache=True):
+        # Gateway-Opcode 8 (Request Guild Members), zählt wie ein Request
+        await self.http.request("GATEWAY", "REQUEST_GUILD_MEMBERS", self.id, global_limit=False)
+        return [self.members[user_id] for user_id in user_ids if user_id in self.members][:limit]
+
+    async def create_role(self, name, **kwargs):
+        role = FakeRole(name)
+        self.roles.append(role)
+        return role
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _callback(self):
+        if self._done:
+            raise RuntimeError("Interaction wurde bereits beantwortet")
+        self._done = True
+        await self._interaction.http.request(
+            "POST", "/interactions/{interaction_id}/callback", self._interaction.id, global_limit=False
+        )
+
+    async def defer(self, ephemeral=False, thinking=False):
+        await self._callback()
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False):
+        await self._callback()
+        self._interaction.sent.append(embed)
+
+    async def edit_message(self, *, embed=None, view=None):
+        await self._callback()
+        self._interaction.sent.append(embed)
+
+    async def send_modal(self, modal):
+        await self._callback()
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, *, embed=None, view=None, ephemeral=False):
+        await self._interaction.http.request(
+            "POST", "/webhooks/{application_id}/{token}", self._interaction.id, global_limit=False
+        )
+        self._interaction.sent.append(embed)
+
+class FakeInteraction:
+    def __init__(self, http, guild, user, channel=None):
+        self.http = http
+        self.id = next_snowflake()
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.channel = channel
+        self.sent = []
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, *, embed=None, view=None):
+        await self.http.request(
+            "PATCH", "/webhooks/{application_id}/{token}/messages/@original", self.id, global_limit=False
+        )
+        self.sent.append(embed)
+
+    def last_embed(self):
+        return self.sent[-1] if self.sent else None
+
+# Lastgenerator
+class LoopLagMonitor:
+    """Misst die Scheduling-Verzögerung der Event-Loop"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(LoadTest.OPERATIONS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unbekannte Operation(en): {', '.join(sorted(unknown))}")
+    return mix
+
+class LoadTest:
+    OPERATIONS = ("create", "archive", "remind")
+
+    def __init__(self, main, args):
+        self.main = main
+        self.args = args
+        self.http = FakeDiscordHTTP(
+            latency_ms=(args.latency_min, args.latency_max),
+            rate_limits=not args.no_rate_limits,
+            rate_scale=args.rate_scale
+        )
+        self.route_through_outbound()
+        self.guild = FakeGuild(self.http)
+        self.staff = [self.guild.add_member(f"Mitarbeiter-{i}") for i in range(args.users)]
+        self.channels = [self.guild.add_text_channel(f"rechnungen-{i}") for i in range(args.channels)]
+        self.log_channel = self.guild.add_text_channel("bot-logs")
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.created_ids = []
+        self.created_by_args = {}
+        self.replays = 0
+        self.open_ids = []
+        self.archived_ids = []
+
+    def route_through_outbound(self):
+        """Wie bot.http: REST-Requests laufen durch den Outbound-Scheduler des Bots.
+        Interaktions-Antworten gehen bei discord.py über den Webhook-Adapter und bleiben außen vor."""
+        request = self.http.request
+
+        async def scheduled(method, path, major_id, global_limit=True):
+            if path.startswith(("/interactions", "/webhooks")):
+                return await request(method, path, major_id, global_limit)
+            return await self.main.outbound.run(
+                (f"{method} {path}", major_id), lambda: request(method, path, major_id, global_limit)
+            )
+
+        self.http.request = scheduled
+
+    def seed(self):
+        """Legt Testkunden und bereits überfällige Rechnungen an"""
+        main = self.main
+        main.get_config(self.guild.id)["log_channel_id"] = self.log_channel.id
+        main.bot._connection._add_guild(self.guild)
+        data = main.get_data(self.guild.id)
+
+        now = datetime.now()
+        tariffs = main.tariff_catalog.at()
+        customer_ids = []
+        for i in range(self.args.customers):
+            customer_id = f"VN-LT{i:06d}"
+            customer_ids.append(customer_id)
+            data['customers'][customer_id] = {
+                "rp_name": f"Testkunde {i}",
+                "hbpay_nummer": f"HB{i:06d}",
+                "economy_id": f"ECO{i:06d}",
+                "versicherungen": random.sample(list(tariffs.tariffs), k=random.randint(1, 3)),
+                "thread_id": None,
+                "discord_user_id": random.choice(self.staff).id,
+                "created_at": now.isoformat(),
+                "created_by": 0
+            }
+            customer = data['customers'][customer_id]
+            customer["total_monthly_price"] = tariffs.total(customer["versicherungen"])
+
+        # Überfällige Rechnungen auf allen drei Mahnstufen
+        for i in range(self.args.overdue):
+            invoice_id = f"RE-LT-{i:05d}"
+            stage = i % 3
+            betrag = 1000.0 + i
+            data['invoices'][invoice_id] = {
+                "customer_id": random.choice(customer_ids),
+                "betrag": betrag * (1.05 if stage == 2 else 1.0),
+                "betrag_netto": betrag / 1.13,
+                "steuer": betrag - betrag / 1.13,
+                "original_betrag": betrag,
+                "paid": False,
+                "message_id": None,
+                "channel_id": random.choice(self.channels).id,
+                "due_date": (now - timedelta(days=stage)).isoformat(),
+                "reminder_count": stage,
+                "created_at": (now - timedelta(days=stage + 3)).isoformat(),
+                "created_by": 0
+            }
+            self.open_ids.append(invoice_id)
+        main.save_data(self.guild.id)
+        self.customer_ids = customer_ids
+
+    async def op_create(self, user):
+        interaction = FakeInteraction(self.http, self.guild, user)
+        known = set(self.main.get_data(self.guild.id)['invoices'])
+        args = (user.id, random.choice(self.customer_ids), random.choice(self.channels))
+        await self.main.create_invoice.callback(interaction, *args[1:])
+        embed = interaction.last_embed()
+        if embed is None or embed.color.value == self.main.COLOR_ERROR:
+            return False
+        invoice_id = next(f.value.strip('`') for f in embed.fields if f.name == "Rechnungsnummer")
+        # Gleiche Argumente innerhalb des Idempotenz-Fensters liefern bewusst dieselbe Rechnung
+        if self.created_by_args.get(args) == invoice_id:
+            self.replays += 1
+            return True
+        self.created_by_args[args] = invoice_id
+        if invoice_id in known:
+            self.errors["duplicate_id"] += 1
+        self.created_ids.append(invoice_id)
+        self.open_ids.append(invoice_id)
+        return True
+
+    async def op_archive(self, user):
+        if not self.open_ids:
+            return None
+        invoice_id = self.open_ids.pop(random.randrange(len(self.open_ids)))
+        interaction = FakeInteraction(self.http, self.guild, user)
+        await self.main.archive_invoice.callback(interaction, invoice_id)
+        embed = interaction.last_embed()
+        if embed is None or embed.color.value == self.main.COLOR_ERROR:
+            return False
+        self.archived_ids.append(invoice_id)
+        return True
+
+    async def op_remind(self, user):
+        await self.main.check_invoices.coro()
+        return True
+
+    async def virtual_user(self, user, weights):
+        names = list(weights)
+        for _ in range(self.args.ops):
+            op = random.choices(names, weights=[weights[n] for n in names])[0]
+            start = time.perf_counter()
+            try:
+                ok = await getattr(self, f"op_{op}")(user)
+            except Exception as e:
+                self.errors[f"{op}: {type(e).__name__}"] += 1
+                ok = False
+            if ok is None:
+                continue
+            self.latencies[op].append(time.perf_counter() - start)
+            if not ok:
+                self.errors[f"{op}: Fehler-Embed"] += 1
+            if self.args.think_ms:
+                await asyncio.sleep(random.uniform(0, self.args.think_ms) / 1000)
+
+    def check_invariants(self):
+        """Prüft Konsistenz zwischen Speicher, Datei und gesendeten Nachrichten"""
+        main = self.main
+        violations = []
+        data = main.get_data(self.guild.id)
+        invoices = data['invoices']
+        with open(os.path.join(main.DATA_DIR, str(self.guild.id), "data.json"), 'r', encoding='utf-8') as f:
+            persisted = json.load(f)['invoices']
+
+        duplicates = [i for i, n in Counter(self.created_ids).items() if n > 1]
+        if duplicates:
+            violations.append(f"Doppelte Rechnungs-IDs vergeben: {', '.join(duplicates[:5])}")
+        if self.errors.get("duplicate_id"):
+            violations.append(f"{self.errors['duplicate_id']} Rechnung(en) haben eine bestehende ID überschrieben")
+
+        lost = [i for i in self.created_ids if i not in invoices]
+        if lost:
+            violations.append(f"{len(lost)} Rechnung(en) im Speicher verloren: {', '.join(lost[:5])}")
+        not_persisted = [i for i in self.created_ids if i not in persisted]
+        if not_persisted:
+            violations.append(f"{len(not_persisted)} Rechnung(en) nicht persistiert: {', '.join(not_persisted[:5])}")
+
+        multipliers = {0: 1.0, 1: 1.0, 2: 1.05, 3: 1.10}
+        for invoice_id, invoice in invoices.items():
+            count = invoice.get('reminder_count', 0)
+            if invoice.get('paid'):
+                if count != 0:
+                    violations.append(f"{invoice_id}: bezahlt, aber reminder_count={count}")
+                continue
+            if count not in multipliers:
+                violations.append(f"{invoice_id}: ungültiger reminder_count={count}")
+            elif abs(invoice['betrag'] - invoice['original_betrag'] * multipliers[count]) > 0.005:
+                violations.append(f"{invoice_id}: Betrag {invoice['betrag']:.2f} passt nicht zu Mahnstufe {count}")
+
+        reminders = Counter(
+            (log['details'].get('invoice_id'), log['action'])
+            for log in data['logs'] if log['action'].startswith("MAHNUNG_")
+        )
+        for (invoice_id, action), n in reminders.items():
+            if n > 1:
+                violations.append(f"{invoice_id}: {action} {n}x versendet")
+
+        for invoice_id in self.created_ids:
+            invoice = invoices.get(invoice_id)
+            if not invoice:
+                continue
+            channel = self.guild.get_channel(invoice['channel_id'])
+            if channel is None or invoice['message_id'] not in channel.messages:
+                violations.append(f"{invoice_id}: Rechnungsnachricht fehlt")
+                continue
+            customer = data['customers'][invoice['customer_id']]
+            expected = main.build_invoice_embed(self.guild.id, invoice_id, invoice, customer).to_dict()
+            if channel.messages[invoice['message_id']].embed.to_dict() != expected:
+                violations.append(f"{invoice_id}: Rechnungsnachricht zeigt einen veralteten Stand")
+        return violations
+
+    async def regression_archive_during_reminder(self):
+        """Archiviert eine Rechnung, während ihre zweite Mahnung unterwegs ist.
+        Danach darf sie weder Mahngebühr noch Mahnstufe tragen."""
+        main = self.main
+        data = main.get_data(self.guild.id)
+        invoice_id = "RE-LT-REGRESSION"
+        now = datetime.now()
+        data['invoices'][invoice_id] = {
+            "customer_id": self.customer_ids[0],
+            "betrag": 500.0,
+            "betrag_netto": 500.0 / 1.13,
+            "steuer": 500.0 - 500.0 / 1.13,
+            "original_betrag": 500.0,
+            "paid": False,
+            "message_id": None,
+            "channel_id": self.channels[0].id,
+            "due_date": (now - timedelta(days=1)).isoformat(),
+            "reminder_count": 1,
+            "created_at": (now - timedelta(days=4)).isoformat(),
+            "created_by": 0
+        }
+        main.save_data(self.guild.id)
+
+        send_reminder = main.send_reminder
+
+        async def archive_then_send(guild, sent_id, *args):
+            if sent_id == invoice_id:
+                await main.archive_invoice.callback(FakeInteraction(self.http, self.guild, self.staff[0]), invoice_id)
+            return await send_reminder(guild, sent_id, *args)
+
+        main.send_reminder = archive_then_send
+        try:
+            await main.check_invoices.coro()
+        finally:
+            main.send_reminder = send_reminder
+
+        invoice = data['invoices'][invoice_id]
+        violations = []
+        if not invoice.get('paid'):
+            violations.append(f"{invoice_id}: Archivieren während der Mahnung fehlgeschlagen")
+        if invoice.get('reminder_count', 0) != 0 or invoice['betrag'] != invoice['original_betrag']:
+            violations.append(
+                f"{invoice_id}: während der Mahnung bezahlt, trotzdem Mahnstufe {invoice.get('reminder_count')} "
+                f"und Betrag {invoice['betrag']:.2f}"
+            )
+        return violations
+
+    def report(self, wall_time, lag_samples, violations):
+        print(f"\n=== Lasttest: {self.args.users} Nutzer × {self.args.ops} Operationen in {wall_time:.2f}s ===")
+        print(f"{'Operation':<10}{'Anzahl':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for op, values in sorted(self.latencies.items()):
+            ms = [v * 1000 for v in values]
+            print(f"{op:<10}{len(ms):>8}{statistics.median(ms):>10.1f}{percentile(ms, 95):>10.1f}"
+                  f"{percentile(ms, 99):>10.1f}{max(ms):>10.1f}")
+
+        lag_ms = [v * 1000 for v in lag_samples] or [0.0]
+        print(f"\nEvent-Loop-Lag: p50 {statistics.median(lag_ms):.1f} ms • p99 {percentile(lag_ms, 99):.1f} ms • max {max(lag_ms):.1f} ms")
+
+        total_requests = sum(self.http.requests.values())
+        total_429 = sum(self.http.responses_429.values())
+        print(f"HTTP-Requests: {total_requests} • davon 429: {total_429}")
+        print(f"Idempotente Wiederholungen: {self.replays} • Cache: {self.main.idempotency_cache.stats()}")
+        print(f"Rechnungsnachrichten: {self.main.invoice_messages.stats()}")
+        for name, stats in self.main.outbound.stats()["classes"].items():
+            print(f"  Outbound {name:<12} gesendet {stats['sent']:>5} • Wartezeit Ø {stats['wait_avg_ms']:.1f} ms, max {stats['wait_max_ms']:.1f} ms")
+        for route, n in self.http.responses_429.most_common():
+            print(f"  429 {route}: {n}")
+
+        if self.errors:
+            print("\nFehler:")
+            for name, n in self.errors.most_common():
+                print(f"  {name}: {n}")
+
+        print(f"\nInvarianten: {len(violations)} Verletzung(en)")
+        for violation in violations[:25]:
+            print(f"  ✗ {violation}")
+        if len(violations) > 25:
+            print(f"  … und {len(violations) - 25} weitere")
+
+    async def run(self):
+        weights = self.args.mix
+        self.seed()
+        # Edits der Rechnungsnachrichten nur kurz sammeln, damit der Test nicht wartet
+        self.main.invoice_messages.delay = 0.05
+        monitor = LoopLagMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(self.virtual_user(user, weights) for user in self.staff))
+        await self.main.invoice_messages.drain()
+        await self.main.outbound.drain()
+        await self.main.guild_store.saved(self.guild.id)
+        wall_time = time.perf_counter() - start
+        await monitor.stop()
+        violations = self.check_invariants()
+        violations += await self.regression_archive_during_reminder()
+        self.report(wall_time, monitor.samples, violations)
+        return 1 if violations else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lasttest mit simulierten Mitarbeitern gegen die Bot-Handler")
+    parser.add_argument("--users", type=int, default=10, help="Anzahl gleichzeitiger virtueller Mitarbeiter")
+    parser.add_argument("--ops", type=int, default=10, help="Operationen pro Mitarbeiter")
+    parser.add_argument("--mix", type=parse_mix, default="create=5,archive=3,remind=1",
+                        help="Gewichtung der Operationen, z.B. create=5,archive=3,remind=1")
+    parser.add_argument("--customers", type=int, default=200, help="Anzahl vorab angelegter Kunden")
+    parser.add_argument("--overdue", type=int, default=9, help="Anzahl vorab angelegter überfälliger Rechnungen")
+    parser.add_argument("--channels", type=int, default=3, help="Anzahl Rechnungs-Channels")
+    parser.add_argument("--latency-min", type=float, default=40, help="Minimale simulierte API-Latenz in ms")
+    parser.add_argument("--latency-max", type=float, default=120, help="Maximale simulierte API-Latenz in ms")
+    parser.add_argument("--think-ms", type=float, default=50, help="Maximale Denkzeit zwischen zwei Operationen in ms")
+    parser.add_argument("--rate-scale", type=float, default=1.0,
+                        help="Verkürzt die Rate-Limit-Fenster um diesen Faktor (1 = reale Limits)")
+    parser.add_argument("--no-rate-limits", action="store_true", help="Rate-Limits der Fake-API deaktivieren")
+    parser.add_argument("--seed", type=int, default=None, help="Zufalls-Seed für reproduzierbare Läufe")
+    parser.add_argument("--log-level", default="WARNING", help="Log-Level des Bots während des Tests")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # main.py legt Daten- und Logdateien im Arbeitsverzeichnis an
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo_dir)
+    workdir = tempfile.mkdtemp(prefix="insurance-loadtest-")
+    os.chdir(workdir)
+    import main as bot_main
+    logging.getLogger().setLevel(args.log_level.upper())
+    print(f"Arbeitsverzeichnis: {workdir}")
+
+    return asyncio.run(LoadTest(bot_main, args).run())
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,101 +1,1010 @@
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
+import asyncio
+import atexit
+import base64
+import bisect
+import calendar
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
+import heapq
+import itertools
 import json
 import os
+from array import array
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import math
+import queue
 import random
+import re
+import secrets
+import signal
+import socket
 import string
+import sys
+import threading
+import time
+import traceback
+import unicodedata
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: keine Sperre, dort läuft ohnehin nur ein Prozess pro Datenverzeichnis
+    fcntl = None
 
 # Logging konfigurieren
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('insurance_bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Die Event-Loop legt Log-Einträge nur in eine Queue, geschrieben wird im Thread des QueueListeners
+LOG_FILE = 'insurance_bot.log'
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'json' für JSON-Lines
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+
+# Command und User der aktuell bearbeiteten Interaction, wird an jeden Log-Eintrag gehängt
+log_context = contextvars.ContextVar('log_context', default={})
+
+class LogContextFilter(logging.Filter):
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    """Formatiert Log-Einträge als eine JSON-Zeile pro Eintrag"""
+
+    FIELDS = ("command", "user_id", "guild_id", "duration_ms")
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in self.FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging():
+    if LOG_FORMAT == 'json':
+        formatter = JsonLogFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(LogContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [queue_handler]
+
+    listener = QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger('InsuranceBot')
 
+# Uhr
+# Alle Zeitpunkte des Bots (Fälligkeiten, Mahnungen, Zeitstempel) kommen von hier,
+# damit Simulationen wie simulate.py die Zeit vorspulen können (main.clock ersetzen)
+class SystemClock:
+    def now(self):
+        return datetime.now()
+
+clock = SystemClock()
+
 # Bot Setup
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
 
-# Datenspeicherung
+# Sharding: SHARD_MODE=auto startet einen AutoShardedBot, SHARD_COUNT/SHARD_IDS
+# erlauben mehrere Prozesse mit fest zugeordneten Shards (z.B. SHARD_IDS=0,1 SHARD_COUNT=4)
+SHARD_COUNT = int(os.environ['SHARD_COUNT']) if os.environ.get('SHARD_COUNT') else None
+SHARD_IDS = [int(s) for s in os.environ['SHARD_IDS'].split(',')] if os.environ.get('SHARD_IDS') else None
+SHARDED = os.environ.get('SHARD_MODE') == 'auto' or SHARD_COUNT is not None
+
+# Längere Rate-Limit-Wartezeiten wirft discord.py als RateLimited, statt den Request-Platz
+# zu blockieren; der Outbound-Scheduler pausiert dann nur die betroffene Route (30 ist das Minimum)
+DISCORD_MAX_RATELIMIT_WAIT = 30.0
+
+if SHARDED:
+    bot = commands.AutoShardedBot(
+        command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+        max_ratelimit_timeout=DISCORD_MAX_RATELIMIT_WAIT
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, max_ratelimit_timeout=DISCORD_MAX_RATELIMIT_WAIT)
+
+def is_local_guild(guild_id):
+    """Prüft, ob ein Server zu den Shards dieses Prozesses gehört"""
+    if not SHARDED or bot.shard_count is None:
+        return True
+    shard_id = (guild_id >> 22) % bot.shard_count
+    return bot.shard_ids is None or shard_id in bot.shard_ids
+
+def local_guilds():
+    """Alle Server dieses Prozesses, auf denen Hintergrundjobs laufen dürfen"""
+    return [guild for guild in bot.guilds if is_local_guild(guild.id)]
+
+# Datenspeicherung (getrennt pro Server)
+DATA_DIR = "guild_data"
+# Altbestand aus der Zeit vor der Aufteilung pro Server. Er wird nur dem Server zugeordnet,
+# dessen ID in LEGACY_GUILD_ID steht; ohne die Angabe bleibt er unangetastet liegen.
 DATA_FILE = "insurance_data.json"
 CONFIG_FILE = "bot_config.json"
+LEGACY_GUILD_ID = int(os.environ['LEGACY_GUILD_ID']) if os.environ.get('LEGACY_GUILD_ID') else None
 
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"log_channel_id": None, "company_account_id": None}
+DEFAULT_CONFIG = {"log_channel_id": None, "company_account_id": None, "billing_channel_id": None}
+# Schlägt das Schreiben fehl, bleibt die Datei vorgemerkt und wird nach dieser Pause erneut geschrieben
+SAVE_RETRY_DELAY = 5
 
-def save_config(config):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=4)
+def atomic_write(path, content):
+    """Schreibt über eine temporäre Datei mit fsync und rename: die Datei ist immer alt oder neu, nie halb"""
+    tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # Auch den Verzeichniseintrag sichern, sonst kann das rename nach einem Absturz fehlen
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def atomic_write_json(path, content, indent=4):
+    atomic_write(path, json.dumps(content, indent=indent, ensure_ascii=False).encode('utf-8'))
+
+def empty_data():
+    return {"customers": {}, "invoices": {}, "logs": [], "tickets": {}, "jobs": {}, "transcripts": {}}
+
+class GuildStore:
+    """Konfiguration und Daten pro Server, beim ersten Zugriff geladen und danach gecacht.
+
+    Jeder Server hat ein eigenes Verzeichnis mit config.json und data.json.
+    Beim Speichern wird nur die Datei des betroffenen Servers neu geschrieben.
+
+    save_data/save_config merken die Datei nur vor. Ein Schreib-Task pro Server serialisiert
+    auf der Event-Loop (konsistenter Stand) und schreibt samt fsync in einem Worker-Thread;
+    was währenddessen gespeichert wird, nimmt der nächste Durchlauf gesammelt mit.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._configs = {}
+        self._data = {}
+        # Zählt Speichervorgänge pro Server, damit Sicherungen unveränderte Server überspringen
+        self.generations = {}
+        # Änderungszähler pro (Server, Bereich), daraus entstehen die ETags der JSON-API
+        self.collection_versions = {}
+        # Für /health und /ready: letzter erfolgreicher und letzter fehlgeschlagener Schreibvorgang
+        self.last_saved_at = None
+        self.last_save_error = None
+        self._legacy_warned = False
+        # Server -> vorgemerkte Dateinamen bzw. laufender Schreib-Task
+        self._dirty = {}
+        self._writers = {}
+
+    def _path(self, guild_id, filename):
+        return os.path.join(self.base_dir, str(guild_id), filename)
+
+    def _read(self, path, default):
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return default
+
+    def _encode(self, content):
+        return json.dumps(content, indent=4, ensure_ascii=False).encode('utf-8')
+
+    def _write(self, guild_id, filename, content):
+        """Schreibt bereits serialisierte Daten; blockiert und läuft deshalb im Worker-Thread"""
+        try:
+            os.makedirs(os.path.join(self.base_dir, str(guild_id)), exist_ok=True)
+            atomic_write(self._path(guild_id, filename), content)
+        except Exception as e:
+            self.last_save_error = (time.time(), f"{guild_id}/{filename}: {e}")
+            raise
+        self.last_saved_at = time.time()
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
+
+    def _load(self, guild_id):
+        self._check_legacy(guild_id)
+
+        self._configs[guild_id] = {**DEFAULT_CONFIG, **self._read(self._path(guild_id, "config.json"), {})}
+        guild_data = self._read(self._path(guild_id, "data.json"), None)
+        if guild_data is None:
+            logger.info(f"Keine Daten für Server {guild_id} gefunden, erstelle neue Datenstruktur")
+            guild_data = empty_data()
+        else:
+            logger.info(f"Daten für Server {guild_id} erfolgreich geladen")
+            # Ältere Datenstände um später hinzugekommene Bereiche ergänzen
+            for key, default in empty_data().items():
+                guild_data.setdefault(key, default)
+        self._data[guild_id] = guild_data
+
+    def _check_legacy(self, guild_id):
+        """Übernimmt die alten globalen Dateien, aber nur für den ausdrücklich genannten Server"""
+        if not (os.path.exists(DATA_FILE) or os.path.exists(CONFIG_FILE)):
+            return
+        if LEGACY_GUILD_ID is None:
+            if not self._legacy_warned:
+                self._legacy_warned = True
+                logger.warning(
+                    f"Altbestand {DATA_FILE}/{CONFIG_FILE} gefunden, aber LEGACY_GUILD_ID ist nicht gesetzt – "
+                    f"er wird keinem Server zugeordnet"
+                )
+            return
+        if guild_id != LEGACY_GUILD_ID:
+            return
+        if os.path.exists(self._path(guild_id, "data.json")) or os.path.exists(self._path(guild_id, "config.json")):
+            if not self._legacy_warned:
+                self._legacy_warned = True
+                logger.error(f"Server {guild_id} hat bereits eigene Daten, Altbestand {DATA_FILE}/{CONFIG_FILE} wird nicht übernommen")
+            return
+        for legacy_file, filename in ((CONFIG_FILE, "config.json"), (DATA_FILE, "data.json")):
+            if os.path.exists(legacy_file):
+                self._write(guild_id, filename, self._encode(self._read(legacy_file, None)))
+                os.replace(legacy_file, legacy_file + ".migrated")
+        logger.warning(f"Altbestand aus {DATA_FILE}/{CONFIG_FILE} wurde Server {guild_id} (LEGACY_GUILD_ID) zugeordnet")
+
+    def config(self, guild_id):
+        if guild_id not in self._configs:
+            self._load(guild_id)
+        return self._configs[guild_id]
+
+    def data(self, guild_id):
+        if guild_id not in self._data:
+            self._load(guild_id)
+        return self._data[guild_id]
+
+    def _contents(self, guild_id, filename):
+        return self._configs[guild_id] if filename == "config.json" else self._data[guild_id]
+
+    def _schedule(self, guild_id, filename):
+        self._dirty.setdefault(guild_id, set()).add(filename)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Ohne Event-Loop (z.B. in Skripten) sofort schreiben
+            for filename in self._dirty.pop(guild_id):
+                self._write(guild_id, filename, self._encode(self._contents(guild_id, filename)))
+            return
+        writer = self._writers.get(guild_id)
+        if writer is None or writer.done():
+            self._writers[guild_id] = loop.create_task(self._writer(guild_id))
+
+    async def _writer(self, guild_id):
+        # Alles, was im selben Durchlauf der Event-Loop gespeichert wird, gemeinsam schreiben
+        await asyncio.sleep(0)
+        while self._dirty.get(guild_id):
+            filenames = self._dirty.pop(guild_id)
+            contents = {filename: self._encode(self._contents(guild_id, filename)) for filename in filenames}
+            try:
+                await asyncio.to_thread(self._write_all, guild_id, contents)
+            except Exception as e:
+                logger.error(f"Daten für Server {guild_id} konnten nicht gespeichert werden, neuer Versuch in {SAVE_RETRY_DELAY}s: {e}")
+                for filename in filenames:
+                    self._dirty.setdefault(guild_id, set()).add(filename)
+                await asyncio.sleep(SAVE_RETRY_DELAY)
+
+    def _write_all(self, guild_id, contents):
+        for filename, content in contents.items():
+            self._write(guild_id, filename, content)
+        logger.info(f"Daten für Server {guild_id} erfolgreich gespeichert")
+
+    def save_config(self, guild_id):
+        self._schedule(guild_id, "config.json")
+
+    def save_data(self, guild_id):
+        self._schedule(guild_id, "data.json")
+
+    async def saved(self, guild_id):
+        """Wartet, bis alles Vorgemerkte des Servers auf der Platte ist"""
+        while (writer := self._writers.get(guild_id)) is not None and not writer.done():
+            await asyncio.shield(writer)
+
+    def changed(self, guild_id, *collections):
+        for collection in collections:
+            key = (guild_id, collection)
+            self.collection_versions[key] = self.collection_versions.get(key, 0) + 1
+
+    def collection_version(self, guild_id, collection):
+        return self.collection_versions.get((guild_id, collection), 0)
+
+    async def flush(self):
+        """Schreibt alle geladenen Server noch einmal, z.B. beim Herunterfahren"""
+        for guild_id in list(self._data):
+            self.save_data(guild_id)
+        for guild_id in list(self._configs):
+            self.save_config(guild_id)
+        for guild_id in list(self._writers):
+            await self.saved(guild_id)
+
+    def replace(self, guild_id, config, data):
+        """Übernimmt einen wiederhergestellten Stand, der bereits auf der Platte liegt"""
+        self._configs[guild_id] = {**DEFAULT_CONFIG, **config}
+        for key, default in empty_data().items():
+            data.setdefault(key, default)
+        self._data[guild_id] = data
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
+        self.changed(guild_id, "customers", "invoices")
+
+guild_store = GuildStore(DATA_DIR)
+
+def get_config(guild_id):
+    return guild_store.config(guild_id)
+
+def get_data(guild_id):
+    return guild_store.data(guild_id)
+
+def save_config(guild_id):
+    guild_store.save_config(guild_id)
+
+def save_data(guild_id):
+    guild_store.save_data(guild_id)
+
+class LeaseStore:
+    """Leases im gemeinsamen Datenverzeichnis, damit mehrere Prozesse keine Arbeit doppelt ausführen.
+
+    Eine neue Lease wird vollständig in eine temporäre Datei geschrieben und per os.link
+    an ihren Platz gebracht, sie erscheint also nie leer oder halb geschrieben. Übernehmen,
+    Freigeben und Aufräumen ändern bestehende Leases nur unter einer flock-Sperre auf das
+    Verzeichnis, damit nicht zwei Prozesse dieselbe abgelaufene Lease übernehmen.
+    """
+
+    def __init__(self, base_dir, owner):
+        self.base_dir = base_dir
+        self.owner = owner
+
+    def _path(self, key):
+        return os.path.join(self.base_dir, f"{key}.lease")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        with open(os.path.join(self.base_dir, ".lock"), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
 
-config = load_config()
+    def _current(self, path):
+        """Inhalt der Lease oder None, wenn es keine gibt"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Leases erscheinen nur vollständig; eine unlesbare Datei ist kaputt und gilt als abgelaufen
+            return {"owner": None, "expires_at": 0}
+
+    def _write_temp(self, path, ttl):
+        temp_path = f"{path}.{secrets.token_hex(8)}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"owner": self.owner, "expires_at": time.time() + ttl}, f)
+        return temp_path
+
+    def acquire(self, key, ttl):
+        os.makedirs(self.base_dir, exist_ok=True)
+        path = self._path(key)
+        temp_path = self._write_temp(path, ttl)
+        try:
+            try:
+                os.link(temp_path, path)
+                return True
+            except FileExistsError:
+                pass
+            with self._locked():
+                current = self._current(path)
+                if current is not None and current.get("expires_at", 0) > time.time():
+                    return False
+                # Unter der Sperre ersetzt os.replace atomar genau die gelesene Lease
+                os.replace(temp_path, path)
+                return True
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def purge_expired(self):
+        """Entfernt abgelaufene Leases, damit das Verzeichnis nicht unbegrenzt wächst"""
+        if not os.path.isdir(self.base_dir):
+            return
+        with self._locked():
+            now = time.time()
+            for filename in os.listdir(self.base_dir):
+                if not filename.endswith(".lease"):
+                    continue
+                path = os.path.join(self.base_dir, filename)
+                try:
+                    current = self._current(path)
+                    if current is not None and current.get("expires_at", 0) <= now:
+                        os.remove(path)
+                except (OSError, ValueError):
+                    continue
 
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            logger.info("Daten erfolgreich geladen")
-            return json.load(f)
-    logger.warning("Keine Datendatei gefunden, erstelle neue Datenstruktur")
-    return {"customers": {}, "invoices": {}, "logs": []}
+    def release(self, key):
+        """Gibt die Lease frei, aber nur, solange sie noch diesem Prozess gehört"""
+        path = self._path(key)
+        with self._locked():
+            current = self._current(path)
+            if current is not None and current.get("owner") == self.owner:
+                os.remove(path)
 
-def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-    logger.info("Daten erfolgreich gespeichert")
+lease_store = LeaseStore(os.path.join(DATA_DIR, "leases"), f"{socket.gethostname()}:{os.getpid()}")
 
 def generate_customer_id():
     """Generiert eine komplexe Kunden-ID"""
     prefix = "VN"
-    year = datetime.now().strftime("%y")
+    year = clock.now().strftime("%y")
     random_part = ''.join(random.choices(string.digits, k=6))
     return f"{prefix}-{year}{random_part}"
 
-def generate_invoice_id():
-    """Generiert eine komplexe Rechnungs-ID"""
+# Rechnungs-IDs, die gerade ausgestellt werden, aber noch nicht in den Daten stehen
+_reserved_invoice_ids = set()
+
+def generate_invoice_id(existing):
+    """Generiert eine komplexe Rechnungs-ID, die weder vergeben noch gerade in Ausstellung ist.
+    Der Aufrufer gibt sie mit release_invoice_id wieder frei, sobald die Rechnung gespeichert ist."""
     prefix = "RE"
-    year = datetime.now().strftime("%y")
-    month = datetime.now().strftime("%m")
-    random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    return f"{prefix}-{year}{month}-{random_part}"
+    year = clock.now().strftime("%y")
+    month = clock.now().strftime("%m")
+    while True:
+        random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
+        invoice_id = f"{prefix}-{year}{month}-{random_part}"
+        if invoice_id not in existing and invoice_id not in _reserved_invoice_ids:
+            _reserved_invoice_ids.add(invoice_id)
+            return invoice_id
+
+def release_invoice_id(invoice_id):
+    _reserved_invoice_ids.discard(invoice_id)
 
 async def send_to_log_channel(guild, embed):
-    """Sendet eine Nachricht in den Log-Channel"""
-    if config["log_channel_id"]:
-        try:
-            log_channel = guild.get_channel(config["log_channel_id"])
-            if log_channel:
-                await log_channel.send(embed=embed)
-                logger.info(f"Log an Channel {config['log_channel_id']} gesendet")
-        except Exception as e:
-            logger.error(f"Fehler beim Senden an Log-Channel: {e}")
-
-def add_log_entry(action, user_id, details):
-    """Fügt einen Log-Eintrag hinzu"""
+    """Stellt eine Nachricht für den Log-Channel des Servers ein, ohne auf Discord zu warten"""
+    log_channel_id = get_config(guild.id)["log_channel_id"]
+    if log_channel_id:
+        log_channel = guild.get_channel(log_channel_id)
+        if log_channel:
+            outbound.submit(PRIORITY_LOG, log_channel.send(embed=embed), f"Log an Channel {log_channel_id}")
+
+def add_log_entry(guild_id, action, user_id, details):
+    """Fügt einen Log-Eintrag zum Server hinzu"""
     log_entry = {
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": clock.now().isoformat(),
         "action": action,
         "user_id": user_id,
         "details": details
     }
-    data['logs'].append(log_entry)
-    save_data(data)
+    logs = get_data(guild_id)['logs']
+    logs.append(log_entry)
+    save_data(guild_id)
+    search_index.log_added(guild_id, len(logs) - 1, log_entry)
     logger.info(f"Log erstellt: {action} von User {user_id}")
 
-data = load_data()
+# Idempotenz für schreibende Commands
+# Doppelklicks und Client-Wiederholungen mit denselben Argumenten liefern innerhalb des
+# Zeitfensters das ursprüngliche Ergebnis, statt eine zweite Rechnung/Akte/Ticket anzulegen.
+IDEMPOTENCY_TTL = 60
+IDEMPOTENCY_MAX_ENTRIES = 2048
+
+class IdempotencyCache:
+    """Begrenzter LRU-Cache mit Ablaufzeit für die Ergebnisse schreibender Commands"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, now):
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    async def run(self, key, func):
+        """Führt func einmal pro Schlüssel aus; Wiederholungen warten auf dasselbe Ergebnis"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return await asyncio.shield(entry[1])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (now + self.ttl, future)
+        self._entries.move_to_end(key)
+        self._evict(now)
+
+        try:
+            result = await func()
+        except BaseException as e:
+            self._discard(key, future)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # als abgerufen markieren, falls niemand wartet
+            raise
+
+        # Fehler-Ergebnisse werden nicht gemerkt, damit ein erneuter Versuch möglich ist
+        if isinstance(result, discord.Embed) and result.color and result.color.value == COLOR_ERROR:
+            self._discard(key, future)
+        future.set_result(result)
+        return result
+
+    def _discard(self, key, future):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is future:
+            del self._entries[key]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_TTL)
+
+def _normalize_argument(value):
+    if hasattr(value, 'id'):
+        return value.id
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+def idempotency_key(interaction, command, *args):
+    """(Server, User, Command, normalisierte Argumente)"""
+    return (interaction.guild_id, interaction.user.id, command) + tuple(_normalize_argument(a) for a in args)
+
+# Mitglieder auflösen
+# Ohne vollständigen Member-Cache liefert guild.get_member oft None. Fehlende Mitglieder einer
+# Log-Seite oder eines Mahnlaufs werden deshalb gesammelt und in Blöcken zu 100 über das Gateway
+# abgefragt. Ergebnisse, auch "nicht mehr auf dem Server", bleiben MEMBER_CACHE_TTL Sekunden gültig.
+MEMBER_CACHE_TTL = int(os.environ.get('MEMBER_CACHE_TTL', 15 * 60))
+MEMBER_CACHE_MAX_ENTRIES = int(os.environ.get('MEMBER_CACHE_MAX_ENTRIES', 5000))
+# Discord erlaubt maximal 100 User-IDs pro Request Guild Members
+MEMBER_QUERY_CHUNK = 100
+
+class MemberResolver:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # (Server, User) -> (Ablaufzeit, Member oder None)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.queries = 0
+        self.failed_queries = 0
+
+    def _cached(self, guild, user_id, now):
+        """(gefunden, Member) aus dem Member-Cache von discord.py oder dem eigenen Cache"""
+        member = guild.get_member(user_id)
+        if member is not None:
+            return True, member
+        entry = self._entries.get((guild.id, user_id))
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end((guild.id, user_id))
+            self.hits += 1
+            return True, entry[1]
+        return False, None
+
+    def _store(self, guild_id, user_id, member, now):
+        self._entries[(guild_id, user_id)] = (now + self.ttl, member)
+        self._entries.move_to_end((guild_id, user_id))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, guild, user_id):
+        """Nur aus den Caches, ohne Gateway-Abfrage (nach resolve für denselben Lauf)"""
+        return self._cached(guild, user_id, time.monotonic())[1]
+
+    async def resolve(self, guild, user_ids):
+        """User-ID -> Member oder None; fehlende werden gesammelt abgefragt"""
+        now = time.monotonic()
+        members = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            if not user_id:
+                continue
+            found, member = self._cached(guild, user_id, now)
+            if found:
+                members[user_id] = member
+            else:
+                missing.append(user_id)
+
+        for start in range(0, len(missing), MEMBER_QUERY_CHUNK):
+            chunk = missing[start:start + MEMBER_QUERY_CHUNK]
+            try:
+                result = await guild.query_members(user_ids=chunk, limit=len(chunk))
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                # Nicht cachen, beim nächsten Aufruf wird es erneut versucht
+                self.failed_queries += 1
+                logger.warning(f"Mitglieder von Server {guild.id} konnten nicht abgefragt werden: {e}")
+                continue
+            self.queries += 1
+            found = {member.id: member for member in result}
+            for user_id in chunk:
+                members[user_id] = found.get(user_id)
+                self._store(guild.id, user_id, found.get(user_id), now)
+        return members
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "queries": self.queries,
+            "failed_queries": self.failed_queries
+        }
+
+member_resolver = MemberResolver(MEMBER_CACHE_MAX_ENTRIES, MEMBER_CACHE_TTL)
+
+# Ausgehende Discord-Requests
+# Alle REST-Requests des Bots laufen durch einen gemeinsamen Scheduler mit Prioritätsklassen.
+# Hintergrundverkehr (Rechnungen, Mahnungen, Akten-Posts, Log-Channel) darf nie alle Plätze
+# belegen, einige bleiben Interaktionen vorbehalten. Pro Route und Channel laufen höchstens
+# OUTBOUND_ROUTE_CONCURRENCY Requests gleichzeitig; nach einem 429 pausiert nur diese Route.
+PRIORITY_INTERACTION, PRIORITY_BILLING, PRIORITY_ARCHIVE, PRIORITY_LOG = range(4)
+OUTBOUND_CLASSES = {
+    PRIORITY_INTERACTION: "interaction",
+    PRIORITY_BILLING: "billing",
+    PRIORITY_ARCHIVE: "archive",
+    PRIORITY_LOG: "log"
+}
+OUTBOUND_CONCURRENCY = int(os.environ.get('OUTBOUND_CONCURRENCY', 8))
+OUTBOUND_RESERVED = int(os.environ.get('OUTBOUND_RESERVED', 2))
+OUTBOUND_ROUTE_CONCURRENCY = int(os.environ.get('OUTBOUND_ROUTE_CONCURRENCY', 2))
+OUTBOUND_MAX_RETRIES = 3
+
+# Alles ohne eigene Klasse (Commands, Buttons, Modals) zählt als Interaktion
+outbound_priority = contextvars.ContextVar('outbound_priority', default=PRIORITY_INTERACTION)
+
+@contextlib.contextmanager
+def outbound_class(priority):
+    token = outbound_priority.set(priority)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+class OutboundScheduler:
+    def __init__(self, concurrency, reserved, route_concurrency):
+        self.concurrency = concurrency
+        self.background_concurrency = max(1, concurrency - reserved)
+        self.route_concurrency = route_concurrency
+        self._active = 0
+        self._background_active = 0
+        self._route_active = {}
+        self._cooldown_until = {}
+        # Heap aus (Priorität, Reihenfolge, Route, Future)
+        self._waiting = []
+        self._seq = itertools.count()
+        self._background = set()
+        self._stats = {
+            priority: {"queued": 0, "sent": 0, "wait_total": 0.0, "wait_max": 0.0, "rate_limited": 0}
+            for priority in OUTBOUND_CLASSES
+        }
+
+    def _can_start(self, priority, route_key, now):
+        if self._active >= self.concurrency:
+            return False
+        if priority != PRIORITY_INTERACTION and self._background_active >= self.background_concurrency:
+            return False
+        if self._route_active.get(route_key, 0) >= self.route_concurrency:
+            return False
+        return self._cooldown_until.get(route_key, 0) <= now
+
+    def _start(self, priority, route_key):
+        self._active += 1
+        if priority != PRIORITY_INTERACTION:
+            self._background_active += 1
+        self._route_active[route_key] = self._route_active.get(route_key, 0) + 1
+
+    def _release(self, priority, route_key):
+        self._active -= 1
+        if priority != PRIORITY_INTERACTION:
+            self._background_active -= 1
+        self._route_active[route_key] -= 1
+        if not self._route_active[route_key]:
+            del self._route_active[route_key]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Vergibt freie Plätze nach Priorität; Wartende auf belegten oder pausierten Routen bleiben liegen"""
+        now = time.monotonic()
+        blocked = []
+        while self._waiting and self._active < self.concurrency:
+            entry = heapq.heappop(self._waiting)
+            priority, _, route_key, future = entry
+            if future.done():
+                continue
+            if self._can_start(priority, route_key, now):
+                self._start(priority, route_key)
+                future.set_result(None)
+            else:
+                blocked.append(entry)
+        for entry in blocked:
+            heapq.heappush(self._waiting, entry)
+
+    def _cool_down(self, route_key, delay):
+        self._cooldown_until[route_key] = max(self._cooldown_until.get(route_key, 0), time.monotonic() + delay)
+        asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    async def _acquire(self, priority, route_key):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), route_key, future))
+        stats = self._stats[priority]
+        stats["queued"] += 1
+        try:
+            self._dispatch()
+            await future
+        except asyncio.CancelledError:
+            # Platz wurde schon vergeben, der Request läuft aber nicht mehr
+            if future.done() and not future.cancelled():
+                self._release(priority, route_key)
+            raise
+        finally:
+            stats["queued"] -= 1
+
+    async def run(self, route_key, request):
+        """Führt request() aus, sobald die Klasse des aktuellen Kontexts an der Reihe ist"""
+        priority = outbound_priority.get()
+        stats = self._stats[priority]
+        for attempt in itertools.count():
+            queued_at = time.monotonic()
+            await self._acquire(priority, route_key)
+            waited = time.monotonic() - queued_at
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+            try:
+                result = await request()
+                stats["sent"] += 1
+                return result
+            except (discord.RateLimited, discord.HTTPException) as e:
+                if isinstance(e, discord.HTTPException) and e.status != 429 or attempt >= OUTBOUND_MAX_RETRIES:
+                    raise
+                retry_after = getattr(e, 'retry_after', None) or 2 ** attempt
+                stats["rate_limited"] += 1
+                self._cool_down(route_key, retry_after)
+                logger.warning(f"Rate-Limit auf {route_key[0]}, {OUTBOUND_CLASSES[priority]} pausiert {retry_after:.1f}s")
+            finally:
+                self._release(priority, route_key)
+
+    def submit(self, priority, coro, name):
+        """Hintergrund-Post, auf den der Aufrufer nicht wartet (Log-Channel, Kundenakte)"""
+        async def runner():
+            with outbound_class(priority):
+                try:
+                    await coro
+                    logger.info(f"{name} gesendet")
+                except Exception as e:
+                    logger.error(f"{name} fehlgeschlagen: {e}", exc_info=True)
+
+        task = asyncio.create_task(runner())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def drain(self):
+        # Nach fertigen Tasks fragen: das Entfernen aus _background passiert erst im Done-Callback
+        while True:
+            pending = [task for task in self._background if not task.done()]
+            if not pending:
+                return
+            await asyncio.wait(pending)
+
+    def stats(self):
+        classes = {}
+        for priority, name in OUTBOUND_CLASSES.items():
+            stats = self._stats[priority]
+            started = stats["sent"] + stats["rate_limited"]
+            classes[name] = {
+                "queued": stats["queued"],
+                "sent": stats["sent"],
+                "rate_limited": stats["rate_limited"],
+                "wait_avg_ms": round(stats["wait_total"] / started * 1000, 1) if started else 0.0,
+                "wait_max_ms": round(stats["wait_max"] * 1000, 1)
+            }
+        return {
+            "active": self._active,
+            "background_active": self._background_active,
+            "background_tasks": len(self._background),
+            "routes_paused": sum(1 for until in self._cooldown_until.values() if until > time.monotonic()),
+            "classes": classes
+        }
+
+outbound = OutboundScheduler(OUTBOUND_CONCURRENCY, OUTBOUND_RESERVED, OUTBOUND_ROUTE_CONCURRENCY)
 
-# Versicherungstypen mit Preisen und zugehörigen Rollen
-INSURANCE_TYPES = {
+def install_outbound(http):
+    """Leitet HTTPClient.request von discord.py durch den Scheduler"""
+    request = http.request
+
+    async def scheduled_request(route, **kwargs):
+        return await outbound.run((route.key, route.major_parameters), lambda: request(route, **kwargs))
+
+    http.request = scheduled_request
+
+install_outbound(bot.http)
+
+# Drosselung
+# Token-Buckets pro User und pro Server, getrennt nach Command-Klasse. Teure Aktionen
+# (Channels, Threads, Exporte) haben eigene, engere Buckets. Ein Bucket, der wieder voll
+# ist, unterscheidet sich nicht von einem neuen und wird deshalb verworfen.
+RATE_LIMIT_CLASSES = {
+    # Klasse: (Aufrufe pro User, Aufrufe pro Server, Zeitraum in Sekunden)
+    "default": (10, 60, 30),
+    "setup": (2, 4, 300),
+    "channel": (2, 10, 120),
+    "thread": (3, 15, 120),
+    "export": (2, 6, 60),
+}
+COMMAND_RATE_CLASSES = {
+    "kundenakte_erstellen": "thread",
+    "ticket_erstellen": "channel",
+    "ticket_setup": "setup",
+    "logs_anzeigen": "export",
+    "kontoauszug": "export",
+    "transkripte_anzeigen": "export",
+}
+# Eigene Limits pro Command, z.B. RATE_LIMITS='{"rechnung_ausstellen": [5, 30, 60]}'
+COMMAND_RATE_LIMITS = {
+    command: tuple(limits) for command, limits in json.loads(os.environ.get('RATE_LIMITS', '{}')).items()
+}
+RATE_LIMIT_SWEEP_INTERVAL = 60
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity, period, now):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self):
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    """Prüft pro Aufruf den Bucket des Users und den des Servers für die Command-Klasse"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+        self.throttled = 0
+
+    def limits_for(self, command):
+        if command in COMMAND_RATE_LIMITS:
+            return command, COMMAND_RATE_LIMITS[command]
+        rate_class = COMMAND_RATE_CLASSES.get(command, "default")
+        return rate_class, RATE_LIMIT_CLASSES[rate_class]
+
+    def _bucket(self, key, capacity, period, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(capacity, period, now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def acquire(self, guild_id, user_id, command):
+        """Verbraucht ein Token; gibt 0 oder die Wartezeit in Sekunden zurück"""
+        now = time.monotonic()
+        if now - self._last_sweep >= RATE_LIMIT_SWEEP_INTERVAL:
+            self._sweep(now)
+
+        rate_class, (per_user, per_guild, period) = self.limits_for(command)
+        buckets = [self._bucket(("user", guild_id, user_id, rate_class), per_user, period, now)]
+        if guild_id is not None:
+            buckets.append(self._bucket(("guild", guild_id, rate_class), per_guild, period, now))
+
+        retry_after = max(bucket.wait_time() for bucket in buckets)
+        if retry_after > 0:
+            self.throttled += 1
+            return retry_after
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return 0.0
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[key]
+
+    def stats(self):
+        return {"buckets": len(self._buckets), "throttled": self.throttled}
+
+rate_limiter = RateLimiter()
+
+async def check_rate_limit(interaction: discord.Interaction, command):
+    """Gibt False zurück und antwortet mit einem Hinweis, wenn der Bucket leer ist"""
+    retry_after = rate_limiter.acquire(interaction.guild_id, interaction.user.id, command)
+    if not retry_after:
+        return True
+
+    logger.info(f"User {interaction.user.id} gedrosselt bei {command} ({retry_after:.0f}s)")
+    wait_embed = discord.Embed(
+        title="Bitte kurz warten",
+        description=(
+            f"Sie haben diese Aktion zu oft in kurzer Zeit ausgeführt. "
+            f"Bitte versuchen Sie es in {math.ceil(retry_after)} Sekunden erneut."
+        ),
+        color=COLOR_WARNING
+    )
+    if interaction.response.is_done():
+        await interaction.followup.send(embed=wait_embed, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=wait_embed, ephemeral=True)
+    return False
+
+# Formatierung
+# Beträge und Zeitangaben für Embeds, Auswahlmenüs und Protokolle an einer Stelle
+def format_eur(amount):
+    return f"{amount:,.2f} €"
+
+def format_date(value):
+    return value.strftime('%d.%m.%Y')
+
+def format_datetime(value, seconds=True):
+    return value.strftime('%d.%m.%Y, %H:%M:%S Uhr' if seconds else '%d.%m.%Y, %H:%M Uhr')
+
+def format_timestamp(value, seconds=True):
+    """Kurzform für Listen- und Protokollzeilen"""
+    return value.strftime('%d.%m.%Y • %H:%M:%S' if seconds else '%d.%m.%Y • %H:%M')
+
+# Tarifkatalog
+# Preise und Rollen stehen in einer Datei mit datierten Preisversionen. Rechnungen werden mit
+# der Version bepreist, die am Rechnungsdatum gilt. Bereits gültige Versionen sollten nicht
+# mehr geändert werden; neue Preise kommen als neue Version mit eigenem Stichtag dazu.
+TARIFF_FILE = os.path.join(DATA_DIR, "tariffs.json")
+# Discord erlaubt maximal 25 Optionen pro Auswahlmenü
+TARIFF_MAX_OPTIONS = 25
+
+# Erste Katalogversion, falls noch keine Datei existiert
+DEFAULT_INSURANCE_TYPES = {
     "Krankenversicherung (Gesetzlich)": {"price": 3000.00, "role": "Krankenversicherung"},
     "Krankenversicherung (Privat)": {"price": 5000.00, "role": "Krankenversicherung"},
     "Haftpflichtversicherung": {"price": 3000.00, "role": "Haftpflichtversicherung"},
@@ -106,6 +1015,93 @@ INSURANCE_TYPES = {
     "Berufsunfähigkeitsversicherung": {"price": 6000.00, "role": "Berufsunfähigkeitsversicherung"}
 }
 
+class TariffVersion:
+    """Eine Preisversion; die Optionen für das Auswahlmenü werden einmal pro Version angelegt"""
+
+    def __init__(self, version, effective_from, tariffs):
+        self.version = version
+        self.effective_from = effective_from
+        self.tariffs = tariffs
+        # Tarife mit "available": false werden noch abgerechnet, aber nicht mehr angeboten
+        self.select_options = tuple(
+            discord.SelectOption(label=name, description=f"Monatsbeitrag: {format_eur(tariff['price'])}", value=name)
+            for name, tariff in tariffs.items() if tariff.get('available', True)
+        )
+
+    def price(self, name):
+        return self.tariffs[name]['price']
+
+    def total(self, names):
+        return sum(self.price(name) for name in names)
+
+class TariffCatalog:
+    """Alle Preisversionen aus TARIFF_FILE, sortiert nach Stichtag"""
+
+    def __init__(self, path):
+        self.path = path
+        self._versions = None
+
+    @property
+    def versions(self):
+        if self._versions is None:
+            self._versions = self._read()
+        return self._versions
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            default = {"versions": [{"version": 1, "effective_from": "2000-01-01", "tariffs": DEFAULT_INSURANCE_TYPES}]}
+            atomic_write_json(self.path, default)
+            logger.info(f"Tarifkatalog mit Standardtarifen angelegt: {self.path}")
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+
+        versions = []
+        for entry in raw.get('versions', []):
+            tariffs = entry['tariffs']
+            for name, tariff in tariffs.items():
+                if not isinstance(tariff.get('price'), (int, float)) or tariff['price'] < 0 or not tariff.get('role'):
+                    raise ValueError(f"Tarif '{name}' in Version {entry['version']} braucht einen Preis >= 0 und eine Rolle")
+            version = TariffVersion(int(entry['version']), datetime.fromisoformat(entry['effective_from']), tariffs)
+            if len(version.select_options) > TARIFF_MAX_OPTIONS:
+                raise ValueError(f"Version {version.version} bietet mehr als {TARIFF_MAX_OPTIONS} Tarife an")
+            versions.append(version)
+
+        if not versions:
+            raise ValueError("Der Tarifkatalog enthält keine Version")
+        if len({v.version for v in versions}) != len(versions):
+            raise ValueError("Versionsnummern im Tarifkatalog sind nicht eindeutig")
+        versions.sort(key=lambda v: v.effective_from)
+
+        # Bestehende Verträge müssen in jeder späteren Version weiter bepreist werden können
+        for previous, current in zip(versions, versions[1:]):
+            missing = set(previous.tariffs) - set(current.tariffs)
+            if missing:
+                raise ValueError(f"Version {current.version} entfernt Tarife: {', '.join(sorted(missing))}")
+        return versions
+
+    def reload(self):
+        """Liest die Datei neu; bei Fehlern bleibt der bisherige Katalog aktiv"""
+        versions = self._read()
+        self._versions = versions
+        return versions
+
+    def at(self, when=None):
+        """Die am Zeitpunkt gültige Version (vor dem ersten Stichtag die erste)"""
+        when = when or clock.now()
+        current = self.versions[0]
+        for version in self.versions:
+            if version.effective_from > when:
+                break
+            current = version
+        return current
+
+    def get(self, number):
+        return next((v for v in self.versions if v.version == number), None)
+
+tariff_catalog = TariffCatalog(TARIFF_FILE)
+
 # Farbschema
 COLOR_PRIMARY = 0x2C3E50
 COLOR_SUCCESS = 0x27AE60
@@ -113,15 +1109,356 @@ COLOR_WARNING = 0xE67E22
 COLOR_ERROR = 0xC0392B
 COLOR_INFO = 0x3498DB
 
+# Embed-Vorlagen
+# Feste Teile (Trennlinien, Abschnittsköpfe, Beschreibungen, Fußzeilen) werden einmal
+# angelegt, kundenbezogene Blöcke pro Kundenakte zwischengespeichert. Jede Vorlage läuft
+# durch fit_embed, das die Discord-Limits an einer Stelle einhält.
+EMBED_MAX_FIELDS = 25
+EMBED_MAX_TITLE = 256
+EMBED_MAX_DESCRIPTION = 4096
+EMBED_MAX_FIELD_NAME = 256
+EMBED_MAX_FIELD_VALUE = 1024
+EMBED_MAX_FOOTER = 2048
+EMBED_MAX_TOTAL = 6000
+
+BLANK = "‎"
+RULE = "─────────────────────────────"
+SECTION_RULE = "━━━━━━━━━━━━━━━━━━━━━━━"
+
+def field(name, value, inline=True):
+    return {"name": name, "value": value, "inline": inline}
+
+def section(title, rule=SECTION_RULE):
+    """Abschnittskopf über die volle Breite"""
+    return field(rule, f"**{title}**", False)
+
+RULE_FIELD = field(BLANK, RULE, False)
+SPACER_FIELD = field(BLANK, BLANK)
+
+def _truncate(text, limit):
+    if text is None or len(text) <= limit:
+        return text
+    return text[:limit - 1] + "…"
+
+def fit_embed(data, template=None):
+    """Kürzt ein Embed-Dict auf die Discord-Limits (Felder, Feldlängen, Gesamtlänge)"""
+    original = (len(data.get('fields', [])), embed_length(data))
+    data['title'] = _truncate(data.get('title'), EMBED_MAX_TITLE)
+    data['description'] = _truncate(data.get('description'), EMBED_MAX_DESCRIPTION)
+    if 'footer' in data:
+        data['footer']['text'] = _truncate(data['footer']['text'], EMBED_MAX_FOOTER)
+    fields = data.get('fields', [])[:EMBED_MAX_FIELDS]
+    for f in fields:
+        f['name'] = _truncate(f['name'], EMBED_MAX_FIELD_NAME)
+        f['value'] = _truncate(f['value'], EMBED_MAX_FIELD_VALUE)
+    data['fields'] = fields
+
+    # Zu lang insgesamt: zuerst hintere Felder weglassen, dann die Beschreibung kürzen
+    while embed_length(data) > EMBED_MAX_TOTAL and fields:
+        fields.pop()
+    overflow = embed_length(data) - EMBED_MAX_TOTAL
+    if overflow > 0 and data['description']:
+        data['description'] = _truncate(data['description'], max(1, len(data['description']) - overflow))
+
+    if (len(fields), embed_length(data)) != original:
+        logger.warning(
+            f"Embed '{template or data.get('title')}' gekürzt: {original[0]} → {len(fields)} Felder, "
+            f"{original[1]} → {embed_length(data)} Zeichen"
+        )
+    return data
+
+def embed_length(data):
+    total = len(data.get('title') or "") + len(data.get('description') or "")
+    total += sum(len(f['name']) + len(f['value']) for f in data.get('fields', []))
+    if 'footer' in data:
+        total += len(data['footer'].get('text') or "")
+    return total
+
+class EmbedTemplate:
+    """Benannte Vorlage: Titel, Farbe, Beschreibung und Fußzeile liegen fest, Felder kommen pro Aufruf"""
+
+    def __init__(self, name, title=None, color=None, description=None, footer=None):
+        self.name = name
+        self.title = title
+        self.color = color
+        self.description = description
+        self.footer = footer
+
+    def render(self, *parts, title=None, color=None, description=None, footer=None, footer_icon=None, timestamp=None):
+        """Teile sind einzelne Feld-Dicts oder Folgen davon (z.B. zwischengespeicherte Blöcke)"""
+        fields = []
+        for part in parts:
+            if isinstance(part, dict):
+                fields.append(dict(part))
+            else:
+                fields.extend(dict(f) for f in part)
+
+        data = {
+            "type": "rich",
+            "title": title or self.title,
+            "description": description or self.description,
+            "fields": fields
+        }
+        footer = footer or self.footer
+        if footer:
+            data['footer'] = {"text": footer}
+            if footer_icon:
+                data['footer']['icon_url'] = footer_icon
+        color = color if color is not None else self.color
+        if color is not None:
+            data['color'] = color
+
+        embed = discord.Embed.from_dict(fit_embed(data, self.name))
+        if timestamp is not None:
+            embed.timestamp = timestamp
+        return embed
+
+class CustomerFragment:
+    """Vorformatierte Blöcke einer Kundenakte"""
+
+    def __init__(self, customer_id, customer):
+        self.source = customer
+        self.holder = (
+            field("Name", customer['rp_name']),
+            field("Kunden-ID", f"`{customer_id}`"),
+            SPACER_FIELD
+        )
+        self.payment = (
+            field("HBpay Nummer", f"`{customer['hbpay_nummer']}`"),
+            field("Economy-ID", f"`{customer['economy_id']}`"),
+            SPACER_FIELD
+        )
+        self._priced_positions = {}
+        self.positions = field(
+            "Versicherte Positionen",
+            "\n".join(f"▸ {ins}" for ins in customer['versicherungen']) or "Keine",
+            False
+        )
+        self.ticket_info = (
+            section("Kundeninformationen"),
+            field("🛡️ Versicherungen", "\n".join(f"▸ {ins}" for ins in customer['versicherungen']), False),
+            field("💰 Monatsbeitrag", f"`{format_eur(customer['total_monthly_price'])}`"),
+            field("💳 HBpay", f"`{customer['hbpay_nummer']}`"),
+            field("🆔 Economy-ID", f"`{customer['economy_id']}`")
+        )
+        self.name = field("Kunde", customer['rp_name'])
+
+    def priced_positions(self, tariffs):
+        """Positionen mit Preisen der angegebenen Tarifversion"""
+        positions = self._priced_positions.get(tariffs.version)
+        if positions is None:
+            positions = self._priced_positions[tariffs.version] = field("Versicherte Positionen", "\n".join(
+                f"▸ {ins}\n   `{format_eur(tariffs.price(ins))}`"
+                for ins in self.source['versicherungen']
+            ), False)
+        return positions
+
+class CustomerFragmentCache:
+    """Blöcke pro (Server, Kunde); verworfen bei invalidate oder wenn die Akte neu geladen wurde"""
+
+    def __init__(self):
+        self._fragments = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild_id, customer_id, customer):
+        key = (guild_id, customer_id)
+        fragment = self._fragments.get(key)
+        if fragment is not None and fragment.source is customer:
+            self.hits += 1
+            return fragment
+        self.misses += 1
+        fragment = self._fragments[key] = CustomerFragment(customer_id, customer)
+        return fragment
+
+    def invalidate(self, guild_id, customer_id=None):
+        if customer_id is not None:
+            self._fragments.pop((guild_id, customer_id), None)
+            return
+        for key in [key for key in self._fragments if key[0] == guild_id]:
+            del self._fragments[key]
+
+    def stats(self):
+        return {"entries": len(self._fragments), "hits": self.hits, "misses": self.misses}
+
+customer_fragments = CustomerFragmentCache()
+
+INVOICE_TEMPLATE = EmbedTemplate("invoice", title="Versicherungsrechnung")
+INVOICE_HOLDER_SECTION = section("Versicherungsnehmer", rule=BLANK)
+INVOICE_PAYMENT_SECTION = section("Zahlungsinformationen", rule=BLANK)
+
+REMINDER_TEMPLATE = EmbedTemplate("reminder")
+REMINDER_LOG_TEMPLATE = EmbedTemplate(
+    "reminder_log",
+    description="Eine Zahlungserinnerung wurde automatisch an den Kunden versendet.",
+    footer="Automatisch generiert • System-ID: 0"
+)
+REMINDER_TITLES = {n: f"⚠️ {n}. Mahnung" for n in range(1, 4)}
+REMINDER_LOG_TITLES = {n: f"📨 {n}. Mahnung versendet" for n in range(1, 4)}
+
+ARCHIVE_TEMPLATE = EmbedTemplate(
+    "archive",
+    title="📦 Archivierte Rechnung",
+    color=COLOR_SUCCESS,
+    description="Diese Rechnung wurde als bezahlt markiert und archiviert."
+)
+ARCHIVE_LOG_TEMPLATE = EmbedTemplate(
+    "archive_log",
+    title="📦 Rechnung archiviert",
+    color=COLOR_SUCCESS,
+    description="Eine Rechnung wurde erfolgreich als bezahlt markiert und archiviert."
+)
+
+TICKET_TEMPLATE = EmbedTemplate(
+    "ticket",
+    title="🎫 Support-Ticket",
+    color=COLOR_INFO,
+    description="**Ein neues Kundenkontakt-Ticket wurde eröffnet**\n\nWillkommen! Dieses Ticket wurde erstellt, um eine professionelle Kommunikation zwischen Mitarbeiter und Versicherungsnehmer zu ermöglichen.",
+    footer="Support-System • Nutzen Sie den Button unten, um dieses Ticket zu schließen"
+)
+
+TICKET_STATUS_FIELD = field("📊 Status", "🟢 Offen")
+TICKET_PRIORITY_FIELD = field("🔢 Priorität", "Normal")
+
+LOG_TEMPLATE = EmbedTemplate("log")
+REPLY_TEMPLATE = EmbedTemplate("reply", color=COLOR_SUCCESS)
+CONFIG_LOG_TEMPLATE = EmbedTemplate("config_log", title="⚙️ System-Konfiguration", color=COLOR_INFO)
+CUSTOMER_FILE_TEMPLATE = EmbedTemplate("customer_file", title="Versicherungsakte", color=COLOR_PRIMARY)
+ACTIVITY_LOG_TEMPLATE = EmbedTemplate("activity_log", title="📊 System-Aktivitätsprotokoll", color=COLOR_PRIMARY)
+TICKET_PANEL_TEMPLATE = EmbedTemplate(
+    "ticket_panel",
+    color=COLOR_PRIMARY,
+    footer="Versicherungs-Management-System v2.0 • Datenschutzkonform & DSGVO-konform"
+)
+STATEMENT_TEMPLATE = EmbedTemplate("statement", title="📒 Kontoauszug", color=COLOR_INFO)
+
+SECTIONS = {title: section(title) for title in (
+    "Rechnungsdetails", "Mahnungsdetails", "Zahlungsinformationen", "Finanzielle Informationen",
+    "Zusatzinformationen", "Ticket-Informationen", "Beteiligte Personen", "Anlass der Kontaktaufnahme",
+    "Kontostand", "Rechnungsverlauf", "Setup-Informationen"
+)}
+
+# Start-Zeitpunkt für die Messung der Zeit bis zur Bereitschaft
+STARTED_AT = time.monotonic()
+COMMAND_SYNC_FILE = os.path.join(DATA_DIR, "command_sync.json")
+
+def command_tree_fingerprint():
+    """Stabiler Hash über Namen, Beschreibungen und Parameter aller Slash Commands"""
+    payload = sorted((cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands()), key=lambda c: c['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+async def sync_command_tree():
+    """Synchronisiert die Slash Commands nur, wenn sich der Command-Tree geändert hat"""
+    fingerprint = command_tree_fingerprint()
+    state = {}
+    if os.path.exists(COMMAND_SYNC_FILE):
+        with open(COMMAND_SYNC_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+
+    if (
+        os.environ.get('FORCE_COMMAND_SYNC') != '1'
+        and state.get('fingerprint') == fingerprint
+        and state.get('application_id') == bot.application_id
+    ):
+        logger.info('Command-Tree unverändert, Synchronisierung übersprungen')
+        return
+
+    synced = await bot.tree.sync()
+    os.makedirs(DATA_DIR, exist_ok=True)
+    atomic_write_json(COMMAND_SYNC_FILE, {
+        "fingerprint": fingerprint,
+        "application_id": bot.application_id,
+        "synced_at": clock.now().isoformat()
+    })
+    logger.info(f'{len(synced)} Slash Commands synchronisiert')
+
 @bot.event
-async def on_ready():
-    logger.info(f'{bot.user} erfolgreich gestartet')
+async def setup_hook():
+    """Läuft genau einmal nach dem Login, nicht bei jedem Reconnect"""
     try:
-        synced = await bot.tree.sync()
-        logger.info(f'{len(synced)} Slash Commands synchronisiert')
-        check_invoices.start()  # Mahnung-System starten
+        await sync_command_tree()
     except Exception as e:
-        logger.error(f'Fehler beim Synchronisieren der Commands: {e}')
+        logger.error(f'Fehler beim Synchronisieren der Commands: {e}', exc_info=True)
+    bot.add_dynamic_items(InsuranceSelect, InsuranceConfirmButton)
+    # Persistente Views, damit bestehende Ticket-Panels und Close-Buttons nach Neustarts funktionieren
+    bot.add_view(TicketView())
+    bot.add_view(TicketCloseView())
+    shutdown_coordinator.install()
+    loop_watchdog.start()
+    check_invoices.start()  # Mahnung-System starten
+    job_scheduler.start()
+    backup_guilds.start()
+
+_ready_logged = False
+
+@bot.event
+async def on_ready():
+    global _ready_logged
+    if _ready_logged:
+        logger.info(f'{bot.user} erneut verbunden')
+        return
+    _ready_logged = True
+    logger.info(f'{bot.user} erfolgreich gestartet (bereit nach {time.monotonic() - STARTED_AT:.2f}s)')
+
+    # Suchindex im Hintergrund aufbauen, danach wird er laufend ergänzt
+    for guild in local_guilds():
+        asyncio.create_task(search_index.ensure(guild.id))
+
+    # Abrechnungszyklen, deren Job verloren ging (z.B. endgültig fehlgeschlagen), neu planen
+    for guild in local_guilds():
+        schedule_all_billing(guild.id)
+
+async def tree_interaction_check(interaction: discord.Interaction):
+    """Setzt den Log-Kontext und prüft die Drosselung, bevor ein Slash Command ausgeführt wird"""
+    interaction.extras['started_at'] = time.perf_counter()
+    log_context.set({
+        "command": interaction.command.name if interaction.command else None,
+        "user_id": interaction.user.id,
+        "guild_id": interaction.guild_id
+    })
+    if interaction.command is None:
+        return True
+    if await shutdown_coordinator.reject(interaction, f"/{interaction.command.name}"):
+        return False
+    return await check_rate_limit(interaction, interaction.command.name)
+
+bot.tree.interaction_check = tree_interaction_check
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    started_at = interaction.extras.get('started_at')
+    duration_ms = round((time.perf_counter() - started_at) * 1000, 1) if started_at else None
+    logger.info(
+        f"Command /{command.name} von User {interaction.user.id} in {duration_ms} ms abgeschlossen",
+        extra={"command": command.name, "user_id": interaction.user.id, "guild_id": interaction.guild_id, "duration_ms": duration_ms}
+    )
+
+# Log-Level zur Laufzeit ändern
+@bot.tree.command(name="log_level_setzen", description="Ändert das Log-Level des Bots zur Laufzeit")
+@app_commands.describe(level="Neues Log-Level")
+@app_commands.choices(level=[
+    app_commands.Choice(name=name, value=name) for name in ("DEBUG", "INFO", "WARNING", "ERROR")
+])
+async def set_log_level(interaction: discord.Interaction, level: app_commands.Choice[str]):
+    if not interaction.user.guild_permissions.administrator:
+        error_embed = discord.Embed(
+            title="Zugriff verweigert",
+            description="Nur Administratoren können das Log-Level ändern.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    old_level = logging.getLevelName(logging.getLogger().level)
+    logging.getLogger().setLevel(level.value)
+
+    success_embed = discord.Embed(
+        title="Log-Level geändert",
+        description=f"Das Log-Level wurde von `{old_level}` auf `{level.value}` gesetzt.",
+        color=COLOR_SUCCESS
+    )
+    await interaction.response.send_message(embed=success_embed, ephemeral=True)
+    logger.warning(f"Log-Level von {old_level} auf {level.value} gesetzt von User {interaction.user.id}")
 
 # Log-Channel einrichten
 @bot.tree.command(name="log_channel_setzen", description="Setzt den Channel für System-Logs")
@@ -136,31 +1473,38 @@ async def set_log_channel(interaction: discord.Interaction, channel: discord.Tex
         await interaction.response.send_message(embed=error_embed, ephemeral=True)
         return
 
-    config["log_channel_id"] = channel.id
-    save_config(config)
+    await interaction.response.defer(ephemeral=True)
+    embed = await idempotency_cache.run(
+        idempotency_key(interaction, "log_channel_setzen", channel),
+        lambda: apply_log_channel(interaction, channel)
+    )
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+async def apply_log_channel(interaction: discord.Interaction, channel):
+    get_config(interaction.guild_id)["log_channel_id"] = channel.id
+    save_config(interaction.guild_id)
 
     success_embed = discord.Embed(
         title="Log-Channel konfiguriert",
         description=f"Alle System-Logs werden nun in {channel.mention} gesendet.",
         color=COLOR_SUCCESS
     )
-    await interaction.response.send_message(embed=success_embed, ephemeral=True)
 
     # Log
-    log_embed = discord.Embed(
-        title="⚙️ System-Konfiguration",
+    now = clock.now()
+    log_embed = CONFIG_LOG_TEMPLATE.render(
+        field("Aktion", "Log-Channel festgelegt", False),
+        field("Neuer Log-Channel", channel.mention),
+        field("Konfiguriert von", interaction.user.mention),
+        field("Zeitstempel", format_datetime(now)),
         description="Der Log-Channel wurde erfolgreich konfiguriert.",
-        color=COLOR_INFO,
-        timestamp=datetime.now()
+        footer=f"User-ID: {interaction.user.id}",
+        timestamp=now
     )
-    log_embed.add_field(name="Aktion", value="Log-Channel festgelegt", inline=False)
-    log_embed.add_field(name="Neuer Log-Channel", value=channel.mention, inline=True)
-    log_embed.add_field(name="Konfiguriert von", value=interaction.user.mention, inline=True)
-    log_embed.add_field(name="Zeitstempel", value=datetime.now().strftime('%d.%m.%Y, %H:%M:%S Uhr'), inline=True)
-    log_embed.set_footer(text=f"User-ID: {interaction.user.id}")
     await send_to_log_channel(interaction.guild, log_embed)
 
     logger.info(f"Log-Channel auf {channel.id} gesetzt von User {interaction.user.id}")
+    return success_embed
 
 # Firmenkonto setzen
 @bot.tree.command(name="firmenkonto_setzen", description="Setzt das Firmenkonto für Economy-Zahlungen")
@@ -175,91 +1519,243 @@ async def set_company_account(interaction: discord.Interaction, user: discord.Us
         await interaction.response.send_message(embed=error_embed, ephemeral=True)
         return
 
-    config["company_account_id"] = user.id
-    save_config(config)
+    await interaction.response.defer(ephemeral=True)
+    embed = await idempotency_cache.run(
+        idempotency_key(interaction, "firmenkonto_setzen", user),
+        lambda: apply_company_account(interaction, user)
+    )
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+async def apply_company_account(interaction: discord.Interaction, user):
+    get_config(interaction.guild_id)["company_account_id"] = user.id
+    save_config(interaction.guild_id)
 
     success_embed = discord.Embed(
         title="Firmenkonto konfiguriert",
         description=f"Das Firmenkonto wurde auf {user.mention} gesetzt.",
         color=COLOR_SUCCESS
     )
-    await interaction.response.send_message(embed=success_embed, ephemeral=True)
 
     # Log
-    log_embed = discord.Embed(
-        title="⚙️ System-Konfiguration",
+    now = clock.now()
+    log_embed = CONFIG_LOG_TEMPLATE.render(
+        field("Aktion", "Firmenkonto festgelegt", False),
+        field("Neues Firmenkonto", f"{user.mention}\n`{user.id}`"),
+        field("Konfiguriert von", interaction.user.mention),
+        field("Zeitstempel", format_datetime(now)),
         description="Das Firmenkonto wurde erfolgreich konfiguriert.",
-        color=COLOR_INFO,
-        timestamp=datetime.now()
+        footer=f"User-ID: {interaction.user.id}",
+        timestamp=now
     )
-    log_embed.add_field(name="Aktion", value="Firmenkonto festgelegt", inline=False)
-    log_embed.add_field(name="Neues Firmenkonto", value=f"{user.mention}\n`{user.id}`", inline=True)
-    log_embed.add_field(name="Konfiguriert von", value=interaction.user.mention, inline=True)
-    log_embed.add_field(name="Zeitstempel", value=datetime.now().strftime('%d.%m.%Y, %H:%M:%S Uhr'), inline=True)
-    log_embed.set_footer(text=f"User-ID: {interaction.user.id}")
     await send_to_log_channel(interaction.guild, log_embed)
+    return success_embed
+
+# Tarifkatalog neu laden
+@bot.tree.command(name="tarife_neu_laden", description="Lädt den Tarifkatalog zur Laufzeit neu")
+async def reload_tariffs(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        error_embed = discord.Embed(
+            title="Zugriff verweigert",
+            description="Nur Administratoren können den Tarifkatalog neu laden.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    try:
+        versions = tariff_catalog.reload()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"Tarifkatalog konnte nicht geladen werden: {e}")
+        error_embed = discord.Embed(
+            title="Tarifkatalog fehlerhaft",
+            description=f"Der bisherige Katalog bleibt aktiv.\n\n`{e}`",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    current = tariff_catalog.at()
+    upcoming = [v for v in versions if v.effective_from > clock.now()]
+    add_log_entry(
+        interaction.guild_id,
+        "TARIFE_NEU_GELADEN",
+        interaction.user.id,
+        {"version": current.version, "versions": [v.version for v in versions]}
+    )
+
+    success_embed = REPLY_TEMPLATE.render(
+        field("Gültige Version", f"v{current.version} seit {format_date(current.effective_from)}"),
+        field("Angebotene Tarife", str(len(current.select_options))),
+        field(
+            "Geplante Versionen",
+            "\n".join(f"v{v.version} ab {format_date(v.effective_from)}" for v in upcoming) or "Keine",
+            False
+        ),
+        title="Tarifkatalog neu geladen"
+    )
+    await interaction.response.send_message(embed=success_embed, ephemeral=True)
+    logger.info(f"Tarifkatalog neu geladen von User {interaction.user.id}: Version {current.version}")
+
+# Kundenakte-Assistent
+# Der Zustand eines offenen Assistenten liegt nicht in einer View, sondern unter einem
+# kurzen Token in einer kleinen Datei im Verzeichnis des Servers. Die Komponenten tragen nur
+# das Token in ihrer custom_id und werden einmalig als DynamicItems registriert – so überleben
+# offene Assistenten auch einen Neustart. Wie die übrigen Daten gehört die Datei dem Prozess,
+# der den Server bedient, mehrere Shard-Prozesse überschreiben sich also nicht gegenseitig.
+WIZARD_FILENAME = "wizards.json"
+WIZARD_TTL = 15 * 60
+
+class WizardStore:
+    """Offene Kundenakte-Assistenten pro Server, per Token adressiert und mit Ablaufzeit"""
+
+    def __init__(self, base_dir, ttl):
+        self.base_dir = base_dir
+        self.ttl = ttl
+        self._entries = {}
+
+    def _path(self, guild_id):
+        return os.path.join(self.base_dir, str(guild_id), WIZARD_FILENAME)
+
+    def _load(self, guild_id):
+        entries = self._entries.get(guild_id)
+        if entries is None:
+            entries = self._entries[guild_id] = {}
+            path = self._path(guild_id)
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    entries.update(json.load(f))
+        return entries
+
+    def _save(self, guild_id):
+        now = time.time()
+        entries = self._load(guild_id)
+        for token in [t for t, e in entries.items() if e['expires_at'] <= now]:
+            del entries[token]
+        os.makedirs(os.path.dirname(self._path(guild_id)), exist_ok=True)
+        atomic_write_json(self._path(guild_id), entries, indent=None)
+
+    def create(self, guild_id, state):
+        token = secrets.token_urlsafe(9)
+        self._load(guild_id)[token] = {**state, "expires_at": time.time() + self.ttl}
+        self._save(guild_id)
+        return token
+
+    def get(self, guild_id, token):
+        entry = self._load(guild_id).get(token)
+        if entry is None or entry['expires_at'] <= time.time():
+            return None
+        return entry
+
+    def update(self, guild_id, token, **changes):
+        entry = self.get(guild_id, token)
+        if entry is not None:
+            entry.update(changes)
+            self._save(guild_id)
+        return entry
+
+    def pop(self, guild_id, token):
+        """Entfernt den Assistenten; abgelaufene zählen wie bei get() als nicht vorhanden"""
+        entry = self.get(guild_id, token)
+        if self._load(guild_id).pop(token, None) is not None:
+            self._save(guild_id)
+        return entry
+
+wizard_store = WizardStore(DATA_DIR, WIZARD_TTL)
+
+def insurance_options(selected=()):
+    """Gecachte Optionen der gültigen Tarifversion, nur die ausgewählten werden neu angelegt"""
+    options = tariff_catalog.at().select_options
+    if not selected:
+        return list(options)
+    return [
+        discord.SelectOption(label=o.label, description=o.description, value=o.value, default=True)
+        if o.value in selected else o
+        for o in options
+    ]
+
+def build_wizard_view(token, selected=()):
+    view = discord.ui.View(timeout=None)
+    view.add_item(InsuranceSelect(token, selected))
+    view.add_item(InsuranceConfirmButton(token, disabled=not selected))
+    return view
+
+def wizard_expired_embed():
+    return discord.Embed(
+        title="Zeitüberschreitung",
+        description="Die Auswahl wurde nicht rechtzeitig bestätigt. Bitte versuchen Sie es erneut.",
+        color=COLOR_WARNING
+    )
 
 # Auswahlmenü für Versicherungen
-class InsuranceSelect(discord.ui.Select):
-    def __init__(self):
-        options = [
-            discord.SelectOption(
-                label=insurance,
-                description=f"Monatsbeitrag: {data['price']:,.2f} €",
-                value=insurance
-            )
-            for insurance, data in INSURANCE_TYPES.items()
-        ]
+class InsuranceSelect(discord.ui.DynamicItem[discord.ui.Select], template=r'insurance_select:(?P<token>[\w-]+)'):
+    def __init__(self, token, selected=()):
+        options = insurance_options(selected)
         super().__init__(
-            placeholder="Wählen Sie die gewünschten Versicherungen aus...",
-            min_values=1,
-            max_values=len(options),
-            options=options,
-            custom_id="insurance_select"
+            discord.ui.Select(
+                placeholder="Wählen Sie die gewünschten Versicherungen aus...",
+                min_values=1,
+                max_values=len(options),
+                options=options,
+                custom_id=f"insurance_select:{token}"
+            )
         )
+        self.token = token
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Select, match):
+        return cls(match['token'])
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return not await shutdown_coordinator.reject(interaction, "Versicherungsauswahl")
 
     async def callback(self, interaction: discord.Interaction):
-        view = self.view
-        for item in view.children:
-            if isinstance(item, discord.ui.Button):
-                item.disabled = False
+        tariffs = tariff_catalog.at()
+        selected = [ins for ins in self.item.values if ins in tariffs.tariffs]
+        if wizard_store.update(interaction.guild_id, self.token, selected=selected) is None:
+            await interaction.response.edit_message(embed=wizard_expired_embed(), view=None)
+            return
 
-        total = sum(INSURANCE_TYPES[ins]["price"] for ins in self.values)
-        preview_text = "\n".join(f"▸ {ins} — {INSURANCE_TYPES[ins]['price']:,.2f} €" for ins in self.values)
+        total = tariffs.total(selected)
+        preview_text = "\n".join(f"▸ {ins} — {format_eur(tariffs.price(ins))}" for ins in selected)
 
-        preview_embed = discord.Embed(
+        preview_embed = REPLY_TEMPLATE.render(
             title="Versicherungen ausgewählt",
-            description=f"**Ausgewählte Versicherungen:**\n{preview_text}\n\n**Gesamtbeitrag (monatlich):** {total:,.2f} €",
-            color=COLOR_INFO
+            description=f"**Ausgewählte Versicherungen:**\n{preview_text}\n\n**Gesamtbeitrag (monatlich):** {format_eur(total)}",
+            color=COLOR_INFO,
+            footer="Klicken Sie auf 'Kundenakte erstellen', um fortzufahren."
         )
-        preview_embed.set_footer(text="Klicken Sie auf 'Kundenakte erstellen', um fortzufahren.")
 
-        await interaction.response.edit_message(embed=preview_embed, view=view)
+        await interaction.response.edit_message(embed=preview_embed, view=build_wizard_view(self.token, selected))
 
-class InsuranceView(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=180)
-        self.selected_insurances = []
-        self.confirmed = False
-        self.add_item(InsuranceSelect())
-
-        confirm_button = discord.ui.Button(
-            label="Kundenakte erstellen",
-            style=discord.ButtonStyle.green,
-            custom_id="confirm_insurance",
-            disabled=True
-        )
-        confirm_button.callback = self.confirm_callback
-        self.add_item(confirm_button)
-
-    async def confirm_callback(self, interaction: discord.Interaction):
-        self.confirmed = True
-        await interaction.response.defer()
-        self.stop()
+class InsuranceConfirmButton(discord.ui.DynamicItem[discord.ui.Button], template=r'confirm_insurance:(?P<token>[\w-]+)'):
+    def __init__(self, token, disabled=False):
+        super().__init__(
+            discord.ui.Button(
+                label="Kundenakte erstellen",
+                style=discord.ButtonStyle.green,
+                custom_id=f"confirm_insurance:{token}",
+                disabled=disabled
+            )
+        )
+        self.token = token
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return not await shutdown_coordinator.reject(interaction, "Kundenakte erstellen")
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match['token'])
 
-    async def on_timeout(self):
-        for item in self.children:
-            item.disabled = True
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        embed = await idempotency_cache.run(
+            idempotency_key(interaction, "kundenakte_erstellen", self.token),
+            lambda: complete_customer_creation(interaction, self.token)
+        )
+        # Nach einem Fehler bleibt der Assistent bestehen und kann erneut bestätigt werden
+        state = wizard_store.get(interaction.guild_id, self.token)
+        view = build_wizard_view(self.token, state['selected']) if state else None
+        await interaction.edit_original_response(embed=embed, view=view)
 
 # Kundenakte erstellen
 @bot.tree.command(name="kundenakte_erstellen", description="Erstellt eine neue Kundenakte im Archiv")
@@ -276,7 +1772,15 @@ async def create_customer(
     hbpay_nummer: str,
     economy_id: str
 ):
-    view = InsuranceView()
+    token = wizard_store.create(interaction.guild_id, {
+        "guild_id": interaction.guild_id,
+        "user_id": interaction.user.id,
+        "forum_channel_id": forum_channel.id,
+        "rp_name": rp_name,
+        "hbpay_nummer": hbpay_nummer,
+        "economy_id": economy_id,
+        "selected": []
+    })
 
     select_embed = discord.Embed(
         title="Versicherungen auswählen",
@@ -284,60 +1788,58 @@ async def create_customer(
         color=COLOR_INFO
     )
 
-    await interaction.response.send_message(embed=select_embed, view=view, ephemeral=True)
-    await view.wait()
+    await interaction.response.send_message(embed=select_embed, view=build_wizard_view(token), ephemeral=True)
 
-    if not view.confirmed:
-        timeout_embed = discord.Embed(
-            title="Zeitüberschreitung",
-            description="Die Auswahl wurde nicht rechtzeitig bestätigt. Bitte versuchen Sie es erneut.",
-            color=COLOR_WARNING
-        )
-        await interaction.edit_original_response(embed=timeout_embed, view=None)
-        return
+async def complete_customer_creation(interaction: discord.Interaction, token):
+    """Legt die Kundenakte an, sobald der Assistent bestätigt wurde, und gibt das Antwort-Embed zurück"""
+    # Erst nach dem Speichern der Akte entfernen, damit ein Fehler den Assistenten nicht verwirft
+    state = wizard_store.get(interaction.guild_id, token)
+    if state is None:
+        return wizard_expired_embed()
 
-    insurance_select = view.children[0]
-    if not insurance_select.values:
+    if not state['selected']:
         error_embed = discord.Embed(
             title="Keine Auswahl getroffen",
             description="Es wurden keine Versicherungen ausgewählt.",
             color=COLOR_ERROR
         )
-        await interaction.edit_original_response(embed=error_embed, view=None)
-        return
+        return error_embed
 
-    insurance_list = insurance_select.values
+    insurance_list = state['selected']
+    rp_name = state['rp_name']
+    hbpay_nummer = state['hbpay_nummer']
+    economy_id = state['economy_id']
+    forum_channel = interaction.guild.get_channel(state['forum_channel_id'])
 
     logger.info(f"Kundenakte wird erstellt von User {interaction.user.id} für {rp_name}")
 
     try:
+        data = get_data(interaction.guild_id)
         customer_id = generate_customer_id()
-        total_price = sum(INSURANCE_TYPES[ins]["price"] for ins in insurance_list)
-
-        embed = discord.Embed(
-            title="Versicherungsakte",
-            color=COLOR_PRIMARY,
-            timestamp=datetime.now()
-        )
-        embed.add_field(name="Versicherungsnehmer-ID", value=f"`{customer_id}`", inline=True)
-        embed.add_field(name="Versicherungsnehmer", value=rp_name, inline=True)
-        embed.add_field(name="‎", value="‎", inline=True)
-        embed.add_field(name="HBpay Kontonummer", value=f"`{hbpay_nummer}`", inline=True)
-        embed.add_field(name="Economy-ID", value=f"`{economy_id}`", inline=True)
-        embed.add_field(name="‎", value="‎", inline=True)
+        tariffs = tariff_catalog.at()
+        total_price = tariffs.total(insurance_list)
 
+        now = clock.now()
         insurance_text = "\n".join(
-            f"▸ {ins} — `{INSURANCE_TYPES[ins]['price']:,.2f} €/Monat`" 
+            f"▸ {ins} — `{format_eur(tariffs.price(ins))}/Monat`"
             for ins in insurance_list
         )
-        embed.add_field(name="Abgeschlossene Versicherungen", value=insurance_text, inline=False)
-        embed.add_field(name="Gesamtbeitrag (monatlich)", value=f"**{total_price:,.2f} €**", inline=False)
-
-        embed.add_field(name="‎", value="─────────────────────────────", inline=False)
-        embed.add_field(
-            name="Aktenanlage",
-            value=f"Bearbeitet von: {interaction.user.mention}\nDatum: {datetime.now().strftime('%d.%m.%Y, %H:%M')} Uhr",
-            inline=False
+        embed = CUSTOMER_FILE_TEMPLATE.render(
+            field("Versicherungsnehmer-ID", f"`{customer_id}`"),
+            field("Versicherungsnehmer", rp_name),
+            SPACER_FIELD,
+            field("HBpay Kontonummer", f"`{hbpay_nummer}`"),
+            field("Economy-ID", f"`{economy_id}`"),
+            SPACER_FIELD,
+            field("Abgeschlossene Versicherungen", insurance_text, False),
+            field("Gesamtbeitrag (monatlich)", f"**{format_eur(total_price)}**", False),
+            RULE_FIELD,
+            field(
+                "Aktenanlage",
+                f"Bearbeitet von: {interaction.user.mention}\nDatum: {format_datetime(now, seconds=False)}",
+                False
+            ),
+            timestamp=now
         )
 
         thread = await forum_channel.create_thread(
@@ -352,17 +1854,24 @@ async def create_customer(
             "economy_id": economy_id,
             "versicherungen": insurance_list,
             "total_monthly_price": total_price,
+            "tariff_version": tariffs.version,
             "thread_id": thread.thread.id,
             "discord_user_id": interaction.user.id,
-            "created_at": datetime.now().isoformat(),
+            "created_at": clock.now().isoformat(),
             "created_by": interaction.user.id
         }
-        save_data(data)
+        save_data(interaction.guild_id)
+        wizard_store.pop(interaction.guild_id, token)
+        guild_store.changed(interaction.guild_id, "customers")
+        customer_fragments.invalidate(interaction.guild_id, customer_id)
+        search_index.customer_added(interaction.guild_id, customer_id, data['customers'][customer_id])
+        if get_config(interaction.guild_id)['billing_channel_id']:
+            schedule_billing(interaction.guild_id, customer_id, data['customers'][customer_id])
 
         member = interaction.guild.get_member(interaction.user.id)
         assigned_roles = []
         for insurance in insurance_list:
-            role_name = INSURANCE_TYPES[insurance]["role"]
+            role_name = tariffs.tariffs[insurance]["role"]
             role = discord.utils.get(interaction.guild.roles, name=role_name)
             if not role:
                 role = await interaction.guild.create_role(
@@ -374,6 +1883,7 @@ async def create_customer(
             assigned_roles.append(role_name)
 
         add_log_entry(
+            interaction.guild_id,
             "KUNDENAKTE_ERSTELLT",
             interaction.user.id,
             {
@@ -384,29 +1894,28 @@ async def create_customer(
             }
         )
 
-        log_embed = discord.Embed(
+        log_embed = LOG_TEMPLATE.render(
+            field("Versicherungsnehmer-ID", f"`{customer_id}`"),
+            field("Name", rp_name),
+            field("Bearbeiter", interaction.user.mention),
+            field("Versicherungen", str(len(insurance_list))),
+            field("Monatsbeitrag", format_eur(total_price)),
             title="📋 Neue Kundenakte erstellt",
             color=COLOR_SUCCESS,
-            timestamp=datetime.now()
+            timestamp=clock.now()
         )
-        log_embed.add_field(name="Versicherungsnehmer-ID", value=f"`{customer_id}`", inline=True)
-        log_embed.add_field(name="Name", value=rp_name, inline=True)
-        log_embed.add_field(name="Bearbeiter", value=interaction.user.mention, inline=True)
-        log_embed.add_field(name="Versicherungen", value=str(len(insurance_list)), inline=True)
-        log_embed.add_field(name="Monatsbeitrag", value=f"{total_price:,.2f} €", inline=True)
         await send_to_log_channel(interaction.guild, log_embed)
 
-        success_embed = discord.Embed(
+        success_embed = REPLY_TEMPLATE.render(
+            field("Versicherungsnehmer-ID", f"`{customer_id}`"),
+            field("Aktenarchiv", thread.thread.mention),
+            field("Monatsbeitrag", format_eur(total_price)),
             title="Kundenakte erfolgreich angelegt",
-            description="Die Versicherungsakte wurde erfolgreich im System hinterlegt.",
-            color=COLOR_SUCCESS
+            description="Die Versicherungsakte wurde erfolgreich im System hinterlegt."
         )
-        success_embed.add_field(name="Versicherungsnehmer-ID", value=f"`{customer_id}`", inline=True)
-        success_embed.add_field(name="Aktenarchiv", value=thread.thread.mention, inline=True)
-        success_embed.add_field(name="Monatsbeitrag", value=f"{total_price:,.2f} €", inline=True)
 
-        await interaction.edit_original_response(embed=success_embed, view=None)
         logger.info(f"Kundenakte {customer_id} erfolgreich erstellt")
+        return success_embed
 
     except Exception as e:
         logger.error(f"Fehler beim Erstellen der Kundenakte: {e}", exc_info=True)
@@ -415,10 +1924,126 @@ async def create_customer(
             description=f"Es ist ein Fehler aufgetreten: {str(e)}",
             color=COLOR_ERROR
         )
+        return error_embed
+
+# Rechnungsnachricht
+def build_invoice_embed(guild_id, invoice_id, invoice, customer):
+    """Rendert die Rechnung aus dem gespeicherten Stand (Status, Mahnstufe, Betrag)"""
+    created_at = datetime.fromisoformat(invoice['created_at'])
+    reminder_count = invoice.get('reminder_count', 0)
+
+    if invoice.get('paid', False):
+        paid_at = datetime.fromisoformat(invoice['paid_at']) if invoice.get('paid_at') else None
+        status = f"✅ Bezahlt am {format_date(paid_at)}" if paid_at else "✅ Bezahlt"
+        color = COLOR_SUCCESS
+    elif reminder_count:
+        status = f"⚠️ Überfällig – {reminder_count}. Mahnung versendet"
+        color = COLOR_WARNING if reminder_count < 3 else COLOR_ERROR
+    else:
+        status = "⏳ Zahlung ausstehend"
+        color = COLOR_PRIMARY
+
+    amounts = [
+        field("Zwischensumme (Netto)", format_eur(invoice['betrag_netto'])),
+        field("Steuer (13%)", format_eur(invoice['steuer'])),
+        field("**Rechnungsbetrag (Brutto)**", f"**{format_eur(invoice['original_betrag'])}**")
+    ]
+    if invoice['betrag'] != invoice['original_betrag']:
+        amounts.append(field("Mahngebühr", format_eur(invoice['betrag'] - invoice['original_betrag'])))
+        amounts.append(field("**Aktueller Betrag**", f"**{format_eur(invoice['betrag'])}**"))
+
+    fragment = customer_fragments.get(guild_id, invoice['customer_id'], customer)
+    tariffs = tariff_catalog.get(invoice.get('tariff_version')) or tariff_catalog.at(created_at)
+    issued_by = invoice.get('created_by_name') or f"User {invoice['created_by']}"
+    return INVOICE_TEMPLATE.render(
+        field("Rechnungsnummer", f"`{invoice_id}`"),
+        field("Rechnungsdatum", format_date(created_at)),
+        field("Fälligkeitsdatum", format_date(datetime.fromisoformat(invoice['due_date']))),
+        INVOICE_HOLDER_SECTION,
+        fragment.holder,
+        INVOICE_PAYMENT_SECTION,
+        fragment.payment,
+        fragment.priced_positions(tariffs),
+        RULE_FIELD,
+        amounts,
+        RULE_FIELD,
+        field("Status", status, False),
+        color=color,
+        footer=f"Ausgestellt von {issued_by}",
+        timestamp=created_at
+    )
+
+# Die ursprüngliche Rechnungsnachricht wird nach Statusänderungen (bezahlt, Mahnstufe)
+# im Hintergrund neu gerendert. Änderungen innerhalb des Zeitfensters ergeben ein einziges Edit.
+INVOICE_EDIT_DELAY = 5
+
+class InvoiceMessageReconciler:
+    """Gleicht die geposteten Rechnungen mit dem gespeicherten Stand ab"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._tasks = {}
+        self._dirty = set()
+        self.edits = 0
+        self.coalesced = 0
+        self.missing = 0
+
+    def mark(self, guild_id, invoice_id):
+        """Merkt eine Rechnung zum Neu-Rendern vor, ohne auf Discord zu warten"""
+        key = (guild_id, invoice_id)
+        self._dirty.add(key)
+        if key in self._tasks:
+            self.coalesced += 1
+            return
+        self._tasks[key] = asyncio.create_task(self._reconcile(key))
+
+    async def _reconcile(self, key):
         try:
-            await interaction.edit_original_response(embed=error_embed, view=None)
-        except:
-            await interaction.followup.send(embed=error_embed, ephemeral=True)
+            # Läuft weiter, solange während eines Edits neue Änderungen dazukommen
+            while key in self._dirty:
+                await asyncio.sleep(self.delay)
+                self._dirty.discard(key)
+                await self._edit(*key)
+        except Exception as e:
+            logger.error(f"Fehler beim Aktualisieren der Rechnung {key[1]}: {e}", exc_info=True)
+        finally:
+            del self._tasks[key]
+
+    async def _edit(self, guild_id, invoice_id):
+        data = get_data(guild_id)
+        invoice = data['invoices'].get(invoice_id)
+        if not invoice or not invoice.get('message_id'):
+            return
+        customer = data['customers'].get(invoice['customer_id'])
+        guild = bot.get_guild(guild_id)
+        channel = guild.get_channel(invoice['channel_id']) if guild else None
+        if not customer or channel is None:
+            return
+
+        try:
+            with outbound_class(PRIORITY_BILLING):
+                await channel.get_partial_message(invoice['message_id']).edit(
+                    embed=build_invoice_embed(guild_id, invoice_id, invoice, customer)
+                )
+            self.edits += 1
+        except discord.NotFound:
+            # Nachricht wurde gelöscht: nicht bei jeder Änderung erneut versuchen
+            self.missing += 1
+            invoice['message_id'] = None
+            save_data(guild_id)
+            logger.info(f"Rechnungsnachricht für {invoice_id} existiert nicht mehr")
+        except discord.Forbidden:
+            logger.warning(f"Keine Berechtigung, die Rechnungsnachricht für {invoice_id} zu bearbeiten")
+
+    async def drain(self):
+        """Wartet, bis alle vorgemerkten Edits erledigt sind"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def stats(self):
+        return {"pending": len(self._tasks), "edits": self.edits, "coalesced": self.coalesced, "missing": self.missing}
+
+invoice_messages = InvoiceMessageReconciler(INVOICE_EDIT_DELAY)
 
 # Rechnung OHNE Zahlungsbuttons erstellen
 @bot.tree.command(name="rechnung_ausstellen", description="Erstellt eine Versicherungsrechnung")
@@ -435,385 +2060,1378 @@ async def create_invoice(
     logger.info(f"Rechnung wird erstellt von User {interaction.user.id} für Kunde {customer_id}")
 
     try:
-        if customer_id not in data['customers']:
-            error_embed = discord.Embed(
-                title="Kunde nicht gefunden",
-                description=f"Es existiert keine Akte mit der Versicherungsnehmer-ID `{customer_id}`.",
-                color=COLOR_ERROR
-            )
-            await interaction.followup.send(embed=error_embed, ephemeral=True)
-            return
-
-        customer = data['customers'][customer_id]
-        invoice_id = generate_invoice_id()
-        betrag_netto = customer['total_monthly_price']
-
-        # 13% Steuer
-        steuer = betrag_netto * 0.13
-        betrag_brutto = betrag_netto + steuer
-
-        # Zahlungsfrist: 3 Tage
-        due_date = datetime.now() + timedelta(days=3)
-
-        embed = discord.Embed(
-            title="Versicherungsrechnung",
-            color=COLOR_PRIMARY,
-            timestamp=datetime.now()
+        embed = await idempotency_cache.run(
+            idempotency_key(interaction, "rechnung_ausstellen", customer_id, channel),
+            lambda: issue_invoice(interaction.guild, customer_id, channel, interaction.user)
         )
-        embed.add_field(name="Rechnungsnummer", value=f"`{invoice_id}`", inline=True)
-        embed.add_field(name="Rechnungsdatum", value=datetime.now().strftime('%d.%m.%Y'), inline=True)
-        embed.add_field(name="Fälligkeitsdatum", value=due_date.strftime('%d.%m.%Y'), inline=True)
-
-        embed.add_field(name="‎", value="**Versicherungsnehmer**", inline=False)
-        embed.add_field(name="Name", value=customer['rp_name'], inline=True)
-        embed.add_field(name="Kunden-ID", value=f"`{customer_id}`", inline=True)
-        embed.add_field(name="‎", value="‎", inline=True)
-
-        embed.add_field(name="‎", value="**Zahlungsinformationen**", inline=False)
-        embed.add_field(name="HBpay Nummer", value=f"`{customer['hbpay_nummer']}`", inline=True)
-        embed.add_field(name="Economy-ID", value=f"`{customer['economy_id']}`", inline=True)
-        embed.add_field(name="‎", value="‎", inline=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
 
-        insurance_details = "\n".join(
-            f"▸ {ins}\n   `{INSURANCE_TYPES[ins]['price']:,.2f} €`" 
-            for ins in customer['versicherungen']
+    except Exception as e:
+        logger.error(f"Fehler beim Erstellen der Rechnung: {e}", exc_info=True)
+        error_embed = discord.Embed(
+            title="Fehler bei der Rechnungsstellung",
+            description=f"Es ist ein Fehler aufgetreten: {str(e)}",
+            color=COLOR_ERROR
         )
-        embed.add_field(name="Versicherte Positionen", value=insurance_details, inline=False)
+        await interaction.followup.send(embed=error_embed, ephemeral=True)
 
-        embed.add_field(name="‎", value="─────────────────────────────", inline=False)
-        embed.add_field(name="Zwischensumme (Netto)", value=f"{betrag_netto:,.2f} €", inline=True)
-        embed.add_field(name="Steuer (13%)", value=f"{steuer:,.2f} €", inline=True)
-        embed.add_field(name="**Rechnungsbetrag (Brutto)**", value=f"**{betrag_brutto:,.2f} €**", inline=True)
+async def issue_invoice(guild, customer_id, channel, issued_by, billing_period=None):
+    """Stellt die Rechnung aus und gibt das Embed für die Antwort zurück.
+    issued_by ist None bei der automatischen Abrechnung, billing_period markiert dann den Zeitraum."""
+    issuer_id = issued_by.id if issued_by else 0
+    issuer_name = issued_by.display_name if issued_by else AUTO_BILLING_NAME
+    data = get_data(guild.id)
+    if customer_id not in data['customers']:
+        error_embed = discord.Embed(
+            title="Kunde nicht gefunden",
+            description=f"Es existiert keine Akte mit der Versicherungsnehmer-ID `{customer_id}`.",
+            color=COLOR_ERROR
+        )
+        return error_embed
 
-        embed.add_field(name="‎", value="─────────────────────────────", inline=False)
-        embed.add_field(name="Status", value="⏳ Zahlung ausstehend", inline=False)
-        embed.set_footer(text=f"Ausgestellt von {interaction.user.display_name}")
+    customer = data['customers'][customer_id]
+    # Bepreisung nach der am Rechnungsdatum gültigen Tarifversion
+    tariffs = tariff_catalog.at()
+    unknown = [ins for ins in customer['versicherungen'] if ins not in tariffs.tariffs]
+    if unknown:
+        error_embed = discord.Embed(
+            title="Tarif nicht im Katalog",
+            description=f"Für {', '.join(unknown)} gibt es in Tarifversion {tariffs.version} keinen Preis.",
+            color=COLOR_ERROR
+        )
+        return error_embed
+
+    betrag_netto = tariffs.total(customer['versicherungen'])
+
+    # 13% Steuer
+    steuer = betrag_netto * 0.13
+    betrag_brutto = betrag_netto + steuer
+
+    # Zahlungsfrist: 3 Tage
+    due_date = clock.now() + timedelta(days=3)
+
+    invoice = {
+        "customer_id": customer_id,
+        "betrag": betrag_brutto,
+        "betrag_netto": betrag_netto,
+        "steuer": steuer,
+        "original_betrag": betrag_brutto,
+        "tariff_version": tariffs.version,
+        "paid": False,
+        "message_id": None,
+        "channel_id": channel.id,
+        "due_date": due_date.isoformat(),
+        "reminder_count": 0,
+        "created_at": clock.now().isoformat(),
+        "created_by": issuer_id,
+        "created_by_name": issuer_name
+    }
+    if billing_period:
+        invoice['billing_period'] = billing_period
 
+    # Bis die Rechnung in den Daten steht, hält die Reservierung die ID für gleichzeitige Ausstellungen frei
+    invoice_id = generate_invoice_id(data['invoices'])
+    try:
         # Rechnung OHNE View senden (keine Buttons)
-        message = await channel.send(embed=embed)
-
-        data['invoices'][invoice_id] = {
+        message = await channel.send(embed=build_invoice_embed(guild.id, invoice_id, invoice, customer))
+        invoice['message_id'] = message.id
+        if billing_period:
+            # Wird mit der Rechnung gespeichert, damit derselbe Zeitraum nie zweimal abgerechnet wird
+            customer['billing']['last_period'] = billing_period
+
+        data['invoices'][invoice_id] = invoice
+    finally:
+        release_invoice_id(invoice_id)
+    save_data(guild.id)
+    guild_store.changed(guild.id, "invoices")
+    customer_invoices.added(guild.id, invoice_id, invoice)
+
+    add_log_entry(
+        guild.id,
+        "RECHNUNG_ERSTELLT",
+        issuer_id,
+        {
+            "invoice_id": invoice_id,
             "customer_id": customer_id,
             "betrag": betrag_brutto,
-            "betrag_netto": betrag_netto,
-            "steuer": steuer,
-            "original_betrag": betrag_brutto,
-            "paid": False,
-            "message_id": message.id,
-            "channel_id": channel.id,
-            "due_date": due_date.isoformat(),
-            "reminder_count": 0,
-            "created_at": datetime.now().isoformat(),
-            "created_by": interaction.user.id
+            "due_date": format_date(due_date)
         }
-        save_data(data)
+    )
 
-        add_log_entry(
-            "RECHNUNG_ERSTELLT",
-            interaction.user.id,
-            {
-                "invoice_id": invoice_id,
-                "customer_id": customer_id,
-                "betrag": betrag_brutto,
-                "due_date": due_date.strftime('%d.%m.%Y')
-            }
-        )
+    log_embed = LOG_TEMPLATE.render(
+        field("Rechnungsnummer", f"`{invoice_id}`"),
+        customer_fragments.get(guild.id, customer_id, customer).name,
+        field("Betrag", format_eur(betrag_brutto)),
+        field("Fällig am", format_date(due_date)),
+        field("Ausgestellt von", issued_by.mention if issued_by else issuer_name),
+        title="🧾 Neue Rechnung ausgestellt",
+        color=COLOR_INFO,
+        timestamp=clock.now()
+    )
+    await send_to_log_channel(guild, log_embed)
+
+    success_embed = REPLY_TEMPLATE.render(
+        field("Rechnungsnummer", f"`{invoice_id}`"),
+        field("Betrag (Brutto)", format_eur(betrag_brutto)),
+        field("Fällig am", format_date(due_date)),
+        title="Rechnung erfolgreich ausgestellt",
+        description="Die Rechnung wurde erstellt und versendet."
+    )
 
-        log_embed = discord.Embed(
-            title="🧾 Neue Rechnung ausgestellt",
-            color=COLOR_INFO,
-            timestamp=datetime.now()
-        )
-        log_embed.add_field(name="Rechnungsnummer", value=f"`{invoice_id}`", inline=True)
-        log_embed.add_field(name="Kunde", value=customer['rp_name'], inline=True)
-        log_embed.add_field(name="Betrag", value=f"{betrag_brutto:,.2f} €", inline=True)
-        log_embed.add_field(name="Fällig am", value=due_date.strftime('%d.%m.%Y'), inline=True)
-        log_embed.add_field(name="Ausgestellt von", value=interaction.user.mention, inline=True)
-        await send_to_log_channel(interaction.guild, log_embed)
+    return success_embed
 
-        success_embed = discord.Embed(
-            title="Rechnung erfolgreich ausgestellt",
-            description="Die Rechnung wurde erstellt und versendet.",
-            color=COLOR_SUCCESS
-        )
-        success_embed.add_field(name="Rechnungsnummer", value=f"`{invoice_id}`", inline=True)
-        success_embed.add_field(name="Betrag (Brutto)", value=f"{betrag_brutto:,.2f} €", inline=True)
-        success_embed.add_field(name="Fällig am", value=due_date.strftime('%d.%m.%Y'), inline=True)
+# Rechnung archivieren - MIT KUNDENAKTE-POST
+@bot.tree.command(name="rechnung_archivieren", description="Markiert eine Rechnung als bezahlt und archiviert sie")
+@app_commands.describe(invoice_id="Rechnungsnummer (z.B. RE-2412-A3F9)")
+async def archive_invoice(interaction: discord.Interaction, invoice_id: str):
+    await interaction.response.defer(ephemeral=True)
+    logger.info(f"Rechnung wird archiviert von User {interaction.user.id}: {invoice_id}")
 
-        await interaction.followup.send(embed=success_embed, ephemeral=True)
+    try:
+        embed = await idempotency_cache.run(
+            idempotency_key(interaction, "rechnung_archivieren", invoice_id),
+            lambda: mark_invoice_paid(interaction, invoice_id)
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
 
     except Exception as e:
-        logger.error(f"Fehler beim Erstellen der Rechnung: {e}", exc_info=True)
+        logger.error(f"Fehler beim Archivieren der Rechnung: {e}", exc_info=True)
         error_embed = discord.Embed(
-            title="Fehler bei der Rechnungsstellung",
+            title="Fehler beim Archivieren",
             description=f"Es ist ein Fehler aufgetreten: {str(e)}",
             color=COLOR_ERROR
         )
         await interaction.followup.send(embed=error_embed, ephemeral=True)
 
-# Rechnung archivieren - MIT KUNDENAKTE-POST
-@bot.tree.command(name="rechnung_archivieren", description="Markiert eine Rechnung als bezahlt und archiviert sie")
-@app_commands.describe(invoice_id="Rechnungsnummer (z.B. RE-2412-A3F9)")
-async def archive_invoice(interaction: discord.Interaction, invoice_id: str):
-    await interaction.response.defer(ephemeral=True)
-    logger.info(f"Rechnung wird archiviert von User {interaction.user.id}: {invoice_id}")
+async def mark_invoice_paid(interaction: discord.Interaction, invoice_id):
+    """Markiert die Rechnung als bezahlt, postet sie in die Kundenakte und gibt das Antwort-Embed zurück"""
+    data = get_data(interaction.guild_id)
 
-    try:
-        # Prüfen ob Rechnung existiert
-        if invoice_id not in data['invoices']:
-            error_embed = discord.Embed(
-                title="Rechnung nicht gefunden",
-                description=f"Es existiert keine Rechnung mit der Nummer `{invoice_id}`.",
-                color=COLOR_ERROR
-            )
-            await interaction.followup.send(embed=error_embed, ephemeral=True)
-            return
+    # Prüfen ob Rechnung existiert
+    if invoice_id not in data['invoices']:
+        error_embed = discord.Embed(
+            title="Rechnung nicht gefunden",
+            description=f"Es existiert keine Rechnung mit der Nummer `{invoice_id}`.",
+            color=COLOR_ERROR
+        )
+        return error_embed
+
+    invoice = data['invoices'][invoice_id]
+
+    # Prüfen ob bereits bezahlt
+    if invoice.get('paid', False):
+        info_embed = discord.Embed(
+            title="Rechnung bereits archiviert",
+            description=f"Die Rechnung `{invoice_id}` wurde bereits als bezahlt markiert.",
+            color=COLOR_INFO
+        )
+        return info_embed
+
+    customer_id = invoice['customer_id']
+    customer = data['customers'].get(customer_id)
+
+    if not customer:
+        error_embed = discord.Embed(
+            title="Kunde nicht gefunden",
+            description=f"Kunde `{customer_id}` konnte nicht gefunden werden.",
+            color=COLOR_ERROR
+        )
+        return error_embed
+
+    # Rechnung als bezahlt markieren
+    data['invoices'][invoice_id]['paid'] = True
+    data['invoices'][invoice_id]['paid_by'] = interaction.user.id
+    data['invoices'][invoice_id]['paid_at'] = clock.now().isoformat()
+    data['invoices'][invoice_id]['archived'] = True
+    data['invoices'][invoice_id]['reminder_count'] = 0
+    save_data(interaction.guild_id)
+    guild_store.changed(interaction.guild_id, "invoices")
+    customer_invoices.paid(interaction.guild_id, invoice_id, invoice)
+    invoice_messages.mark(interaction.guild_id, invoice_id)
+
+    # Log-Eintrag
+    add_log_entry(
+        interaction.guild_id,
+        "RECHNUNG_ARCHIVIERT",
+        interaction.user.id,
+        {
+            "invoice_id": invoice_id,
+            "customer_id": customer_id,
+            "betrag": invoice['betrag']
+        }
+    )
+
+    # Log in Channel senden
+    now = clock.now()
+    fragment = customer_fragments.get(interaction.guild_id, customer_id, customer)
+    netto = field("Betrag (Netto)", format_eur(invoice.get('betrag_netto', 0)))
+    steuer = field("Steuer (13%)", format_eur(invoice.get('steuer', 0)))
+    log_embed = ARCHIVE_LOG_TEMPLATE.render(
+        SECTIONS["Rechnungsdetails"],
+        field("Rechnungsnummer", f"`{invoice_id}`"),
+        fragment.name,
+        field("Archiviert von", interaction.user.mention),
+        SECTIONS["Zahlungsinformationen"],
+        netto,
+        steuer,
+        field("Betrag (Brutto)", f"**{format_eur(invoice['betrag'])}**"),
+        SECTIONS["Zusatzinformationen"],
+        field("Kunden-ID", f"`{customer_id}`"),
+        field("Status", "✅ Bezahlt & Archiviert"),
+        field("Zeitstempel", format_datetime(now)),
+        footer=f"User-ID: {interaction.user.id}",
+        timestamp=now
+    )
+    await send_to_log_channel(interaction.guild, log_embed)
+
+    # Rechnung in Kundenakte posten
+    # Im Hintergrund, die Bestätigung für den Mitarbeiter wartet nicht darauf
+    thread_id = customer.get('thread_id')
+    thread = interaction.guild.get_thread(thread_id) if thread_id else None
+    if thread:
+        archive_embed = ARCHIVE_TEMPLATE.render(
+            field("Rechnungsnummer", f"`{invoice_id}`"),
+            field("Rechnungsdatum", format_date(datetime.fromisoformat(invoice['created_at']))),
+            field("Zahlungsdatum", format_date(now)),
+            fragment.positions,
+            RULE_FIELD,
+            field("Nettobetrag", netto['value']),
+            steuer,
+            field("**Bruttobetrag**", f"**{format_eur(invoice['betrag'])}**"),
+            RULE_FIELD,
+            field("Status", "✅ Bezahlt"),
+            field("Archiviert von", interaction.user.mention),
+            footer=f"Archiviert am {format_datetime(now)}",
+            timestamp=now
+        )
+        outbound.submit(PRIORITY_ARCHIVE, thread.send(embed=archive_embed), f"Rechnung {invoice_id} in Kundenakte")
+
+    # Erfolgsbestätigung
+    success_embed = REPLY_TEMPLATE.render(
+        fragment.name,
+        field("Betrag", format_eur(invoice['betrag'])),
+        field("Status", "✅ Archiviert"),
+        title="✅ Rechnung erfolgreich archiviert",
+        description=f"Die Rechnung `{invoice_id}` wurde als bezahlt markiert und archiviert."
+    )
+
+    logger.info(f"Rechnung {invoice_id} erfolgreich archiviert von User {interaction.user.id}")
+    return success_embed
+
+# Kontoauszug
+# Kunden-ID -> Rechnungsnummern in Ausstellungsreihenfolge, beim ersten Zugriff einmal aus den
+# Rechnungen aufgebaut und danach beim Ausstellen und Archivieren gepflegt. Bezahlte Beträge
+# ändern sich nicht mehr und werden als Summe geführt; eine Seite liest nur ihre eigenen Rechnungen.
+STATEMENT_PAGE_SIZE = 10
 
-        invoice = data['invoices'][invoice_id]
+class CustomerAccount:
+    __slots__ = ("invoice_ids", "open_ids", "paid_total", "paid_surcharges")
 
-        # Prüfen ob bereits bezahlt
+    def __init__(self):
+        self.invoice_ids = []
+        self.open_ids = {}
+        self.paid_total = 0.0
+        self.paid_surcharges = 0.0
+
+    def add(self, invoice_id, invoice):
+        if invoice_id in self.open_ids:
+            return
+        self.invoice_ids.append(invoice_id)
         if invoice.get('paid', False):
-            info_embed = discord.Embed(
-                title="Rechnung bereits archiviert",
-                description=f"Die Rechnung `{invoice_id}` wurde bereits als bezahlt markiert.",
-                color=COLOR_INFO
-            )
-            await interaction.followup.send(embed=info_embed, ephemeral=True)
+            self.paid(invoice_id, invoice)
+        else:
+            self.open_ids[invoice_id] = None
+
+    def paid(self, invoice_id, invoice):
+        self.open_ids.pop(invoice_id, None)
+        self.paid_total += invoice['betrag']
+        self.paid_surcharges += invoice['betrag'] - invoice.get('original_betrag', invoice['betrag'])
+
+class GuildInvoiceIndex:
+    def __init__(self):
+        self.accounts = {}
+        # (created_at, Rechnungsnummer) aufsteigend, für Zeitfenster und Cursor der JSON-API
+        self.ordered = []
+        self.open_ids = set()
+
+    def add(self, invoice_id, invoice):
+        account = self.accounts.setdefault(invoice['customer_id'], CustomerAccount())
+        if invoice_id in account.open_ids:
             return
+        account.add(invoice_id, invoice)
+        key = (invoice['created_at'], invoice_id)
+        if not self.ordered or self.ordered[-1] < key:
+            self.ordered.append(key)
+        else:
+            bisect.insort(self.ordered, key)
+        if not invoice.get('paid', False):
+            self.open_ids.add(invoice_id)
+
+class CustomerInvoiceIndex:
+    def __init__(self):
+        self._by_guild = {}
+
+    def guild_index(self, guild_id):
+        index = self._by_guild.get(guild_id)
+        if index is None:
+            index = self._by_guild[guild_id] = GuildInvoiceIndex()
+            invoices = get_data(guild_id)['invoices']
+            for invoice_id in sorted(invoices, key=lambda i: invoices[i]['created_at']):
+                index.add(invoice_id, invoices[invoice_id])
+        return index
+
+    def account(self, guild_id, customer_id):
+        return self.guild_index(guild_id).accounts.get(customer_id) or CustomerAccount()
+
+    def added(self, guild_id, invoice_id, invoice):
+        self.guild_index(guild_id).add(invoice_id, invoice)
+
+    def paid(self, guild_id, invoice_id, invoice):
+        index = self.guild_index(guild_id)
+        account = index.accounts.get(invoice['customer_id'])
+        if account is not None and invoice_id in account.open_ids:
+            account.paid(invoice_id, invoice)
+        index.open_ids.discard(invoice_id)
+
+    def forget(self, guild_id):
+        self._by_guild.pop(guild_id, None)
+
+customer_invoices = CustomerInvoiceIndex()
+
+def open_totals(invoices, account):
+    """Offene Rechnungen eines Kontos, offener Betrag und darin enthaltene Mahngebühren"""
+    open_invoices = [invoices[i] for i in account.open_ids if i in invoices]
+    open_balance = sum(invoice['betrag'] for invoice in open_invoices)
+    open_surcharges = sum(invoice['betrag'] - invoice.get('original_betrag', invoice['betrag']) for invoice in open_invoices)
+    return open_invoices, open_balance, open_surcharges
+
+def statement_line(invoice_id, invoice):
+    """Eine Zeile des Rechnungsverlaufs"""
+    if invoice.get('paid', False):
+        status = f"✅ Bezahlt am {format_date(datetime.fromisoformat(invoice['paid_at']))}" if invoice.get('paid_at') else "✅ Bezahlt"
+    elif invoice.get('reminder_count', 0):
+        status = f"⚠️ {invoice['reminder_count']}. Mahnung"
+    else:
+        status = f"🕒 Offen, fällig am {format_date(datetime.fromisoformat(invoice['due_date']))}"
+    surcharge = invoice['betrag'] - invoice.get('original_betrag', invoice['betrag'])
+    amount = f"**{format_eur(invoice['betrag'])}**" + (f" (inkl. {format_eur(surcharge)} Mahngebühr)" if surcharge > 0.005 else "")
+    return field(
+        f"{invoice_id} • {format_date(datetime.fromisoformat(invoice['created_at']))}",
+        f"{amount}\n{status}",
+        False
+    )
+
+def build_statement_embed(guild_id, customer_id, customer, page, footer=None):
+    """Seite des Kontoauszugs (1-basiert, neueste Rechnungen zuerst) und Anzahl der Seiten"""
+    invoices = get_data(guild_id)['invoices']
+    account = customer_invoices.account(guild_id, customer_id)
+    pages = max(1, math.ceil(len(account.invoice_ids) / STATEMENT_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+
+    open_invoices, open_balance, open_surcharges = open_totals(invoices, account)
+
+    end = len(account.invoice_ids) - (page - 1) * STATEMENT_PAGE_SIZE
+    start = max(0, end - STATEMENT_PAGE_SIZE)
+    lines = [
+        statement_line(invoice_id, invoices[invoice_id])
+        for invoice_id in reversed(account.invoice_ids[start:end])
+        if invoices.get(invoice_id, {}).get('customer_id') == customer_id
+    ]
+
+    fragment = customer_fragments.get(guild_id, customer_id, customer)
+    embed = STATEMENT_TEMPLATE.render(
+        fragment.holder,
+        SECTIONS["Kontostand"],
+        field("Offen", f"**{format_eur(open_balance)}**\n{len(open_invoices)} Rechnung(en)"),
+        field("Bezahlt", f"{format_eur(account.paid_total)}\n{len(account.invoice_ids) - len(account.open_ids)} Rechnung(en)"),
+        field("Mahngebühren", f"{format_eur(account.paid_surcharges + open_surcharges)}\ndavon offen {format_eur(open_surcharges)}"),
+        SECTIONS["Rechnungsverlauf"],
+        lines or [field(BLANK, "Noch keine Rechnungen ausgestellt.", False)],
+        footer=footer or f"Seite {page}/{pages}" + (f" • Weiter mit seite:{page + 1}" if page < pages else ""),
+        timestamp=clock.now()
+    )
+    return embed, page, pages
 
-        customer_id = invoice['customer_id']
-        customer = data['customers'].get(customer_id)
+@bot.tree.command(name="kontoauszug", description="Zeigt offene und bezahlte Rechnungen eines Kunden")
+@app_commands.describe(
+    customer_id="Versicherungsnehmer-ID",
+    seite="Seite des Rechnungsverlaufs (Standard: 1, neueste zuerst)",
+    in_akte_posten="Stand zusätzlich in die Kundenakte posten"
+)
+async def account_statement(interaction: discord.Interaction, customer_id: str, seite: int = 1, in_akte_posten: bool = False):
+    await interaction.response.defer(ephemeral=True)
+    logger.info(f"Kontoauszug für {customer_id} angefordert von User {interaction.user.id}")
 
+    try:
+        customer = get_data(interaction.guild_id)['customers'].get(customer_id)
         if not customer:
             error_embed = discord.Embed(
                 title="Kunde nicht gefunden",
-                description=f"Kunde `{customer_id}` konnte nicht gefunden werden.",
+                description=f"Es existiert keine Akte mit der Versicherungsnehmer-ID `{customer_id}`.",
                 color=COLOR_ERROR
             )
             await interaction.followup.send(embed=error_embed, ephemeral=True)
             return
 
-        # Rechnung als bezahlt markieren
-        data['invoices'][invoice_id]['paid'] = True
-        data['invoices'][invoice_id]['paid_by'] = interaction.user.id
-        data['invoices'][invoice_id]['paid_at'] = datetime.now().isoformat()
-        data['invoices'][invoice_id]['archived'] = True
-        data['invoices'][invoice_id]['reminder_count'] = 0
-        save_data(data)
+        embed, page, _ = build_statement_embed(interaction.guild_id, customer_id, customer, seite)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+        if not in_akte_posten:
+            return
+        thread = interaction.guild.get_thread(customer['thread_id']) if customer.get('thread_id') else None
+        if not thread:
+            warning_embed = discord.Embed(
+                title="Kundenakte nicht gefunden",
+                description=f"Für `{customer_id}` gibt es keinen Akten-Thread, der Kontoauszug wurde nicht gepostet.",
+                color=COLOR_WARNING
+            )
+            await interaction.followup.send(embed=warning_embed, ephemeral=True)
+            return
 
-        # Log-Eintrag
+        embed, _, _ = build_statement_embed(
+            interaction.guild_id, customer_id, customer, page,
+            footer=f"Stand {format_datetime(clock.now())} • erstellt von {interaction.user.display_name}"
+        )
+        await thread.send(embed=embed)
         add_log_entry(
-            "RECHNUNG_ARCHIVIERT",
+            interaction.guild_id,
+            "KONTOAUSZUG_GEPOSTET",
             interaction.user.id,
-            {
-                "invoice_id": invoice_id,
-                "customer_id": customer_id,
-                "betrag": invoice['betrag']
-            }
-        )
-
-        # Log in Channel senden
-        log_embed = discord.Embed(
-            title="📦 Rechnung archiviert",
-            description="Eine Rechnung wurde erfolgreich als bezahlt markiert und archiviert.",
-            color=COLOR_SUCCESS,
-            timestamp=datetime.now()
-        )
-        log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Rechnungsdetails**", inline=False)
-        log_embed.add_field(name="Rechnungsnummer", value=f"`{invoice_id}`", inline=True)
-        log_embed.add_field(name="Kunde", value=customer['rp_name'], inline=True)
-        log_embed.add_field(name="Archiviert von", value=interaction.user.mention, inline=True)
-        log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Zahlungsinformationen**", inline=False)
-        log_embed.add_field(name="Betrag (Netto)", value=f"{invoice.get('betrag_netto', 0):,.2f} €", inline=True)
-        log_embed.add_field(name="Steuer (13%)", value=f"{invoice.get('steuer', 0):,.2f} €", inline=True)
-        log_embed.add_field(name="Betrag (Brutto)", value=f"**{invoice['betrag']:,.2f} €**", inline=True)
-        log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Zusatzinformationen**", inline=False)
-        log_embed.add_field(name="Kunden-ID", value=f"`{customer_id}`", inline=True)
-        log_embed.add_field(name="Status", value="✅ Bezahlt & Archiviert", inline=True)
-        log_embed.add_field(name="Zeitstempel", value=datetime.now().strftime('%d.%m.%Y, %H:%M:%S Uhr'), inline=True)
-        log_embed.set_footer(text=f"User-ID: {interaction.user.id}")
-        await send_to_log_channel(interaction.guild, log_embed)
-
-        # Rechnung in Kundenakte posten
-        thread_id = customer.get('thread_id')
-        if thread_id:
-            try:
-                thread = interaction.guild.get_thread(thread_id)
-                if thread:
-                    archive_embed = discord.Embed(
-                        title="📦 Archivierte Rechnung",
-                        description="Diese Rechnung wurde als bezahlt markiert und archiviert.",
-                        color=COLOR_SUCCESS,
-                        timestamp=datetime.now()
-                    )
-                    archive_embed.add_field(name="Rechnungsnummer", value=f"`{invoice_id}`", inline=True)
-                    archive_embed.add_field(name="Rechnungsdatum", value=datetime.fromisoformat(invoice['created_at']).strftime('%d.%m.%Y'), inline=True)
-                    archive_embed.add_field(name="Zahlungsdatum", value=datetime.now().strftime('%d.%m.%Y'), inline=True)
-
-                    insurance_list = customer.get('versicherungen', [])
-                    insurance_text = "\n".join(f"▸ {ins}" for ins in insurance_list)
-                    archive_embed.add_field(name="Versicherte Positionen", value=insurance_text if insurance_text else "Keine", inline=False)
-
-                    archive_embed.add_field(name="‎", value="─────────────────────────────", inline=False)
-                    archive_embed.add_field(name="Nettobetrag", value=f"{invoice.get('betrag_netto', 0):,.2f} €", inline=True)
-                    archive_embed.add_field(name="Steuer (13%)", value=f"{invoice.get('steuer', 0):,.2f} €", inline=True)
-                    archive_embed.add_field(name="**Bruttobetrag**", value=f"**{invoice['betrag']:,.2f} €**", inline=True)
-
-                    archive_embed.add_field(name="‎", value="─────────────────────────────", inline=False)
-                    archive_embed.add_field(name="Status", value="✅ Bezahlt", inline=True)
-                    archive_embed.add_field(name="Archiviert von", value=interaction.user.mention, inline=True)
-                    archive_embed.set_footer(text=f"Archiviert am {datetime.now().strftime('%d.%m.%Y, %H:%M:%S')} Uhr")
-
-                    await thread.send(embed=archive_embed)
-                    logger.info(f"Rechnung {invoice_id} in Kundenakte gepostet")
-            except Exception as e:
-                logger.error(f"Fehler beim Posten in Kundenakte: {e}")
-
-        # Erfolgsbestätigung
-        success_embed = discord.Embed(
-            title="✅ Rechnung erfolgreich archiviert",
-            description=f"Die Rechnung `{invoice_id}` wurde als bezahlt markiert und archiviert.",
-            color=COLOR_SUCCESS
+            {"customer_id": customer_id, "seite": page}
         )
-        success_embed.add_field(name="Kunde", value=customer['rp_name'], inline=True)
-        success_embed.add_field(name="Betrag", value=f"{invoice['betrag']:,.2f} €", inline=True)
-        success_embed.add_field(name="Status", value="✅ Archiviert", inline=True)
-
-        await interaction.followup.send(embed=success_embed, ephemeral=True)
-        logger.info(f"Rechnung {invoice_id} erfolgreich archiviert von User {interaction.user.id}")
+        logger.info(f"Kontoauszug für {customer_id} in Kundenakte gepostet")
 
     except Exception as e:
-        logger.error(f"Fehler beim Archivieren der Rechnung: {e}", exc_info=True)
+        logger.error(f"Fehler beim Kontoauszug: {e}", exc_info=True)
         error_embed = discord.Embed(
-            title="Fehler beim Archivieren",
+            title="Fehler beim Kontoauszug",
             description=f"Es ist ein Fehler aufgetreten: {str(e)}",
             color=COLOR_ERROR
         )
         await interaction.followup.send(embed=error_embed, ephemeral=True)
 
 # Mahnungs-System
+# Tage überfällig -> (Mahnstufe, Mahngebühr in %, Faktor auf den Ursprungsbetrag)
+REMINDER_STAGES = {
+    0: (1, 0, 1.00),
+    1: (2, 5, 1.05),
+    2: (3, 10, 1.10)
+}
+# Solange gilt die Lease einer Mahnstufe, auch über einen Neustart hinweg
+REMINDER_LEASE_TTL = 36 * 3600
+
 @tasks.loop(hours=24)
 async def check_invoices():
-    """Überprüft täglich alle Rechnungen und sendet Mahnungen"""
+    """Überprüft täglich alle Rechnungen der lokalen Shards und sendet Mahnungen"""
+    async with shutdown_coordinator.busy("Mahnlauf"):
+        try:
+            now = clock.now()
+            lease_store.purge_expired()
+            for guild in local_guilds():
+                data = get_data(guild.id)
+                due = []
+                for invoice_id, invoice_data in list(data['invoices'].items()):
+                    if invoice_data.get('paid', False):
+                        continue
+
+                    due_date = datetime.fromisoformat(invoice_data['due_date'])
+                    days_overdue = (now - due_date).days
+
+                    if days_overdue < 0:
+                        continue
+
+                    reminder_count = invoice_data.get('reminder_count', 0)
+
+                    # Erste Mahnung (Tag 0), zweite (Tag 1, +5%), dritte (Tag 2, +10% vom Original)
+                    stage = REMINDER_STAGES.get(days_overdue)
+                    if not stage or reminder_count != days_overdue:
+                        continue
+                    due.append((invoice_id, invoice_data, stage))
+
+                if not due:
+                    continue
+                # Alle zu erwähnenden Kunden des Laufs mit einer Abfrage pro 100 auflösen
+                customers = data['customers']
+                await member_resolver.resolve(guild, [
+                    customers[invoice_data['customer_id']]['discord_user_id']
+                    for _, invoice_data, _ in due if invoice_data['customer_id'] in customers
+                ])
+
+                for invoice_id, invoice_data, (reminder_number, surcharge_percent, factor) in due:
+                    # Kann während der Abfrage bezahlt oder von einem anderen Lauf gemahnt worden sein
+                    invoice_data = get_data(guild.id)['invoices'].get(invoice_id)
+                    if invoice_data is None or invoice_data.get('paid', False):
+                        continue
+                    if invoice_data.get('reminder_count', 0) != reminder_number - 1:
+                        continue
+
+                    # Verhindert, dass ein zweiter Prozess dieselbe Mahnstufe verschickt
+                    lease_key = f"mahnung-{guild.id}-{invoice_id}-{reminder_number}"
+                    if not lease_store.acquire(lease_key, REMINDER_LEASE_TTL):
+                        logger.info(f"Mahnung {reminder_number} für {invoice_id} wird bereits von einem anderen Prozess versendet")
+                        continue
+
+                    betrag = invoice_data['original_betrag'] * factor if surcharge_percent else invoice_data['betrag']
+                    with outbound_class(PRIORITY_BILLING):
+                        sent = await send_reminder(guild, invoice_id, invoice_data, reminder_number, surcharge_percent, betrag)
+                    if not sent:
+                        # Ohne Mahnung auch keine Gebühr; der nächste Lauf darf es erneut versuchen
+                        lease_store.release(lease_key)
+                        continue
+
+                    # Während des Versands kann die Rechnung archiviert oder der Stand ersetzt worden sein
+                    invoice_data = get_data(guild.id)['invoices'].get(invoice_id)
+                    if invoice_data is None or invoice_data.get('paid', False):
+                        logger.info(f"Rechnung {invoice_id} wurde während der {reminder_number}. Mahnung bezahlt, keine Mahngebühr")
+                        continue
+                    invoice_data['betrag'] = betrag
+                    invoice_data['reminder_count'] = reminder_number
+                    save_data(guild.id)
+                    guild_store.changed(guild.id, "invoices")
+                    invoice_messages.mark(guild.id, invoice_id)
+
+        except Exception as e:
+            logger.error(f"Fehler bei Mahnungsprüfung: {e}", exc_info=True)
+            loop_watchdog.ran("check_invoices", error=e)
+        else:
+            loop_watchdog.ran("check_invoices")
+
+@check_invoices.before_loop
+async def before_check_invoices():
+    # Der Loop startet im setup_hook, die Server sind aber erst nach on_ready bekannt
+    await bot.wait_until_ready()
+
+async def send_reminder(guild, invoice_id, invoice_data, reminder_number, surcharge_percent, betrag):
+    """Sendet eine Mahnung mit dem neuen Betrag; True, wenn sie im Channel angekommen ist"""
     try:
-        now = datetime.now()
-        for invoice_id, invoice_data in list(data['invoices'].items()):
-            if invoice_data.get('paid', False):
-                continue
+        channel = guild.get_channel(invoice_data['channel_id'])
+        if not channel:
+            return False
 
-            due_date = datetime.fromisoformat(invoice_data['due_date'])
-            days_overdue = (now - due_date).days
+        customer = get_data(guild.id)['customers'].get(invoice_data['customer_id'])
+        if not customer:
+            return False
+
+        customer_user = member_resolver.get(guild, customer['discord_user_id'])
+
+        surcharge_text = f" (+{surcharge_percent}% Mahngebühr)" if surcharge_percent > 0 else ""
+        fragment = customer_fragments.get(guild.id, invoice_data['customer_id'], customer)
+        color = COLOR_WARNING if reminder_number < 3 else COLOR_ERROR
+        now = clock.now()
+        invoice_field = field("Rechnungsnummer", f"`{invoice_id}`")
+        original_field = field("Ursprünglicher Betrag", format_eur(invoice_data['original_betrag']))
+
+        embed = REMINDER_TEMPLATE.render(
+            invoice_field,
+            fragment.name,
+            field("Mahnung", f"{reminder_number}. Mahnung"),
+            original_field,
+            field("Aktueller Betrag", f"**{format_eur(betrag)}{surcharge_text}**"),
+            title=REMINDER_TITLES[reminder_number],
+            description=f"Die Rechnung `{invoice_id}` ist überfällig.",
+            color=color,
+            timestamp=now
+        )
 
-            if days_overdue < 0:
-                continue
+        if customer_user:
+            await channel.send(f"{customer_user.mention}", embed=embed)
+        else:
+            await channel.send(embed=embed)
+
+        # Log
+        log_embed = REMINDER_LOG_TEMPLATE.render(
+            SECTIONS["Mahnungsdetails"],
+            invoice_field,
+            fragment.name,
+            field("Mahnungsstufe", f"{reminder_number}. Mahnung"),
+            SECTIONS["Finanzielle Informationen"],
+            original_field,
+            field("Neuer Betrag", f"**{format_eur(betrag)}**"),
+            field("Mahngebühr", f"+{surcharge_percent}%" if surcharge_percent > 0 else "Keine"),
+            SECTIONS["Zusatzinformationen"],
+            field("Kunden-ID", f"`{invoice_data['customer_id']}`"),
+            field("Zeitstempel", format_datetime(now)),
+            title=REMINDER_LOG_TITLES[reminder_number],
+            color=color,
+            timestamp=now
+        )
+        await send_to_log_channel(guild, log_embed)
 
-            reminder_count = invoice_data.get('reminder_count', 0)
-
-            # Erste Mahnung (Tag 0 nach Fälligkeit)
-            if days_overdue == 0 and reminder_count == 0:
-                await send_reminder(invoice_id, invoice_data, 1, 0)
-                data['invoices'][invoice_id]['reminder_count'] = 1
-                save_data(data)
-
-            # Zweite Mahnung (Tag 1, +5%)
-            elif days_overdue == 1 and reminder_count == 1:
-                new_amount = invoice_data['original_betrag'] * 1.05
-                data['invoices'][invoice_id]['betrag'] = new_amount
-                await send_reminder(invoice_id, invoice_data, 2, 5)
-                data['invoices'][invoice_id]['reminder_count'] = 2
-                save_data(data)
-
-            # Dritte Mahnung (Tag 2, +10% vom Original)
-            elif days_overdue == 2 and reminder_count == 2:
-                new_amount = invoice_data['original_betrag'] * 1.10
-                data['invoices'][invoice_id]['betrag'] = new_amount
-                await send_reminder(invoice_id, invoice_data, 3, 10)
-                data['invoices'][invoice_id]['reminder_count'] = 3
-                save_data(data)
+        add_log_entry(
+            guild.id,
+            f"MAHNUNG_{reminder_number}",
+            0,
+            {
+                "invoice_id": invoice_id,
+                "customer_id": invoice_data['customer_id'],
+                "surcharge": surcharge_percent
+            }
+        )
+        return True
 
     except Exception as e:
-        logger.error(f"Fehler bei Mahnungsprüfung: {e}", exc_info=True)
+        logger.error(f"Fehler beim Senden der Mahnung: {e}", exc_info=True)
+        return False
 
-async def send_reminder(invoice_id, invoice_data, reminder_number, surcharge_percent):
-    """Sendet eine Mahnung"""
-    try:
-        for guild in bot.guilds:
-            channel = guild.get_channel(invoice_data['channel_id'])
-            if not channel:
-                continue
+# Verzögerte Jobs
+# Jobs liegen persistent in den Daten des Servers und werden erst nach erfolgreicher
+# Ausführung entfernt (at-least-once). Handler müssen deshalb idempotent sein.
+JOB_MAX_ATTEMPTS = 5
+JOB_HANDLERS = {}
 
-            customer = data['customers'].get(invoice_data['customer_id'])
-            if not customer:
-                continue
+def job_handler(action):
+    """Registriert einen Handler für eine Job-Aktion"""
+    def decorator(func):
+        JOB_HANDLERS[action] = func
+        return func
+    return decorator
 
-            customer_user = guild.get_member(customer['discord_user_id'])
+class JobScheduler:
+    """Ein einzelner Task, der fällige Jobs aus einem Heap nach Ausführungszeit abarbeitet"""
 
-            surcharge_text = f" (+{surcharge_percent}% Mahngebühr)" if surcharge_percent > 0 else ""
+    def __init__(self):
+        self._heap = []
+        self._wakeup = None
+        self._task = None
+        self._stopped = False
+
+    def _push(self, guild_id, job):
+        heapq.heappush(self._heap, (datetime.fromisoformat(job['run_at']).timestamp(), guild_id, job['id']))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def schedule(self, guild_id, action, target, run_at, payload=None, save=True):
+        job = {
+            "id": secrets.token_hex(6),
+            "action": action,
+            "target": target,
+            "payload": payload or {},
+            "run_at": run_at.isoformat(),
+            "attempts": 0,
+            "created_at": clock.now().isoformat()
+        }
+        get_data(guild_id)['jobs'][job['id']] = job
+        if save:
+            save_data(guild_id)
+        # Vor dem Start übernimmt run() alle gespeicherten Jobs selbst
+        if self._wakeup:
+            self._push(guild_id, job)
+        logger.info(f"Job {job['id']} ({action} → {target}) geplant für {job['run_at']}")
+        return job
+
+    def load(self, guild_id):
+        for job in get_data(guild_id)['jobs'].values():
+            self._push(guild_id, job)
+
+    def reload(self, guild_id):
+        """Nach einer Wiederherstellung; vor dem Start lädt run() ohnehin alles"""
+        if self._wakeup:
+            self.load(guild_id)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def run(self):
+        await bot.wait_until_ready()
+        for guild in local_guilds():
+            self.load(guild.id)
+        self._wakeup = asyncio.Event()
+
+        while not self._stopped:
+            self._wakeup.clear()
+            # Fälligkeit und Vergleich über dieselbe Uhr, sonst greifen Jobs unter der virtuellen Uhr nie
+            timeout = max(0.0, self._heap[0][0] - clock.now().timestamp()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            while self._heap and self._heap[0][0] <= clock.now().timestamp() and not self._stopped:
+                _, guild_id, job_id = heapq.heappop(self._heap)
+                # Jobs sind Aufräumarbeit (Transkripte, Channels), die Abrechnung hebt sich selbst an
+                async with shutdown_coordinator.busy(f"Job {job_id}"):
+                    with outbound_class(PRIORITY_ARCHIVE):
+                        await self._execute(guild_id, job_id)
+            loop_watchdog.ran("job_scheduler")
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def wake(self):
+        """Prüft die Fälligkeiten neu, z.B. nachdem eine virtuelle Uhr vorgestellt wurde"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    def stop(self):
+        """Beginnt keine weiteren Jobs; offene bleiben gespeichert und laufen nach dem Neustart"""
+        self._stopped = True
+        if self._wakeup:
+            self._wakeup.set()
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _execute(self, guild_id, job_id):
+        jobs = get_data(guild_id)['jobs']
+        job = jobs.get(job_id)
+        if job is None:
+            return
 
-            embed = discord.Embed(
-                title=f"⚠️ {reminder_number}. Mahnung",
-                description=f"Die Rechnung `{invoice_id}` ist überfällig.",
-                color=COLOR_WARNING if reminder_number < 3 else COLOR_ERROR,
-                timestamp=datetime.now()
-            )
-            embed.add_field(name="Rechnungsnummer", value=f"`{invoice_id}`", inline=True)
-            embed.add_field(name="Kunde", value=customer['rp_name'], inline=True)
-            embed.add_field(name="Mahnung", value=f"{reminder_number}. Mahnung", inline=True)
-            embed.add_field(name="Ursprünglicher Betrag", value=f"{invoice_data['original_betrag']:,.2f} €", inline=True)
-            embed.add_field(name="Aktueller Betrag", value=f"**{invoice_data['betrag']:,.2f} €{surcharge_text}**", inline=True)
-
-            if customer_user:
-                await channel.send(f"{customer_user.mention}", embed=embed)
-            else:
-                await channel.send(embed=embed)
-
-            # Log
-            log_embed = discord.Embed(
-                title=f"📨 {reminder_number}. Mahnung versendet",
-                description="Eine Zahlungserinnerung wurde automatisch an den Kunden versendet.",
-                color=COLOR_WARNING if reminder_number < 3 else COLOR_ERROR,
-                timestamp=datetime.now()
-            )
-            log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Mahnungsdetails**", inline=False)
-            log_embed.add_field(name="Rechnungsnummer", value=f"`{invoice_id}`", inline=True)
-            log_embed.add_field(name="Kunde", value=customer['rp_name'], inline=True)
-            log_embed.add_field(name="Mahnungsstufe", value=f"{reminder_number}. Mahnung", inline=True)
-            log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Finanzielle Informationen**", inline=False)
-            log_embed.add_field(name="Ursprünglicher Betrag", value=f"{invoice_data['original_betrag']:,.2f} €", inline=True)
-            log_embed.add_field(name="Neuer Betrag", value=f"**{invoice_data['betrag']:,.2f} €**", inline=True)
-            if surcharge_percent > 0:
-                log_embed.add_field(name="Mahngebühr", value=f"+{surcharge_percent}%", inline=True)
+        try:
+            handler = JOB_HANDLERS[job['action']]
+            await handler(bot.get_guild(guild_id), job)
+        except Exception as e:
+            job['attempts'] += 1
+            if job['attempts'] >= JOB_MAX_ATTEMPTS:
+                logger.error(f"Job {job_id} ({job['action']}) endgültig fehlgeschlagen: {e}", exc_info=True)
+                del jobs[job_id]
             else:
-                log_embed.add_field(name="Mahngebühr", value="Keine", inline=True)
-            log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Zusatzinformationen**", inline=False)
-            log_embed.add_field(name="Kunden-ID", value=f"`{invoice_data['customer_id']}`", inline=True)
-            log_embed.add_field(name="Zeitstempel", value=datetime.now().strftime('%d.%m.%Y, %H:%M:%S Uhr'), inline=True)
-            log_embed.set_footer(text="Automatisch generiert • System-ID: 0")
-            await send_to_log_channel(guild, log_embed)
-
-            add_log_entry(
-                f"MAHNUNG_{reminder_number}",
-                0,
-                {
-                    "invoice_id": invoice_id,
-                    "customer_id": invoice_data['customer_id'],
-                    "surcharge": surcharge_percent
-                }
+                retry_at = clock.now() + timedelta(seconds=30 * 2 ** job['attempts'])
+                job['run_at'] = retry_at.isoformat()
+                logger.warning(f"Job {job_id} ({job['action']}) fehlgeschlagen, neuer Versuch um {job['run_at']}: {e}")
+                self._push(guild_id, job)
+            save_data(guild_id)
+            return
+
+        del jobs[job_id]
+        save_data(guild_id)
+        logger.info(f"Job {job_id} ({job['action']} → {job['target']}) ausgeführt")
+
+job_scheduler = JobScheduler()
+
+@job_handler("delete_channel")
+async def delete_channel_job(guild, job):
+    """Löscht einen Channel; ist er bereits weg, gilt der Job als erledigt"""
+    if guild is None:
+        return
+    channel = guild.get_channel(job['target'])
+    if channel is None:
+        return
+    try:
+        await channel.delete(reason=job['payload'].get('reason'))
+    except discord.NotFound:
+        pass
+
+# Geplante Jobs anzeigen
+@bot.tree.command(name="jobs_anzeigen", description="Zeigt die geplanten verzögerten Aktionen an")
+async def show_jobs(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        error_embed = discord.Embed(
+            title="Zugriff verweigert",
+            description="Nur Administratoren können geplante Jobs einsehen.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    jobs = sorted(get_data(interaction.guild_id)['jobs'].values(), key=lambda j: j['run_at'])
+    embed = LOG_TEMPLATE.render(
+        [
+            field(
+                f"{job['action']} • `{job['id']}`",
+                (
+                    f"Ziel: `{job['target']}`\n"
+                    f"Fällig: {format_datetime(datetime.fromisoformat(job['run_at']))}\n"
+                    f"Versuche: {job['attempts']}"
+                ),
+                False
             )
+            for job in jobs[:EMBED_MAX_FIELDS]
+        ],
+        title="⏱️ Geplante Jobs",
+        description=f"{len(jobs)} ausstehende Job(s)" if jobs else "Es sind keine Jobs geplant.",
+        color=COLOR_INFO,
+        timestamp=clock.now()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Automatische Abrechnung
+# Jeder Kunde hat einen Abrechnungsanker (Datum der Aktenanlage). Fällig ist immer genau ein
+# Job pro Kunde im Job-Scheduler; nach der Rechnung plant er den nächsten Zyklus. Die Uhrzeit
+# ergibt sich aus der Kunden-ID, damit sich die Rechnungen über den Tag verteilen.
+AUTO_BILLING_NAME = "Automatische Abrechnung"
+
+def add_months(value, months):
+    """Gleicher Tag n Monate später, am Monatsende auf den letzten Tag gekürzt"""
+    month = value.month - 1 + months
+    year = value.year + month // 12
+    month = month % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+def billing_anchor(customer_id, created_at):
+    seconds = int(hashlib.sha1(customer_id.encode()).hexdigest(), 16) % 86400
+    return datetime.combine(created_at.date(), datetime.min.time()) + timedelta(seconds=seconds)
+
+def billing_period(due):
+    return due.strftime('%Y-%m')
+
+def schedule_billing(guild_id, customer_id, customer, first_cycle=1, save=True):
+    """Plant den nächsten Abrechnungszyklus des Kunden, falls noch keiner geplant ist"""
+    billing = customer.get('billing')
+    if billing is None:
+        anchor = billing_anchor(customer_id, datetime.fromisoformat(customer['created_at']))
+        billing = customer['billing'] = {"anchor": anchor.isoformat(), "cycle": first_cycle, "last_period": None, "job_id": None}
+    if billing['job_id'] in get_data(guild_id)['jobs']:
+        return False
+
+    anchor = datetime.fromisoformat(billing['anchor'])
+    # Nie rückwirkend abrechnen: weder bei der Ersteinrichtung noch nach einer Pause der
+    # Abrechnung oder einem verlorenen Job, der nächste Zyklus liegt immer in der Zukunft
+    while add_months(anchor, billing['cycle']) < clock.now():
+        billing['cycle'] += 1
+    due = add_months(anchor, billing['cycle'])
+    job = job_scheduler.schedule(guild_id, "bill_customer", customer_id, due, {"period": billing_period(due)}, save=False)
+    billing['job_id'] = job['id']
+    if save:
+        save_data(guild_id)
+    return True
+
+def schedule_all_billing(guild_id):
+    """Stellt sicher, dass jeder Kunde genau einen geplanten Zyklus hat; einmal speichern statt pro Kunde"""
+    if not get_config(guild_id)['billing_channel_id']:
+        return 0
+    customers = get_data(guild_id)['customers']
+    scheduled = [
+        schedule_billing(guild_id, customer_id, customer, first_cycle=0, save=False)
+        for customer_id, customer in customers.items()
+    ]
+    if any(scheduled):
+        save_data(guild_id)
+    return len(customers)
+
+@job_handler("bill_customer")
+async def bill_customer_job(guild, job):
+    """Stellt die Rechnung eines Zyklus aus und plant den nächsten"""
+    if guild is None:
+        return
+    customer_id = job['target']
+    customer = get_data(guild.id)['customers'].get(customer_id)
+    billing = customer.get('billing') if customer else None
+    if not billing or billing['job_id'] != job['id']:
+        return
+    channel_id = get_config(guild.id)['billing_channel_id']
+    if not channel_id:
+        billing['job_id'] = None
+        return
 
-            break
+    period = job['payload']['period']
+    if billing['last_period'] != period:
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            raise RuntimeError(f"Abrechnungs-Channel {channel_id} nicht gefunden")
+        with outbound_class(PRIORITY_BILLING):
+            embed = await issue_invoice(guild, customer_id, channel, None, billing_period=period)
+        if embed.color.value == COLOR_ERROR:
+            raise RuntimeError(embed.description)
+        logger.info(f"Zeitraum {period} für {customer_id} automatisch abgerechnet")
+    else:
+        logger.info(f"Zeitraum {period} für {customer_id} bereits abgerechnet")
+
+    billing['cycle'] += 1
+    billing['job_id'] = None
+    schedule_billing(guild.id, customer_id, customer)
+
+# Automatische Abrechnung einrichten
+@bot.tree.command(name="abrechnung_einrichten", description="Aktiviert die monatliche automatische Rechnungsstellung")
+@app_commands.describe(channel="Channel für automatische Rechnungen (leer lassen zum Deaktivieren)")
+async def setup_billing(interaction: discord.Interaction, channel: discord.TextChannel = None):
+    if not interaction.user.guild_permissions.administrator:
+        error_embed = discord.Embed(
+            title="Zugriff verweigert",
+            description="Nur Administratoren können die automatische Abrechnung einrichten.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    get_config(interaction.guild_id)['billing_channel_id'] = channel.id if channel else None
+    save_config(interaction.guild_id)
+    add_log_entry(
+        interaction.guild_id,
+        "ABRECHNUNG_EINGERICHTET" if channel else "ABRECHNUNG_DEAKTIVIERT",
+        interaction.user.id,
+        {"channel_id": channel.id if channel else None}
+    )
+
+    if channel:
+        count = schedule_all_billing(interaction.guild_id)
+        embed = REPLY_TEMPLATE.render(
+            field("Kunden", str(count)),
+            title="Automatische Abrechnung aktiviert",
+            description=f"Rechnungen werden monatlich zum Abrechnungstag jedes Kunden in {channel.mention} gestellt."
+        )
+    else:
+        # Geplante Jobs laufen ins Leere und planen keinen weiteren Zyklus
+        embed = discord.Embed(
+            title="Automatische Abrechnung deaktiviert",
+            description="Es werden keine weiteren Rechnungen automatisch gestellt.",
+            color=COLOR_INFO
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+    logger.info(f"Automatische Abrechnung {'aktiviert' if channel else 'deaktiviert'} von User {interaction.user.id}")
+
+# Sicherungen
+# Jede Sicherung zerlegt config.json und data.json an Zeilengrenzen in inhaltsdefinierte Blöcke,
+# die unter ihrem SHA-256 abgelegt werden. Eine Sicherung schreibt nur Blöcke, die es noch nicht
+# gibt, plus ein kleines Manifest. Vor einer Wiederherstellung wird jede Prüfsumme kontrolliert.
+BACKUP_DIR = os.path.join(DATA_DIR, "backups")
+BACKUP_FILES = ("config.json", "data.json")
+BACKUP_INTERVAL_MINUTES = int(os.environ.get('BACKUP_INTERVAL_MINUTES', 60))
+BACKUP_MAX_COUNT = int(os.environ.get('BACKUP_MAX_COUNT', 48))
+BACKUP_MAX_AGE_DAYS = int(os.environ.get('BACKUP_MAX_AGE_DAYS', 14))
+# Ein Block endet nach einer Zeile, deren CRC auf die Maske passt (im Mittel alle 256 Zeilen).
+# Ein neuer Kunde verschiebt so nur die Blöcke rund um die Änderung, nicht alle folgenden.
+CHUNK_MIN_SIZE = 4 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+CHUNK_BOUNDARY_MASK = 0xFF
+
+def split_chunks(content):
+    chunks = []
+    start = position = 0
+    for line in content.splitlines(keepends=True):
+        position += len(line)
+        size = position - start
+        if size >= CHUNK_MAX_SIZE or (size >= CHUNK_MIN_SIZE and zlib.crc32(line) & CHUNK_BOUNDARY_MASK == 0):
+            chunks.append(content[start:position])
+            start = position
+    if start < len(content):
+        chunks.append(content[start:])
+    return chunks
+
+class BackupStore:
+    """Sicherungen pro Server: chunks/<sha256> (zlib) und snapshots/<id>.json"""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def _chunk_path(self, guild_id, digest):
+        return os.path.join(self.base_dir, str(guild_id), "chunks", digest[:2], digest)
+
+    def _snapshot_dir(self, guild_id):
+        return os.path.join(self.base_dir, str(guild_id), "snapshots")
+
+    def snapshots(self, guild_id):
+        """Alle Manifeste, neueste zuerst"""
+        directory = self._snapshot_dir(guild_id)
+        if not os.path.isdir(directory):
+            return []
+        manifests = []
+        for filename in os.listdir(directory):
+            if filename.endswith(".json"):
+                with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+        return sorted(manifests, key=lambda m: m['created_at'], reverse=True)
+
+    def create(self, guild_id, reason, summary):
+        """Legt eine Sicherung an; None, wenn sich seit der letzten nichts geändert hat"""
+        files = {}
+        written = 0
+        for filename in BACKUP_FILES:
+            path = guild_store._path(guild_id, filename)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                content = f.read()
+            digests = []
+            for chunk in split_chunks(content):
+                digest = hashlib.sha256(chunk).hexdigest()
+                chunk_path = self._chunk_path(guild_id, digest)
+                if not os.path.exists(chunk_path):
+                    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                    atomic_write(chunk_path, zlib.compress(chunk))
+                    written += 1
+                digests.append(digest)
+            files[filename] = {"sha256": hashlib.sha256(content).hexdigest(), "size": len(content), "chunks": digests}
+
+        snapshots = self.snapshots(guild_id)
+        if not files or (snapshots and snapshots[0]['files'] == files):
+            return None
+
+        now = clock.now()
+        snapshot_id = now.strftime('%Y%m%d-%H%M%S')
+        if any(s['id'] == snapshot_id for s in snapshots):
+            snapshot_id += f"-{secrets.token_hex(2)}"
+        manifest = {
+            "id": snapshot_id,
+            "created_at": now.isoformat(),
+            "reason": reason,
+            "summary": summary,
+            "new_chunks": written,
+            "files": files
+        }
+        os.makedirs(self._snapshot_dir(guild_id), exist_ok=True)
+        atomic_write_json(os.path.join(self._snapshot_dir(guild_id), f"{snapshot_id}.json"), manifest)
+        self.rotate(guild_id)
+        return manifest
+
+    def rotate(self, guild_id):
+        """Behält die neuesten BACKUP_MAX_COUNT Sicherungen im Zeitfenster, die neueste immer"""
+        snapshots = self.snapshots(guild_id)
+        cutoff = clock.now() - timedelta(days=BACKUP_MAX_AGE_DAYS)
+        keep = [s for s in snapshots[:BACKUP_MAX_COUNT] if datetime.fromisoformat(s['created_at']) >= cutoff] or snapshots[:1]
+        kept_ids = {s['id'] for s in keep}
+        removed = [s for s in snapshots if s['id'] not in kept_ids]
+        if not removed:
+            return
+        for manifest in removed:
+            os.remove(os.path.join(self._snapshot_dir(guild_id), f"{manifest['id']}.json"))
+
+        # Blöcke, auf die keine verbleibende Sicherung mehr zeigt, löschen
+        referenced = {digest for s in keep for f in s['files'].values() for digest in f['chunks']}
+        chunk_root = os.path.join(self.base_dir, str(guild_id), "chunks")
+        for prefix in os.listdir(chunk_root):
+            for digest in os.listdir(os.path.join(chunk_root, prefix)):
+                if digest not in referenced:
+                    os.remove(os.path.join(chunk_root, prefix, digest))
+        logger.info(f"{len(removed)} alte Sicherung(en) für Server {guild_id} entfernt")
+
+    def load_verified(self, guild_id, snapshot_id):
+        """Setzt die Dateien einer Sicherung zusammen und prüft jede Prüfsumme; wirft ValueError"""
+        path = os.path.join(self._snapshot_dir(guild_id), f"{snapshot_id}.json")
+        if not os.path.exists(path):
+            raise ValueError(f"Sicherung `{snapshot_id}` existiert nicht")
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        contents = {}
+        for filename, info in manifest['files'].items():
+            parts = []
+            for digest in info['chunks']:
+                try:
+                    with open(self._chunk_path(guild_id, digest), 'rb') as f:
+                        chunk = zlib.decompress(f.read())
+                except (OSError, zlib.error) as e:
+                    raise ValueError(f"Block {digest[:12]} von {filename} fehlt oder ist beschädigt: {e}")
+                if hashlib.sha256(chunk).hexdigest() != digest:
+                    raise ValueError(f"Prüfsumme von Block {digest[:12]} in {filename} stimmt nicht")
+                parts.append(chunk)
+            content = b"".join(parts)
+            if len(content) != info['size'] or hashlib.sha256(content).hexdigest() != info['sha256']:
+                raise ValueError(f"Prüfsumme von {filename} stimmt nicht")
+            contents[filename] = content
+        return manifest, contents
+
+    def write_files(self, guild_id, contents):
+        for filename, content in contents.items():
+            atomic_write(guild_store._path(guild_id, filename), content)
+
+backup_store = BackupStore(BACKUP_DIR)
+# Sicherung und Wiederherstellung desselben Servers dürfen sich nicht überschneiden
+backup_lock = asyncio.Lock()
+_backup_generations = {}
+
+def backup_summary(guild_id):
+    data = get_data(guild_id)
+    return {"customers": len(data['customers']), "invoices": len(data['invoices']), "logs": len(data['logs'])}
+
+async def create_backup(guild_id, reason):
+    async with backup_lock:
+        # Die Sicherung liest die Dateien, vorgemerkte Speicherungen müssen also erst auf die Platte
+        await guild_store.saved(guild_id)
+        generation = guild_store.generations.get(guild_id, 0)
+        manifest = await asyncio.to_thread(backup_store.create, guild_id, reason, backup_summary(guild_id))
+        _backup_generations[guild_id] = generation
+    if manifest:
+        logger.info(f"Sicherung {manifest['id']} für Server {guild_id} angelegt ({manifest['new_chunks']} neue Blöcke)")
+    return manifest
+
+@tasks.loop(minutes=BACKUP_INTERVAL_MINUTES)
+async def backup_guilds():
+    """Sichert regelmäßig alle Server, deren Daten sich seit der letzten Sicherung geändert haben"""
+    failed = None
+    for guild in local_guilds():
+        if guild_store.generations.get(guild.id, 0) == _backup_generations.get(guild.id):
+            continue
+        try:
+            async with shutdown_coordinator.busy("Sicherung"):
+                await create_backup(guild.id, "automatisch")
+        except Exception as e:
+            logger.error(f"Sicherung für Server {guild.id} fehlgeschlagen: {e}", exc_info=True)
+            failed = e
+    loop_watchdog.ran("backup_guilds", error=failed)
+
+@backup_guilds.before_loop
+async def before_backup_guilds():
+    await bot.wait_until_ready()
+
+def reload_guild_state(guild_id):
+    """Verwirft alles, was aus den Daten des Servers abgeleitet und im Speicher gehalten wird"""
+    open_tickets.forget(guild_id)
+    customer_fragments.invalidate(guild_id)
+    customer_invoices.forget(guild_id)
+    search_index.forget(guild_id)
+    job_scheduler.reload(guild_id)
+    schedule_all_billing(guild_id)
+
+async def backup_autocomplete(interaction: discord.Interaction, current: str):
+    snapshots = await asyncio.to_thread(backup_store.snapshots, interaction.guild_id)
+    choices = []
+    for manifest in snapshots:
+        created_at = datetime.fromisoformat(manifest['created_at'])
+        summary = manifest['summary']
+        label = (
+            f"{format_datetime(created_at)} • {manifest['reason']} • "
+            f"{summary['customers']} Kunden, {summary['invoices']} Rechnungen"
+        )
+        if current.lower() in label.lower() or current in manifest['id']:
+            choices.append(app_commands.Choice(name=label[:100], value=manifest['id']))
+    return choices[:25]
+
+# Sicherung wiederherstellen
+@bot.tree.command(name="backup_wiederherstellen", description="Stellt die Daten des Servers aus einer Sicherung wieder her")
+@app_commands.describe(sicherung="Zeitpunkt der Sicherung")
+@app_commands.autocomplete(sicherung=backup_autocomplete)
+async def restore_backup(interaction: discord.Interaction, sicherung: str):
+    if not interaction.user.guild_permissions.administrator:
+        error_embed = discord.Embed(
+            title="Zugriff verweigert",
+            description="Nur Administratoren können Sicherungen wiederherstellen.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    guild_id = interaction.guild_id
+    started = time.perf_counter()
+
+    try:
+        manifest, contents = await asyncio.to_thread(backup_store.load_verified, guild_id, sicherung)
+        restored = await asyncio.to_thread(
+            lambda: {filename: json.loads(content) for filename, content in contents.items()}
+        )
+    except ValueError as e:
+        logger.error(f"Sicherung {sicherung} für Server {guild_id} nicht verwendbar: {e}")
+        error_embed = discord.Embed(
+            title="Sicherung nicht verwendbar",
+            description=f"Die Prüfung ist fehlgeschlagen, es wurde nichts verändert.\n\n{e}",
+            color=COLOR_ERROR
+        )
+        await interaction.followup.send(embed=error_embed, ephemeral=True)
+        return
+
+    try:
+        # Aktuellen Stand vorher sichern, damit auch die Wiederherstellung rückgängig gemacht werden kann
+        await create_backup(guild_id, f"vor Wiederherstellung von {sicherung}")
+        async with backup_lock:
+            # Ein noch laufender Schreib-Task würde den alten Stand über die Wiederherstellung legen
+            await guild_store.saved(guild_id)
+            # Schreiben und Übernehmen ohne await dazwischen, sonst könnte ein anderer
+            # Command den alten Stand aus dem Speicher wieder auf die Platte schreiben
+            backup_store.write_files(guild_id, contents)
+            guild_store.replace(
+                guild_id,
+                restored.get("config.json", {}),
+                restored.get("data.json", empty_data())
+            )
+            reload_guild_state(guild_id)
+
+        add_log_entry(guild_id, "SICHERUNG_WIEDERHERGESTELLT", interaction.user.id, {"snapshot_id": sicherung})
+        duration = time.perf_counter() - started
+
+        summary = manifest['summary']
+        success_embed = REPLY_TEMPLATE.render(
+            field("Kunden", str(summary['customers'])),
+            field("Rechnungen", str(summary['invoices'])),
+            field("Dauer", f"{duration:.2f}s"),
+            title="Sicherung wiederhergestellt",
+            description=f"Der Stand vom {format_datetime(datetime.fromisoformat(manifest['created_at']))} ist wieder aktiv."
+        )
+        await interaction.followup.send(embed=success_embed, ephemeral=True)
+        logger.warning(f"Sicherung {sicherung} für Server {guild_id} wiederhergestellt von User {interaction.user.id}")
 
     except Exception as e:
-        logger.error(f"Fehler beim Senden der Mahnung: {e}", exc_info=True)
+        logger.error(f"Fehler beim Wiederherstellen der Sicherung: {e}", exc_info=True)
+        error_embed = discord.Embed(
+            title="Fehler bei der Wiederherstellung",
+            description=f"Es ist ein Fehler aufgetreten: {str(e)}",
+            color=COLOR_ERROR
+        )
+        await interaction.followup.send(embed=error_embed, ephemeral=True)
 
 # Ticket-System
+TICKET_CATEGORY_NAME = "Support-Tickets"
+# Discord erlaubt maximal 50 Channels pro Kategorie
+TICKET_CATEGORY_LIMIT = 50
+
+class TicketCategoryAllocator:
+    """Verteilt neue Tickets auf "Support-Tickets", "Support-Tickets 2", ...
+
+    Die Kategorien eines Servers und ihre Channel-Anzahl werden einmal aus dem
+    Cache gelesen und danach über die Channel-Events aktuell gehalten. Channels,
+    die gerade angelegt werden, zählen bis zur Antwort der API als reserviert.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._pending = {}
+        self._locks = {}
+
+    @staticmethod
+    def _number(category_name):
+        if category_name == TICKET_CATEGORY_NAME:
+            return 1
+        prefix, _, number = category_name.rpartition(" ")
+        if prefix == TICKET_CATEGORY_NAME and number.isdigit():
+            return int(number)
+        return None
+
+    def _guild_counts(self, guild):
+        counts = self._counts.get(guild.id)
+        if counts is None:
+            counts = self._counts[guild.id] = {}
+            for category in guild.categories:
+                number = self._number(category.name)
+                if number is not None:
+                    counts[category.id] = [number, len(category.channels)]
+        return counts
+
+    async def allocate(self, guild):
+        """Gibt die erste Ticket-Kategorie mit freiem Platz zurück, legt bei Bedarf eine neue an"""
+        # Sperre pro Server, damit gleichzeitige Anfragen keine doppelten Kategorien anlegen
+        lock = self._locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            return await self._allocate(guild)
+
+    async def _allocate(self, guild):
+        counts = self._guild_counts(guild)
+        for category_id, (number, count) in sorted(counts.items(), key=lambda item: item[1][0]):
+            if count + self._pending.get(category_id, 0) < TICKET_CATEGORY_LIMIT:
+                category = guild.get_channel(category_id)
+                if category is not None:
+                    return category
+
+        used = {number for number, _ in counts.values()}
+        number = next(n for n in itertools.count(1) if n not in used)
+        name = TICKET_CATEGORY_NAME if number == 1 else f"{TICKET_CATEGORY_NAME} {number}"
+        category = await guild.create_category(name)
+        counts[category.id] = [number, 0]
+        logger.info(f"Ticket-Kategorie {name} angelegt")
+        return category
+
+    def mark_full(self, category):
+        counts = self._counts.get(category.guild.id, {})
+        if category.id in counts:
+            counts[category.id][1] = TICKET_CATEGORY_LIMIT
+
+    def channel_added(self, channel):
+        counts = self._counts.get(channel.guild.id)
+        if counts is not None and channel.category_id in counts:
+            counts[channel.category_id][1] += 1
+
+    def channel_removed(self, channel):
+        counts = self._counts.get(channel.guild.id)
+        if counts is None:
+            return
+        if channel.id in counts:
+            del counts[channel.id]
+        elif channel.category_id in counts:
+            counts[channel.category_id][1] = max(0, counts[channel.category_id][1] - 1)
+
+    async def create_ticket_channel(self, guild, name, topic):
+        for _ in range(2):
+            async with self._locks.setdefault(guild.id, asyncio.Lock()):
+                category = await self._allocate(guild)
+                self._pending[category.id] = self._pending.get(category.id, 0) + 1
+            try:
+                return await category.create_text_channel(name=name, topic=topic)
+            except discord.HTTPException as e:
+                # Kategorie ist voller als gedacht (z.B. manuell angelegte Channels)
+                if "CHANNEL_PARENT_MAX_CHANNELS" not in e.text and "Maximum number of channels in category" not in e.text:
+                    raise
+                self.mark_full(category)
+                logger.warning(f"Ticket-Kategorie {category.name} voll, weiche aus: {e}")
+            finally:
+                self._pending[category.id] -= 1
+        raise RuntimeError("Es konnte keine Ticket-Kategorie mit freiem Platz gefunden werden.")
+
+class OpenTicketIndex:
+    """Kunden-ID -> offener Ticket-Channel, aufgebaut aus dem Ticket-Index des Servers"""
+
+    def __init__(self):
+        self._by_customer = {}
+        self._pending = set()
+
+    def _guild_index(self, guild_id):
+        index = self._by_customer.get(guild_id)
+        if index is None:
+            index = self._by_customer[guild_id] = {
+                ticket['customer_id']: int(channel_id)
+                for channel_id, ticket in get_data(guild_id)['tickets'].items()
+            }
+        return index
+
+    def get(self, guild_id, customer_id):
+        return self._guild_index(guild_id).get(customer_id)
+
+    def reserve(self, guild, customer_id):
+        """Verhindert, dass zwei gleichzeitige Anfragen für denselben Kunden ein Ticket anlegen"""
+        key = (guild.id, customer_id)
+        if key in self._pending:
+            return False
+        channel_id = self.get(guild.id, customer_id)
+        if channel_id and guild.get_channel(channel_id) is not None:
+            return False
+        if channel_id:
+            # Channel ist weg, ohne dass wir es gesehen haben (z.B. gelöscht, während der Bot offline war)
+            ticket_channel_removed(guild.id, channel_id)
+        self._pending.add(key)
+        return True
+
+    def release(self, guild_id, customer_id):
+        self._pending.discard((guild_id, customer_id))
+
+    def opened(self, guild_id, customer_id, channel_id):
+        self._guild_index(guild_id)[customer_id] = channel_id
+
+    def closed(self, guild_id, customer_id):
+        self._guild_index(guild_id).pop(customer_id, None)
+
+    def forget(self, guild_id):
+        self._by_customer.pop(guild_id, None)
+
+ticket_categories = TicketCategoryAllocator()
+open_tickets = OpenTicketIndex()
+
+def ticket_channel_removed(guild_id, channel_id):
+    """Entfernt das Ticket eines gelöschten Channels, damit der Kunde ein neues bekommen kann"""
+    ticket = get_data(guild_id)['tickets'].pop(str(channel_id), None)
+    if ticket is None:
+        return
+    open_tickets.closed(guild_id, ticket['customer_id'])
+    save_data(guild_id)
+    logger.info(f"Ticket-Channel {channel_id} von {ticket['customer_id']} wurde gelöscht, Ticket entfernt")
+
+@bot.event
+async def on_guild_channel_create(channel):
+    ticket_categories.channel_added(channel)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    ticket_categories.channel_removed(channel)
+    # Von Hand gelöschte Tickets; beim Schließen per Button ist der Eintrag schon weg
+    ticket_channel_removed(channel.guild.id, channel.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    if before.category_id != after.category_id:
+        ticket_categories.channel_removed(before)
+        ticket_categories.channel_added(after)
+
 class TicketView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)
 
+    async def interaction_check(self, interaction: discord.Interaction):
+        return not await shutdown_coordinator.reject(interaction, "Ticket öffnen")
+
     @discord.ui.button(label="Kundenkontakt anfragen", style=discord.ButtonStyle.primary, custom_id="open_ticket", emoji="📞")
     async def open_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         logger.info(f"Ticket-Button geklickt von User {interaction.user.id}")
+        # Vor dem Formular prüfen, damit niemand umsonst einen Text schreibt
+        if not await check_rate_limit(interaction, "ticket_erstellen"):
+            return
         await interaction.response.send_modal(TicketModal())
 
 class TicketModal(discord.ui.Modal, title="Kundenkontakt-Anfrage"):
@@ -832,118 +3450,140 @@ class TicketModal(discord.ui.Modal, title="Kundenkontakt-Anfrage"):
         max_length=1000
     )
 
+    async def interaction_check(self, interaction: discord.Interaction):
+        return not await shutdown_coordinator.reject(interaction, "Ticket erstellen")
+
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         logger.info(f"Ticket wird erstellt von User {interaction.user.id}")
 
         try:
-            customer_id = self.customer_id_input.value
+            embed = await idempotency_cache.run(
+                idempotency_key(interaction, "ticket_erstellen", self.customer_id_input.value, self.reason.value),
+                lambda: self.create_ticket(interaction)
+            )
+            await interaction.followup.send(embed=embed, ephemeral=True)
 
-            if customer_id not in data['customers']:
-                error_embed = discord.Embed(
-                    title="Kunde nicht gefunden",
-                    description=f"Es existiert keine Akte mit der Versicherungsnehmer-ID `{customer_id}`.",
-                    color=COLOR_ERROR
-                )
-                await interaction.followup.send(embed=error_embed, ephemeral=True)
-                return
+        except Exception as e:
+            logger.error(f"Fehler beim Erstellen des Tickets: {e}", exc_info=True)
+            error_embed = discord.Embed(
+                title="Fehler bei der Ticket-Erstellung",
+                description=f"Es ist ein Fehler aufgetreten: {str(e)}",
+                color=COLOR_ERROR
+            )
+            await interaction.followup.send(embed=error_embed, ephemeral=True)
+
+    async def create_ticket(self, interaction: discord.Interaction):
+        """Legt den Ticket-Channel an und gibt das Embed für die Antwort zurück"""
+        customer_id = self.customer_id_input.value
+        data = get_data(interaction.guild_id)
+
+        if customer_id not in data['customers']:
+            error_embed = discord.Embed(
+                title="Kunde nicht gefunden",
+                description=f"Es existiert keine Akte mit der Versicherungsnehmer-ID `{customer_id}`.",
+                color=COLOR_ERROR
+            )
+            return error_embed
 
-            customer = data['customers'][customer_id]
-            guild = interaction.guild
-            category = discord.utils.get(guild.categories, name="Support-Tickets")
+        customer = data['customers'][customer_id]
+        guild = interaction.guild
 
-            if not category:
-                category = await guild.create_category("Support-Tickets")
+        if not open_tickets.reserve(guild, customer_id):
+            existing = open_tickets.get(guild.id, customer_id)
+            info_embed = discord.Embed(
+                title="Ticket bereits offen",
+                description=(
+                    f"Für `{customer_id}` ist bereits ein Ticket offen: <#{existing}>"
+                    if existing else f"Für `{customer_id}` wird gerade bereits ein Ticket erstellt."
+                ),
+                color=COLOR_INFO
+            )
+            return info_embed
 
-            ticket_channel = await category.create_text_channel(
+        try:
+            ticket_channel = await ticket_categories.create_ticket_channel(
+                guild,
                 name=f"ticket-{customer_id.lower()}",
                 topic=f"Kundenkontakt: {customer['rp_name']} | {customer_id}"
             )
+            # Ticket-Index: Channel -> Kunde, der Close-Button liest nur noch von hier
+            data['tickets'][str(ticket_channel.id)] = {
+                "customer_id": customer_id,
+                "opened_by": interaction.user.id,
+                "created_at": clock.now().isoformat()
+            }
+            save_data(interaction.guild_id)
+            # Erst nach dem Speichern gilt das Ticket als offen, sonst bleibt die Reservierung frei
+            open_tickets.opened(guild.id, customer_id, ticket_channel.id)
+        finally:
+            open_tickets.release(guild.id, customer_id)
+
+        customer_user = guild.get_member(customer['discord_user_id'])
+
+        # Verbessertes Ticket-Embed
+        now = clock.now()
+        embed = TICKET_TEMPLATE.render(
+            SECTIONS["Ticket-Informationen"],
+            TICKET_STATUS_FIELD,
+            field("⏰ Erstellt am", format_datetime(now, seconds=False)),
+            TICKET_PRIORITY_FIELD,
+            SECTIONS["Beteiligte Personen"],
+            field("👤 Mitarbeiter", f"{interaction.user.mention}\n`{interaction.user.id}`"),
+            field("👥 Versicherungsnehmer", f"{customer['rp_name']}\n`{customer_id}`"),
+            SPACER_FIELD,
+            SECTIONS["Anlass der Kontaktaufnahme"],
+            field("📝 Beschreibung", self.reason.value, False),
+            customer_fragments.get(guild.id, customer_id, customer).ticket_info,
+            timestamp=now
+        )
 
-            customer_user = guild.get_member(customer['discord_user_id'])
+        # Close-Button hinzufügen
+        close_view = TicketCloseView()
 
-            # Verbessertes Ticket-Embed
-            embed = discord.Embed(
-                title="🎫 Support-Ticket",
-                description="**Ein neues Kundenkontakt-Ticket wurde eröffnet**\n\nWillkommen! Dieses Ticket wurde erstellt, um eine professionelle Kommunikation zwischen Mitarbeiter und Versicherungsnehmer zu ermöglichen.",
-                color=COLOR_INFO,
-                timestamp=datetime.now()
-            )
+        mentions = [interaction.user.mention]
+        if customer_user:
+            mentions.append(customer_user.mention)
 
-            embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Ticket-Informationen**", inline=False)
-            embed.add_field(name="📊 Status", value="🟢 Offen", inline=True)
-            embed.add_field(name="⏰ Erstellt am", value=datetime.now().strftime('%d.%m.%Y, %H:%M'), inline=True)
-            embed.add_field(name="🔢 Priorität", value="Normal", inline=True)
-
-            embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Beteiligte Personen**", inline=False)
-            embed.add_field(name="👤 Mitarbeiter", value=f"{interaction.user.mention}\n`{interaction.user.id}`", inline=True)
-            embed.add_field(name="👥 Versicherungsnehmer", value=f"{customer['rp_name']}\n`{customer_id}`", inline=True)
-            embed.add_field(name="‎", value="‎", inline=True)
-
-            embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Anlass der Kontaktaufnahme**", inline=False)
-            embed.add_field(name="📝 Beschreibung", value=self.reason.value, inline=False)
-
-            embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Kundeninformationen**", inline=False)
-            insurance_info = "\n".join(f"▸ {ins}" for ins in customer['versicherungen'])
-            embed.add_field(name="🛡️ Versicherungen", value=insurance_info, inline=False)
-            embed.add_field(name="💰 Monatsbeitrag", value=f"`{customer['total_monthly_price']:,.2f} €`", inline=True)
-            embed.add_field(name="💳 HBpay", value=f"`{customer['hbpay_nummer']}`", inline=True)
-            embed.add_field(name="🆔 Economy-ID", value=f"`{customer['economy_id']}`", inline=True)
-
-            embed.set_footer(text="Support-System • Nutzen Sie den Button unten, um dieses Ticket zu schließen")
-
-            # Close-Button hinzufügen
-            close_view = TicketCloseView(ticket_channel.id, customer_id)
-
-            mentions = [interaction.user.mention]
-            if customer_user:
-                mentions.append(customer_user.mention)
-
-            await ticket_channel.send(" ".join(mentions), embed=embed, view=close_view)
-
-            add_log_entry(
-                "TICKET_ERSTELLT",
-                interaction.user.id,
-                {
-                    "customer_id": customer_id,
-                    "channel_id": ticket_channel.id,
-                    "reason": self.reason.value
-                }
-            )
+        await ticket_channel.send(" ".join(mentions), embed=embed, view=close_view)
 
-            log_embed = discord.Embed(
-                title="🎫 Neues Support-Ticket",
-                color=COLOR_INFO,
-                timestamp=datetime.now()
-            )
-            log_embed.add_field(name="Ticket-Channel", value=ticket_channel.mention, inline=True)
-            log_embed.add_field(name="Kunde", value=customer['rp_name'], inline=True)
-            log_embed.add_field(name="Erstellt von", value=interaction.user.mention, inline=True)
-            await send_to_log_channel(interaction.guild, log_embed)
-
-            success_embed = discord.Embed(
-                title="Ticket erfolgreich erstellt",
-                description="Die Kundenkontakt-Anfrage wurde erstellt.",
-                color=COLOR_SUCCESS
-            )
-            success_embed.add_field(name="Ticket-Channel", value=ticket_channel.mention, inline=True)
+        add_log_entry(
+            interaction.guild_id,
+            "TICKET_ERSTELLT",
+            interaction.user.id,
+            {
+                "customer_id": customer_id,
+                "channel_id": ticket_channel.id,
+                "reason": self.reason.value
+            }
+        )
 
-            await interaction.followup.send(embed=success_embed, ephemeral=True)
+        log_embed = LOG_TEMPLATE.render(
+            field("Ticket-Channel", ticket_channel.mention),
+            customer_fragments.get(guild.id, customer_id, customer).name,
+            field("Erstellt von", interaction.user.mention),
+            title="🎫 Neues Support-Ticket",
+            color=COLOR_INFO,
+            timestamp=now
+        )
+        await send_to_log_channel(interaction.guild, log_embed)
 
-        except Exception as e:
-            logger.error(f"Fehler beim Erstellen des Tickets: {e}", exc_info=True)
-            error_embed = discord.Embed(
-                title="Fehler bei der Ticket-Erstellung",
-                description=f"Es ist ein Fehler aufgetreten: {str(e)}",
-                color=COLOR_ERROR
-            )
-            await interaction.followup.send(embed=error_embed, ephemeral=True)
+        success_embed = REPLY_TEMPLATE.render(
+            field("Ticket-Channel", ticket_channel.mention),
+            title="Ticket erfolgreich erstellt",
+            description="Die Kundenkontakt-Anfrage wurde erstellt."
+        )
+
+        return success_embed
 
 class TicketCloseView(discord.ui.View):
-    def __init__(self, channel_id, customer_id):
+    """Persistente View, der Ticket-Zustand kommt aus dem Ticket-Index des Servers"""
+
+    def __init__(self):
         super().__init__(timeout=None)
-        self.channel_id = channel_id
-        self.customer_id = customer_id
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return not await shutdown_coordinator.reject(interaction, "Ticket schließen")
 
     @discord.ui.button(label="Ticket schließen", style=discord.ButtonStyle.danger, custom_id="close_ticket", emoji="🔒")
     async def close_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -957,80 +3597,256 @@ class TicketCloseView(discord.ui.View):
             )
             await interaction.response.send_message(embed=error_embed, ephemeral=True)
             return
+        if not await check_rate_limit(interaction, "ticket_schliessen"):
+            return
+
+        await interaction.response.defer()
+        embed = await idempotency_cache.run(
+            idempotency_key(interaction, "ticket_schliessen", interaction.channel_id),
+            lambda: self.close(interaction)
+        )
+        await interaction.followup.send(embed=embed)
 
+    async def close(self, interaction: discord.Interaction):
+        """Schließt das Ticket und gibt das Embed für die Ankündigung im Channel zurück"""
         channel = interaction.channel
+        tickets = get_data(interaction.guild_id)['tickets']
+        ticket = tickets.pop(str(channel.id), None)
+        if ticket:
+            customer_id = ticket['customer_id']
+            open_tickets.closed(interaction.guild_id, customer_id)
+            save_data(interaction.guild_id)
+        else:
+            # Tickets von vor dem Ticket-Index: Kunden-ID steht am Ende des Channel-Themas
+            customer_id = (channel.topic or "").rsplit("| ", 1)[-1] or "Unbekannt"
 
         close_embed = discord.Embed(
             title="🔒 Ticket wird geschlossen",
             description=f"Dieses Ticket wird in 5 Sekunden geschlossen und archiviert.\n\nGeschlossen von: {interaction.user.mention}",
             color=COLOR_WARNING,
-            timestamp=datetime.now()
+            timestamp=clock.now()
         )
 
-        await interaction.response.send_message(embed=close_embed)
-
         # Log
-        log_embed = discord.Embed(
+        now = clock.now()
+        log_embed = LOG_TEMPLATE.render(
+            SECTIONS["Ticket-Informationen"],
+            field("Ticket-Channel", channel.mention),
+            field("Geschlossen von", interaction.user.mention),
+            field("Status", "🔴 Geschlossen"),
+            SECTIONS["Zusatzinformationen"],
+            field("Kunden-ID", f"`{customer_id}`"),
+            field("Channel-ID", f"`{channel.id}`"),
+            field("Zeitstempel", format_datetime(now)),
             title="🔒 Support-Ticket geschlossen",
             description="Ein Mitarbeiter hat ein Kundenkontakt-Ticket geschlossen.",
             color=COLOR_WARNING,
-            timestamp=datetime.now()
-        )
-        log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Ticket-Informationen**", inline=False)
-        log_embed.add_field(name="Ticket-Channel", value=channel.mention, inline=True)
-        log_embed.add_field(name="Geschlossen von", value=interaction.user.mention, inline=True)
-        log_embed.add_field(name="Status", value="🔴 Geschlossen", inline=True)
-        log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Zusatzinformationen**", inline=False)
-        log_embed.add_field(name="Kunden-ID", value=f"`{self.customer_id}`", inline=True)
-        log_embed.add_field(name="Channel-ID", value=f"`{self.channel_id}`", inline=True)
-        log_embed.add_field(name="Zeitstempel", value=datetime.now().strftime('%d.%m.%Y, %H:%M:%S Uhr'), inline=True)
-        log_embed.set_footer(text=f"User-ID: {interaction.user.id}")
+            footer=f"User-ID: {interaction.user.id}",
+            timestamp=now
+        )
         await send_to_log_channel(interaction.guild, log_embed)
 
         add_log_entry(
+            interaction.guild_id,
             "TICKET_GESCHLOSSEN",
             interaction.user.id,
             {
-                "customer_id": self.customer_id,
-                "channel_id": self.channel_id
+                "customer_id": customer_id,
+                "channel_id": channel.id
             }
         )
 
-        import asyncio
-        await asyncio.sleep(5)
-        await channel.delete(reason=f"Ticket geschlossen von {interaction.user}")
+        # Transkript und Löschen über die persistente Job-Queue, damit ein Neustart kein Ticket verwaist zurücklässt
+        job_scheduler.schedule(
+            interaction.guild_id,
+            "archive_ticket",
+            channel.id,
+            clock.now() + timedelta(seconds=5),
+            {"reason": f"Ticket geschlossen von {interaction.user}", "customer_id": customer_id, "closed_by": interaction.user.id}
+        )
+        return close_embed
+
+# Ticket-Transkripte
+# Der Verlauf wird als gzip-komprimierte JSON-Lines-Datei geschrieben, blockweise und
+# im Thread-Pool, sodass weder der komplette Verlauf im Speicher liegt noch die Event-Loop blockiert.
+TRANSCRIPT_BATCH_SIZE = 100
+TRANSCRIPT_MAX_UPLOAD = 8 * 1024 * 1024
+
+def transcript_line(message):
+    return json.dumps({
+        "id": message.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "created_at": message.created_at.isoformat(),
+        "content": message.content,
+        "embeds": [embed.to_dict() for embed in message.embeds],
+        "attachments": [attachment.url for attachment in message.attachments]
+    }, ensure_ascii=False) + "\n"
+
+def _write_transcript_lines(path, lines):
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        f.writelines(lines)
+
+async def write_transcript(channel, path):
+    """Streamt den Channel-Verlauf in eine gzip-Datei und gibt die Anzahl der Nachrichten zurück"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    count = 0
+    batch = []
+    async for message in channel.history(limit=None, oldest_first=True):
+        batch.append(transcript_line(message))
+        count += 1
+        if len(batch) >= TRANSCRIPT_BATCH_SIZE:
+            await asyncio.to_thread(_write_transcript_lines, partial_path, batch)
+            batch = []
+    await asyncio.to_thread(_write_transcript_lines, partial_path, batch)
+    os.replace(partial_path, path)
+    return count
+
+@job_handler("archive_ticket")
+async def archive_ticket_job(guild, job):
+    """Archiviert den Verlauf eines geschlossenen Tickets und löscht anschließend den Channel"""
+    if guild is None:
+        return
+    channel = guild.get_channel(job['target'])
+    if channel is None:
+        return
+
+    data = get_data(guild.id)
+    customer_id = job['payload'].get('customer_id')
+    transcripts = data['transcripts'].setdefault(customer_id, [])
+    entry = next((t for t in transcripts if t['channel_id'] == channel.id), None)
+
+    # Bei einem erneuten Versuch nur die noch fehlenden Schritte ausführen
+    if entry is None:
+        filename = f"{channel.id}.jsonl.gz"
+        path = os.path.join(DATA_DIR, str(guild.id), "transcripts", customer_id, filename)
+        message_count = await write_transcript(channel, path)
+        entry = {
+            "channel_id": channel.id,
+            "channel_name": channel.name,
+            "file": path,
+            "message_count": message_count,
+            "closed_by": job['payload'].get('closed_by'),
+            "closed_at": clock.now().isoformat(),
+            "thread_message_id": None
+        }
+        transcripts.append(entry)
+        save_data(guild.id)
+        logger.info(f"Transkript für Ticket {channel.id} gespeichert ({message_count} Nachrichten)")
+
+    customer = data['customers'].get(customer_id)
+    thread_id = customer.get('thread_id') if customer else None
+    if entry['thread_message_id'] is None and thread_id:
+        thread = guild.get_thread(thread_id)
+        if thread:
+            fields = [
+                field("Nachrichten", str(entry['message_count'])),
+                field("Kunden-ID", f"`{customer_id}`")
+            ]
+            upload = os.path.getsize(entry['file']) <= TRANSCRIPT_MAX_UPLOAD
+            if not upload:
+                fields.append(field("Datei", "Zu groß für den Upload, nur im Archiv gespeichert", False))
+            transcript_embed = LOG_TEMPLATE.render(
+                fields,
+                title="🗂️ Ticket-Transkript",
+                description=f"Der Verlauf des Tickets `#{entry['channel_name']}` wurde archiviert.",
+                color=COLOR_INFO,
+                timestamp=clock.now()
+            )
+            if upload:
+                message = await thread.send(embed=transcript_embed, file=discord.File(entry['file']))
+            else:
+                message = await thread.send(embed=transcript_embed)
+            entry['thread_message_id'] = message.id
+            save_data(guild.id)
+
+    await delete_channel_job(guild, job)
+
+# Transkripte abrufen
+@bot.tree.command(name="transkripte_anzeigen", description="Zeigt die archivierten Ticket-Transkripte eines Kunden an")
+@app_commands.describe(customer_id="Versicherungsnehmer-ID")
+async def show_transcripts(interaction: discord.Interaction, customer_id: str):
+    if not interaction.user.guild_permissions.administrator:
+        error_embed = discord.Embed(
+            title="Zugriff verweigert",
+            description="Nur Administratoren können Ticket-Transkripte einsehen.",
+            color=COLOR_ERROR
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    transcripts = get_data(interaction.guild_id)['transcripts'].get(customer_id, [])
+    if not transcripts:
+        info_embed = discord.Embed(
+            title="Keine Transkripte vorhanden",
+            description=f"Für `{customer_id}` wurden noch keine Tickets archiviert.",
+            color=COLOR_INFO
+        )
+        await interaction.response.send_message(embed=info_embed, ephemeral=True)
+        return
+
+    embed = LOG_TEMPLATE.render(
+        [
+            field(
+                f"#{entry['channel_name']}",
+                f"Geschlossen: {format_datetime(datetime.fromisoformat(entry['closed_at']), seconds=False)}\nNachrichten: {entry['message_count']}",
+                False
+            )
+            for entry in transcripts[-EMBED_MAX_FIELDS:]
+        ],
+        title="🗂️ Ticket-Transkripte",
+        description=f"{len(transcripts)} archivierte(s) Ticket(s) für `{customer_id}`",
+        color=COLOR_INFO
+    )
+
+    latest = transcripts[-1]
+    if os.path.exists(latest['file']) and os.path.getsize(latest['file']) <= TRANSCRIPT_MAX_UPLOAD:
+        await interaction.response.send_message(embed=embed, file=discord.File(latest['file']), ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="ticket_setup", description="Richtet das Ticket-System ein")
 @app_commands.describe(channel="Channel für das Ticket-Panel")
 async def setup_tickets(interaction: discord.Interaction, channel: discord.TextChannel):
+    await interaction.response.defer(ephemeral=True)
     logger.info(f"Ticket-System wird eingerichtet von User {interaction.user.id} in Channel {channel.id}")
 
     try:
-        embed = discord.Embed(
-            title="",
-            description="",
-            color=COLOR_PRIMARY
+        success_embed = await idempotency_cache.run(
+            idempotency_key(interaction, "ticket_setup", channel),
+            lambda: post_ticket_panel(interaction, channel)
         )
+        await interaction.followup.send(embed=success_embed, ephemeral=True)
 
-        embed.add_field(
-            name="🎫 Professionelles Kundenkontakt-System",
-            value="━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━",
-            inline=False
+    except Exception as e:
+        logger.error(f"Fehler beim Einrichten des Ticket-Systems: {e}", exc_info=True)
+        error_embed = discord.Embed(
+            title="Fehler beim Setup",
+            description=f"Es ist ein Fehler aufgetreten: {str(e)}",
+            color=COLOR_ERROR
         )
+        await interaction.followup.send(embed=error_embed, ephemeral=True)
 
-        embed.add_field(
-            name="",
-            value=(
+async def post_ticket_panel(interaction: discord.Interaction, channel):
+    """Postet das Ticket-Panel und gibt das Embed für die Antwort zurück"""
+    embed = TICKET_PANEL_TEMPLATE.render(
+        field("🎫 Professionelles Kundenkontakt-System", "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━", False),
+        field(
+            "",
+            (
                 "Willkommen beim zentralen Kundenkontakt-Portal unserer Versicherungsgesellschaft. "
                 "Dieses System ermöglicht eine strukturierte und professionelle Kommunikation zwischen "
                 "unseren Mitarbeitern und Versicherungsnehmern.\n\u200b"
             ),
-            inline=False
-        )
-
-        embed.add_field(
-            name="📋 So funktioniert's",
-            value=(
+            False
+        ),
+        field(
+            "📋 So funktioniert's",
+            (
                 "```\n"
                 "1. Klicken Sie auf den Button unten\n"
                 "2. Geben Sie die Versicherungsnehmer-ID ein\n"
@@ -1038,73 +3854,358 @@ async def setup_tickets(interaction: discord.Interaction, channel: discord.TextC
                 "4. Ein privater Ticket-Channel wird erstellt\n"
                 "```"
             ),
-            inline=False
-        )
-
-        embed.add_field(
-            name="⚠️ Wichtige Hinweise",
-            value=(
+            False
+        ),
+        field(
+            "⚠️ Wichtige Hinweise",
+            (
                 "▸ Stellen Sie sicher, dass die **Versicherungsnehmer-ID korrekt** ist\n"
                 "▸ Formulieren Sie den Kontaktgrund **präzise und ausführlich**\n"
                 "▸ Der Versicherungsnehmer wird **automatisch zum Ticket hinzugefügt**\n"
                 "▸ Alle Kundeninformationen werden **direkt im Ticket angezeigt**\n\u200b"
             ),
-            inline=False
-        )
+            False
+        ),
+        field("", "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━", False),
+        footer_icon=interaction.guild.icon.url if interaction.guild.icon else None,
+        timestamp=clock.now()
+    )
 
-        embed.add_field(
-            name="",
-            value="━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━",
-            inline=False
-        )
+    view = TicketView()
+    await channel.send(embed=embed, view=view)
 
-        embed.set_footer(
-            text="Versicherungs-Management-System v2.0 • Datenschutzkonform & DSGVO-konform",
-            icon_url=interaction.guild.icon.url if interaction.guild.icon else None
-        )
+    success_embed = discord.Embed(
+        title="Ticket-System aktiviert",
+        description=f"Das Kundenkontakt-System wurde erfolgreich in {channel.mention} eingerichtet.",
+        color=COLOR_SUCCESS
+    )
 
-        embed.timestamp = datetime.now()
+    add_log_entry(
+        interaction.guild_id,
+        "TICKET_SYSTEM_SETUP",
+        interaction.user.id,
+        {"channel_id": channel.id}
+    )
 
-        view = TicketView()
-        await channel.send(embed=embed, view=view)
+    now = clock.now()
+    log_embed = LOG_TEMPLATE.render(
+        SECTIONS["Setup-Informationen"],
+        field("Ticket-Panel Channel", channel.mention),
+        field("Eingerichtet von", interaction.user.mention),
+        field("Status", "✅ Aktiv"),
+        SECTIONS["Zusatzinformationen"],
+        field("Channel-ID", f"`{channel.id}`"),
+        field("Zeitstempel", format_datetime(now)),
+        title="⚙️ Ticket-System eingerichtet",
+        description="Das Kundenkontakt-System wurde erfolgreich konfiguriert.",
+        color=COLOR_INFO,
+        footer=f"User-ID: {interaction.user.id}",
+        timestamp=now
+    )
+    await send_to_log_channel(interaction.guild, log_embed)
+    return success_embed
+
+# Emoji-Mapping für verschiedene Aktionen
+LOG_ACTION_EMOJIS = {
+    "KUNDENAKTE_ERSTELLT": "📋",
+    "RECHNUNG_ERSTELLT": "🧾",
+    "RECHNUNG_BEZAHLT": "💰",
+    "RECHNUNG_ARCHIVIERT": "📦",
+    "MAHNUNG_1": "⚠️",
+    "MAHNUNG_2": "🔶",
+    "MAHNUNG_3": "🔴",
+    "TICKET_ERSTELLT": "🎫",
+    "TICKET_GESCHLOSSEN": "🔒",
+    "TICKET_SYSTEM_SETUP": "⚙️",
+    "KONTOAUSZUG_GEPOSTET": "📒"
+}
+
+LOG_ACTION_NAMES = {
+    "KUNDENAKTE_ERSTELLT": "Kundenakte erstellt",
+    "RECHNUNG_ERSTELLT": "Rechnung ausgestellt",
+    "RECHNUNG_BEZAHLT": "Rechnung bezahlt",
+    "RECHNUNG_ARCHIVIERT": "Rechnung archiviert",
+    "MAHNUNG_1": "1. Mahnung versendet",
+    "MAHNUNG_2": "2. Mahnung versendet (+5%)",
+    "MAHNUNG_3": "3. Mahnung versendet (+10%)",
+    "TICKET_ERSTELLT": "Ticket erstellt",
+    "TICKET_GESCHLOSSEN": "Ticket geschlossen",
+    "TICKET_SYSTEM_SETUP": "Ticket-System eingerichtet",
+    "KONTOAUSZUG_GEPOSTET": "Kontoauszug in Akte gepostet"
+}
+
+# Volltextsuche
+# Invertierter Index pro Server über Kundenakten und Log-Einträge (darin auch die Ticket-Gründe).
+# Posting-Listen sind array('I') mit aufsteigenden Dokument-IDs: bei Logs die Position in
+# data['logs'], bei Kunden die Position in einer Liste der Kunden-IDs.
+SEARCH_PAGE_SIZE = 10
+SEARCH_MIN_TOKEN_LENGTH = 2
+SEARCH_MAX_PREFIX_TERMS = 32
+# In gefalteter Schreibweise (fuer statt für), wie sie search_tokens liefert
+SEARCH_STOPWORDS = frozenset(
+    "der die das den dem des ein eine einer eines und oder mit von vom fuer im in am an auf aus zu zum zur "
+    "ist sind wird wurde bei nach nicht ich sie er es wir ihr".split()
+)
+# Umlaute wie bei der Eingabe ohne Umlaut-Tastatur: Müller == Mueller
+_SEARCH_FOLDING = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_SEARCH_TOKEN = re.compile(r"[^\W_]+")
+
+def search_tokens(text):
+    """Zerlegt Text in gefaltete Suchbegriffe (Kleinschreibung, Umlaute, Akzente)"""
+    text = str(text).casefold().translate(_SEARCH_FOLDING)
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return [
+        token for token in _SEARCH_TOKEN.findall(text)
+        if len(token) >= SEARCH_MIN_TOKEN_LENGTH and token not in SEARCH_STOPWORDS
+    ]
+
+def _contains(postings, doc_id):
+    i = bisect.bisect_left(postings, doc_id)
+    return i < len(postings) and postings[i] == doc_id
+
+class InvertedIndex:
+    """Begriff -> aufsteigende Dokument-IDs"""
+
+    def __init__(self):
+        self.postings = {}
+        self._terms = None
+
+    def add(self, doc_id, text):
+        for token in set(search_tokens(text)):
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = array('I')
+                if self._terms is not None:
+                    bisect.insort(self._terms, token)
+            postings.append(doc_id)
+
+    def _prefix(self, prefix):
+        """Vereinigung der Posting-Listen aller Begriffe, die mit prefix beginnen"""
+        # Sortierte Begriffsliste erst bei der ersten Präfixsuche anlegen, danach per insort pflegen
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        start = bisect.bisect_left(self._terms, prefix)
+        matches = []
+        for term in itertools.islice(self._terms, start, start + SEARCH_MAX_PREFIX_TERMS):
+            if not term.startswith(prefix):
+                break
+            matches.append(self.postings[term])
+        if len(matches) == 1:
+            return matches[0]
+        return array('I', sorted(set().union(*matches)))
+
+    def search(self, terms):
+        """Dokumente, die alle Begriffe enthalten; der letzte darf unvollständig sein"""
+        lists = [self.postings.get(term) for term in terms[:-1]]
+        last = self.postings.get(terms[-1]) or self._prefix(terms[-1])
+        lists.append(last)
+        if not all(lists):
+            return array('I')
+
+        # Mit der kürzesten Liste beginnen, die übrigen per Binärsuche prüfen
+        lists.sort(key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            result = array('I', (doc_id for doc_id in result if _contains(other, doc_id)))
+            if not result:
+                break
+        return result
+
+def customer_search_text(customer_id, customer):
+    return " ".join((customer_id, customer['rp_name'], customer['hbpay_nummer'], customer['economy_id']))
+
+def log_search_text(entry):
+    values = " ".join(str(v) for v in entry['details'].values() if v is not None and not isinstance(v, (dict, list)))
+    return f"{LOG_ACTION_NAMES.get(entry['action'], entry['action'])} {values}"
+
+class GuildSearchIndex:
+    def __init__(self):
+        self.customers = InvertedIndex()
+        self.customer_ids = []
+        self._known_customers = set()
+        self.logs = InvertedIndex()
+        self.log_count = 0
+
+    def add_customer(self, customer_id, customer):
+        if customer_id in self._known_customers:
+            return
+        self._known_customers.add(customer_id)
+        self.customers.add(len(self.customer_ids), customer_search_text(customer_id, customer))
+        self.customer_ids.append(customer_id)
 
-        success_embed = discord.Embed(
-            title="Ticket-System aktiviert",
-            description=f"Das Kundenkontakt-System wurde erfolgreich in {channel.mention} eingerichtet.",
-            color=COLOR_SUCCESS
+    def add_log(self, position, entry):
+        # Nur lückenlos anhängen; Verpasstes holt catch_up nach
+        if position != self.log_count:
+            return
+        self.logs.add(position, log_search_text(entry))
+        self.log_count += 1
+
+    def catch_up(self, data):
+        logs = data['logs']
+        for position in range(self.log_count, len(logs)):
+            self.add_log(position, logs[position])
+        for customer_id, customer in data['customers'].items():
+            self.add_customer(customer_id, customer)
+
+    def search(self, query):
+        """Treffer als (Kunden-IDs, Log-Positionen); Kunden zuerst, Logs neueste zuerst"""
+        terms = search_tokens(query)
+        if not terms:
+            return [], array('I')
+        customer_hits = [self.customer_ids[doc_id] for doc_id in self.customers.search(terms)]
+        return customer_hits, self.logs.search(terms)
+
+class SearchIndex:
+    """Baut den Index eines Servers einmal im Thread-Pool auf und ergänzt ihn danach laufend"""
+
+    def __init__(self):
+        self._guilds = {}
+        self._building = {}
+
+    async def ensure(self, guild_id):
+        index = self._guilds.get(guild_id)
+        if index is not None:
+            return index
+        task = self._building.get(guild_id)
+        if task is None:
+            task = self._building[guild_id] = asyncio.create_task(self._build(guild_id))
+        return await asyncio.shield(task)
+
+    async def _build(self, guild_id):
+        started = time.perf_counter()
+        data = get_data(guild_id)
+        logs = list(data['logs'])
+        customers = list(data['customers'].items())
+        index = GuildSearchIndex()
+
+        def build():
+            for customer_id, customer in customers:
+                index.add_customer(customer_id, customer)
+            for position, entry in enumerate(logs):
+                index.add_log(position, entry)
+
+        try:
+            await asyncio.to_thread(build)
+            # Was während des Aufbaus dazukam, direkt in der Event-Loop nachtragen
+            index.catch_up(data)
+            self._guilds[guild_id] = index
+        finally:
+            del self._building[guild_id]
+        logger.info(
+            f"Suchindex für Server {guild_id} aufgebaut: {len(index.customer_ids)} Kunden, "
+            f"{index.log_count} Logs, {len(index.logs.postings)} Begriffe in {time.perf_counter() - started:.2f}s"
+        )
+        return index
+
+    def forget(self, guild_id):
+        """Der nächste Zugriff baut den Index neu auf"""
+        self._guilds.pop(guild_id, None)
+
+    def log_added(self, guild_id, position, entry):
+        index = self._guilds.get(guild_id)
+        if index is not None:
+            index.add_log(position, entry)
+
+    def customer_added(self, guild_id, customer_id, customer):
+        index = self._guilds.get(guild_id)
+        if index is not None:
+            index.add_customer(customer_id, customer)
+
+search_index = SearchIndex()
+
+def search_result_field(data, kind, ref):
+    """Feld für einen Treffer mit Link auf Kundenakte oder Ticket-Channel"""
+    if kind == "customer":
+        customer = data['customers'][ref]
+        thread = f" • Akte: <#{customer['thread_id']}>" if customer.get('thread_id') else ""
+        return field(f"📋 {customer['rp_name']}", f"`{ref}`{thread}", False)
+
+    entry = data['logs'][ref]
+    action = entry['action']
+    details = entry['details']
+    timestamp = format_timestamp(datetime.fromisoformat(entry['timestamp']), seconds=False)
+    name = f"{LOG_ACTION_EMOJIS.get(action, '📌')} {LOG_ACTION_NAMES.get(action, action)} • {timestamp}"
+
+    links = []
+    if action == "TICKET_ERSTELLT" and details.get('channel_id'):
+        links.append(f"Ticket: <#{details['channel_id']}>")
+    customer = data['customers'].get(details.get('customer_id'))
+    if customer and customer.get('thread_id'):
+        links.append(f"Akte: <#{customer['thread_id']}>")
+
+    if details.get('reason'):
+        text = details['reason']
+    else:
+        text = " • ".join(
+            f"`{v}`" if k.endswith('_id') else str(v)
+            for k, v in details.items() if v is not None and not isinstance(v, (dict, list))
         )
-        await interaction.response.send_message(embed=success_embed, ephemeral=True)
+    text = _truncate(text, 300) or "—"
+    return field(name, f"{text}\n{' • '.join(links)}" if links else text, False)
 
-        add_log_entry(
-            "TICKET_SYSTEM_SETUP",
-            interaction.user.id,
-            {"channel_id": channel.id}
+# Suche
+@bot.tree.command(name="suche", description="Durchsucht Kundenakten, Ticket-Gründe und Aktivitätsprotokoll")
+@app_commands.describe(begriff="Suchbegriff (Name, Kunden-ID, Rechnungsnummer, Ticket-Grund ...)", seite="Ergebnisseite (Standard: 1)")
+async def search(interaction: discord.Interaction, begriff: str, seite: int = 1):
+    if not interaction.user.guild_permissions.administrator:
+        error_embed = discord.Embed(
+            title="Zugriff verweigert",
+            description="Nur Administratoren können die Suche verwenden.",
+            color=COLOR_ERROR
         )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+
+    try:
+        index = await search_index.ensure(interaction.guild_id)
+        started = time.perf_counter()
+        customer_hits, log_hits = index.search(begriff)
+        total = len(customer_hits) + len(log_hits)
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        if not total:
+            info_embed = discord.Embed(
+                title="Keine Treffer",
+                description=f"Für `{begriff}` wurde nichts gefunden.",
+                color=COLOR_INFO
+            )
+            await interaction.followup.send(embed=info_embed, ephemeral=True)
+            return
 
-        log_embed = discord.Embed(
-            title="⚙️ Ticket-System eingerichtet",
-            description="Das Kundenkontakt-System wurde erfolgreich konfiguriert.",
+        pages = math.ceil(total / SEARCH_PAGE_SIZE)
+        seite = min(max(seite, 1), pages)
+        start = (seite - 1) * SEARCH_PAGE_SIZE
+        end = start + SEARCH_PAGE_SIZE
+
+        # Kunden zuerst, danach Logs von neu nach alt, ohne die Trefferliste zu kopieren
+        results = [("customer", ref) for ref in customer_hits[start:end]]
+        log_start = max(0, start - len(customer_hits))
+        for i in range(log_start, log_start + SEARCH_PAGE_SIZE - len(results)):
+            if i >= len(log_hits):
+                break
+            results.append(("log", log_hits[len(log_hits) - 1 - i]))
+
+        data = get_data(interaction.guild_id)
+        embed = LOG_TEMPLATE.render(
+            [search_result_field(data, kind, ref) for kind, ref in results],
+            title=f"🔎 Suche: {begriff}",
+            description=f"{total} Treffer ({len(customer_hits)} Kunden, {len(log_hits)} Einträge) in {duration_ms:.1f} ms",
             color=COLOR_INFO,
-            timestamp=datetime.now()
-        )
-        log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Setup-Informationen**", inline=False)
-        log_embed.add_field(name="Ticket-Panel Channel", value=channel.mention, inline=True)
-        log_embed.add_field(name="Eingerichtet von", value=interaction.user.mention, inline=True)
-        log_embed.add_field(name="Status", value="✅ Aktiv", inline=True)
-        log_embed.add_field(name="━━━━━━━━━━━━━━━━━━━━━━━", value="**Zusatzinformationen**", inline=False)
-        log_embed.add_field(name="Channel-ID", value=f"`{channel.id}`", inline=True)
-        log_embed.add_field(name="Zeitstempel", value=datetime.now().strftime('%d.%m.%Y, %H:%M:%S Uhr'), inline=True)
-        log_embed.set_footer(text=f"User-ID: {interaction.user.id}")
-        await send_to_log_channel(interaction.guild, log_embed)
+            footer=f"Seite {seite}/{pages}" + (f" • Weiter mit seite:{seite + 1}" if seite < pages else "")
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
 
     except Exception as e:
-        logger.error(f"Fehler beim Einrichten des Ticket-Systems: {e}", exc_info=True)
+        logger.error(f"Fehler bei der Suche: {e}", exc_info=True)
         error_embed = discord.Embed(
-            title="Fehler beim Setup",
+            title="Fehler bei der Suche",
             description=f"Es ist ein Fehler aufgetreten: {str(e)}",
             color=COLOR_ERROR
         )
-        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        await interaction.followup.send(embed=error_embed, ephemeral=True)
 
 # Log anzeigen
 @bot.tree.command(name="logs_anzeigen", description="Zeigt die letzten Bot-Aktivitäten an")
@@ -1124,6 +4225,7 @@ async def show_logs(interaction: discord.Interaction, anzahl: int = 10):
     await interaction.response.defer(ephemeral=True)
 
     try:
+        data = get_data(interaction.guild_id)
         if not data['logs']:
             info_embed = discord.Embed(
                 title="Keine Logs vorhanden",
@@ -1133,51 +4235,21 @@ async def show_logs(interaction: discord.Interaction, anzahl: int = 10):
             await interaction.followup.send(embed=info_embed, ephemeral=True)
             return
 
+        # Ein Feld pro Eintrag, mehr als EMBED_MAX_FIELDS lehnt Discord ab
+        anzahl = min(max(anzahl, 1), EMBED_MAX_FIELDS)
         recent_logs = data['logs'][-anzahl:]
         recent_logs.reverse()
+        members = await member_resolver.resolve(interaction.guild, [log['user_id'] for log in recent_logs])
 
-        embed = discord.Embed(
-            title="📊 System-Aktivitätsprotokoll",
-            description=f"```ansi\n\u001b[1;37mAktuelle Systemübersicht - {len(recent_logs)} Einträge\u001b[0m\n```",
-            color=COLOR_PRIMARY,
-            timestamp=datetime.now()
-        )
-
-        # Emoji-Mapping für verschiedene Aktionen
-        action_emojis = {
-            "KUNDENAKTE_ERSTELLT": "📋",
-            "RECHNUNG_ERSTELLT": "🧾",
-            "RECHNUNG_BEZAHLT": "💰",
-            "RECHNUNG_ARCHIVIERT": "📦",
-            "MAHNUNG_1": "⚠️",
-            "MAHNUNG_2": "🔶",
-            "MAHNUNG_3": "🔴",
-            "TICKET_ERSTELLT": "🎫",
-            "TICKET_GESCHLOSSEN": "🔒",
-            "TICKET_SYSTEM_SETUP": "⚙️"
-        }
-
-        action_names = {
-            "KUNDENAKTE_ERSTELLT": "Kundenakte erstellt",
-            "RECHNUNG_ERSTELLT": "Rechnung ausgestellt",
-            "RECHNUNG_BEZAHLT": "Rechnung bezahlt",
-            "RECHNUNG_ARCHIVIERT": "Rechnung archiviert",
-            "MAHNUNG_1": "1. Mahnung versendet",
-            "MAHNUNG_2": "2. Mahnung versendet (+5%)",
-            "MAHNUNG_3": "3. Mahnung versendet (+10%)",
-            "TICKET_ERSTELLT": "Ticket erstellt",
-            "TICKET_GESCHLOSSEN": "Ticket geschlossen",
-            "TICKET_SYSTEM_SETUP": "Ticket-System eingerichtet"
-        }
-
-        for idx, log in enumerate(recent_logs, 1):
-            timestamp = datetime.fromisoformat(log['timestamp']).strftime('%d.%m.%Y • %H:%M:%S')
-            user = interaction.guild.get_member(log['user_id']) if log['user_id'] != 0 else None
+        fields = []
+        for log in recent_logs:
+            timestamp = format_timestamp(datetime.fromisoformat(log['timestamp']))
+            user = members.get(log['user_id'])
             user_name = user.mention if user else "🤖 **System**"
 
             action = log['action']
-            emoji = action_emojis.get(action, "📌")
-            action_display = action_names.get(action, action)
+            emoji = LOG_ACTION_EMOJIS.get(action, "📌")
+            action_display = LOG_ACTION_NAMES.get(action, action)
 
             # Details formatieren
             details_list = []
@@ -1189,28 +4261,31 @@ async def show_logs(interaction: discord.Interaction, anzahl: int = 10):
                 elif k == 'invoice_id':
                     details_list.append(f"`{v}`")
                 elif k == 'betrag' or 'price' in k:
-                    details_list.append(f"**{v:,.2f} €**")
+                    details_list.append(f"**{format_eur(v)}**")
                 else:
                     details_list.append(f"{v}")
 
             details_text = " • ".join(details_list) if details_list else "—"
 
-            embed.add_field(
-                name=f"{emoji} {action_display}",
-                value=(
+            fields.append(field(
+                f"{emoji} {action_display}",
+                (
                     f"```fix\n"
                     f"Zeitstempel: {timestamp}\n"
                     f"```"
                     f"**Bearbeiter:** {user_name}\n"
                     f"**Details:** {details_text}\n"
-                    f"━━━━━━━━━━━━━━━━━━━━━━━"
+                    f"{SECTION_RULE}"
                 ),
-                inline=False
-            )
+                False
+            ))
 
-        embed.set_footer(
-            text=f"Angefordert von {interaction.user.display_name} • System v2.0",
-            icon_url=interaction.user.display_avatar.url if interaction.user.display_avatar else None
+        embed = ACTIVITY_LOG_TEMPLATE.render(
+            fields,
+            description=f"```ansi\n\u001b[1;37mAktuelle Systemübersicht - {len(recent_logs)} Einträge\u001b[0m\n```",
+            footer=f"Angefordert von {interaction.user.display_name} • System v2.0",
+            footer_icon=interaction.user.display_avatar.url if interaction.user.display_avatar else None,
+            timestamp=clock.now()
         )
 
         await interaction.followup.send(embed=embed, ephemeral=True)
@@ -1224,8 +4299,308 @@ async def show_logs(interaction: discord.Interaction, anzahl: int = 10):
         )
         await interaction.followup.send(embed=error_embed, ephemeral=True)
 
+# Geordnetes Herunterfahren
+# Bei SIGTERM/SIGINT (z.B. Redeploy auf Render) nimmt der Bot keine neuen Interaktionen mehr an.
+# Laufende Commands, Jobs, Mahnläufe und Rechnungs-Edits dürfen bis zur Frist fertig werden,
+# danach werden die Daten geschrieben und die Gateway-Verbindung geschlossen.
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', 20))
+
+class ShutdownCoordinator:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.draining = False
+        # Laufende Arbeit: Task oder Future -> Beschreibung für das Log
+        self._pending = {}
+        self._owners = {}
+        self._task = None
+
+    def install(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request, sig.name)
+            except (NotImplementedError, RuntimeError):
+                # Windows: SIGINT bleibt beim Standardverhalten
+                pass
+
+    def track(self, name):
+        """Merkt sich den aktuellen Task (z.B. einen Command), bis er fertig ist"""
+        task = asyncio.current_task()
+        if task is None or task in self._pending:
+            return
+        self._pending[task] = name
+        task.add_done_callback(lambda t: self._pending.pop(t, None))
+
+    @contextlib.asynccontextmanager
+    async def busy(self, name):
+        """Abschnitt in einem langlebigen Task (Mahnlauf, Job), auf den beim Herunterfahren gewartet wird"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[future] = name
+        self._owners[future] = asyncio.current_task()
+        try:
+            yield
+        finally:
+            self._pending.pop(future, None)
+            self._owners.pop(future, None)
+            future.set_result(None)
+
+    async def reject(self, interaction: discord.Interaction, name):
+        """True, wenn die Interaktion wegen des Herunterfahrens abgewiesen wurde"""
+        if not self.draining:
+            self.track(name)
+            return False
+        maintenance_embed = discord.Embed(
+            title="🔧 Wartungsmodus",
+            description="Der Bot wird gerade neu gestartet. Bitte versuchen Sie es in einer Minute erneut.",
+            color=COLOR_WARNING
+        )
+        if not interaction.response.is_done():
+            await interaction.response.send_message(embed=maintenance_embed, ephemeral=True)
+        return True
+
+    def request(self, reason):
+        if self.draining:
+            logger.warning(f"{reason} empfangen, Herunterfahren läuft bereits")
+            return
+        self.draining = True
+        self._task = asyncio.create_task(self.shutdown(reason))
+
+    async def shutdown(self, reason):
+        started = time.monotonic()
+        logger.warning(f"{reason} empfangen, fahre herunter (Frist {self.timeout:g}s)")
+
+        # Keine neuen Mahnläufe, Sicherungen oder Jobs mehr beginnen
+        check_invoices.stop()
+        backup_guilds.stop()
+        job_scheduler.stop()
+        edits = asyncio.create_task(invoice_messages.drain())
+        self._pending[edits] = "Rechnungs-Edits"
+        posts = asyncio.create_task(outbound.drain())
+        self._pending[posts] = "Log- und Akten-Posts"
+
+        dropped = []
+        if self._pending:
+            _, not_done = await asyncio.wait(list(self._pending), timeout=self.timeout)
+            for pending in not_done:
+                dropped.append(self._pending.get(pending, "?"))
+                owner = self._owners.get(pending, pending)
+                if isinstance(owner, asyncio.Task):
+                    owner.cancel()
+
+        check_invoices.cancel()
+        backup_guilds.cancel()
+        job_scheduler.cancel()
+
+        try:
+            await asyncio.wait_for(guild_store.flush(), self.timeout)
+        except Exception as e:
+            logger.error(f"Daten konnten beim Herunterfahren nicht geschrieben werden: {e}", exc_info=True)
+
+        duration = time.monotonic() - started
+        if dropped:
+            logger.warning(f"Herunterfahren nach {duration:.2f}s, abgebrochen: {', '.join(dropped)}")
+        else:
+            logger.info(f"Herunterfahren nach {duration:.2f}s abgeschlossen, nichts abgebrochen")
+        await bot.close()
+
+shutdown_coordinator = ShutdownCoordinator(SHUTDOWN_TIMEOUT)
+
+# Überwachung der Event-Loop
+# Ein Task misst in festen Abständen, wie viel später als geplant die Loop ihn wieder drannimmt.
+# Ein eigener Thread prüft den Herzschlag dieses Tasks: bleibt er länger aus als
+# HEALTH_STALL_SNAPSHOT_MS, wird der Stack des Loop-Threads geloggt, also der blockierende Code.
+# /health (lebt der Prozess?) und /ready (soll er Traffic bekommen?) bewerten daraus, aus der
+# Gateway-Latenz, dem letzten Speichern und den Hintergrund-Loops den Zustand.
+HEALTH_INTERVAL = float(os.environ.get('HEALTH_INTERVAL', 0.5))
+HEALTH_LAG_WINDOW = 120  # Messungen, bei 0.5s also eine Minute
+HEALTH_LAG_DEGRADED_MS = float(os.environ.get('HEALTH_LAG_DEGRADED_MS', 250))
+HEALTH_LAG_UNHEALTHY_MS = float(os.environ.get('HEALTH_LAG_UNHEALTHY_MS', 5000))
+HEALTH_STALL_SNAPSHOT_MS = float(os.environ.get('HEALTH_STALL_SNAPSHOT_MS', 1000))
+HEALTH_LATENCY_DEGRADED_MS = float(os.environ.get('HEALTH_LATENCY_DEGRADED_MS', 1000))
+HEALTH_PERSIST_MAX_AGE = float(os.environ.get('HEALTH_PERSIST_MAX_AGE', 0))  # Sekunden, 0 = keine Grenze
+HEALTH_LOOP_GRACE = 300  # Sekunden Spielraum, bevor ein Loop als überfällig gilt
+
+HEALTH_LEVELS = ("ok", "degraded", "unhealthy")
+
+class LoopWatchdog:
+    def __init__(self, interval):
+        self.interval = interval
+        self.lags = deque(maxlen=HEALTH_LAG_WINDOW)
+        self.heartbeat = None
+        self.last_stall = None
+        # Loop-Name -> {"at": Zeitstempel, "error": Text oder None}
+        self.runs = {}
+        self._loop_thread_id = None
+        self._snapshot_for = None
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._measure())
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    @property
+    def started(self):
+        """Erst nach dem setup_hook laufen Watchdog und Hintergrund-Loops"""
+        return self._task is not None
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def ran(self, name, error=None):
+        """Vermerkt einen Durchlauf eines Hintergrund-Loops"""
+        self.runs[name] = {"at": time.time(), "error": str(error) if error else None}
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max(0.0, (now - started - self.interval) * 1000)
+            self.lags.append(lag_ms)
+            self.heartbeat = now
+            if lag_ms >= HEALTH_STALL_SNAPSHOT_MS:
+                logger.warning(f"Event-Loop war {lag_ms:.0f} ms blockiert")
+
+    def _watch(self):
+        """Läuft im eigenen Thread, damit er auch bei blockierter Loop noch arbeitet"""
+        while True:
+            time.sleep(self.interval / 2)
+            if self._task.done():
+                continue
+            heartbeat = self.heartbeat
+            stalled_ms = (time.monotonic() - heartbeat - self.interval) * 1000
+            if stalled_ms < HEALTH_STALL_SNAPSHOT_MS or self._snapshot_for == heartbeat:
+                continue
+            # Ein Snapshot pro Blockade
+            self._snapshot_for = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(kein Frame)"
+            self.last_stall = {
+                "at": clock.now().isoformat(),
+                "stalled_ms": round(stalled_ms),
+                "stack": stack
+            }
+            logger.warning(f"Event-Loop blockiert seit {stalled_ms:.0f} ms, aktueller Stack:\n{stack}")
+
+    def stalled_ms(self):
+        if self.heartbeat is None:
+            return 0.0
+        return max(0.0, (time.monotonic() - self.heartbeat - self.interval) * 1000)
+
+    def stats(self):
+        lags = sorted(self.lags)
+        return {
+            "running": self.is_running(),
+            "samples": len(lags),
+            "lag_ms": round(self.lags[-1] if self.lags else 0.0, 1),
+            "lag_p99_ms": round(lags[int(len(lags) * 0.99)] if lags else 0.0, 1),
+            "lag_max_ms": round(lags[-1] if lags else 0.0, 1),
+            "stalled_ms": round(self.stalled_ms(), 1),
+            "last_stall": self.last_stall
+        }
+
+loop_watchdog = LoopWatchdog(HEALTH_INTERVAL)
+
+def worst(*levels):
+    return max(levels, key=HEALTH_LEVELS.index, default="ok")
+
+def event_loop_check():
+    stats = loop_watchdog.stats()
+    lag = max(stats["lag_p99_ms"], stats["stalled_ms"])
+    if not loop_watchdog.started:
+        status = "ok"
+    elif not stats["running"] or lag >= HEALTH_LAG_UNHEALTHY_MS:
+        status = "unhealthy"
+    elif lag >= HEALTH_LAG_DEGRADED_MS:
+        status = "degraded"
+    else:
+        status = "ok"
+    return {"status": status, **stats}
+
+def gateway_check():
+    if SHARDED:
+        latencies = bot.latencies
+    else:
+        latencies = [(bot.shard_id or 0, bot.latency)]
+    shards = [
+        {"shard_id": shard_id, "latency_ms": round(latency * 1000, 1) if math.isfinite(latency) else None}
+        for shard_id, latency in latencies
+    ]
+    connected = bot.is_ready() and not bot.is_closed()
+    if not connected or any(shard["latency_ms"] is None for shard in shards):
+        status = "unhealthy"
+    elif any(shard["latency_ms"] >= HEALTH_LATENCY_DEGRADED_MS for shard in shards):
+        status = "degraded"
+    else:
+        status = "ok"
+    return {"status": status, "connected": connected, "shards": shards}
+
+def persistence_check():
+    now = time.time()
+    saved_at = guild_store.last_saved_at
+    error = guild_store.last_save_error
+    age = now - saved_at if saved_at is not None else None
+    # Nur gespeichert wird bei Änderungen, ein hohes Alter allein ist deshalb kein Fehler
+    if error is not None and (saved_at is None or error[0] > saved_at):
+        status = "unhealthy"
+    elif HEALTH_PERSIST_MAX_AGE and age is not None and age > HEALTH_PERSIST_MAX_AGE:
+        status = "degraded"
+    else:
+        status = "ok"
+    return {
+        "status": status,
+        "last_saved_s_ago": round(age, 1) if age is not None else None,
+        "last_error": error[1] if error else None
+    }
+
+def background_loops():
+    """Name -> (läuft, erwarteter Abstand in Sekunden oder None)"""
+    return {
+        "check_invoices": (check_invoices.is_running() and not check_invoices.failed(), 24 * 3600),
+        "backup_guilds": (backup_guilds.is_running() and not backup_guilds.failed(), BACKUP_INTERVAL_MINUTES * 60),
+        "job_scheduler": (job_scheduler.is_running(), None)
+    }
+
+def loops_check():
+    now = time.time()
+    loops = {}
+    for name, (running, period) in background_loops().items():
+        run = loop_watchdog.runs.get(name)
+        age = now - run["at"] if run else None
+        if not running and loop_watchdog.started and not shutdown_coordinator.draining:
+            status = "unhealthy"
+        elif run and run["error"]:
+            status = "degraded"
+        elif period and bot.is_ready() and (age if age is not None else time.monotonic() - STARTED_AT) > 2 * period + HEALTH_LOOP_GRACE:
+            status = "degraded"
+        else:
+            status = "ok"
+        loops[name] = {
+            "status": status,
+            "running": running,
+            "last_run_s_ago": round(age, 1) if age is not None else None,
+            "last_error": run["error"] if run else None
+        }
+    return {"status": worst(*(loop["status"] for loop in loops.values())), "loops": loops}
+
+def health_report():
+    checks = {
+        "event_loop": event_loop_check(),
+        "gateway": gateway_check(),
+        "persistence": persistence_check(),
+        "background": loops_check()
+    }
+    return worst(*(check["status"] for check in checks.values())), checks
+
 # Für Render: Keep-Alive mit Flask
-from flask import Flask
+from flask import Flask, Response, request
 from threading import Thread
 
 app = Flask('')
@@ -1236,14 +4611,277 @@ def home():
 
 @app.route('/health')
 def health():
-    return {"status": "healthy", "bot": bot.user.name if bot.user else "starting"}
+    """Liveness: 503 nur, wenn der Prozess nicht mehr sinnvoll arbeitet (Loop hängt, Speichern scheitert)"""
+    status, checks = health_report()
+    # Ohne Gateway lebt der Prozess noch (discord.py verbindet neu), er ist nur nicht bereit
+    liveness = worst(*(check["status"] for name, check in checks.items() if name != "gateway"))
+    if checks["gateway"]["status"] != "ok":
+        liveness = worst(liveness, "degraded")
+    body = {
+        "status": "draining" if shutdown_coordinator.draining else {"ok": "healthy"}.get(liveness, liveness),
+        "bot": bot.user.name if bot.user else "starting",
+        "shards": checks["gateway"]["shards"],
+        "checks": checks
+    }
+    return body, 503 if liveness == "unhealthy" else 200
+
+@app.route('/ready')
+def ready():
+    """Readiness: 200, solange der Bot verbunden ist, nicht herunterfährt und nichts unhealthy ist"""
+    status, checks = health_report()
+    if shutdown_coordinator.draining:
+        status = "draining"
+    elif not bot.is_ready():
+        status = "starting"
+    body = {"status": {"ok": "ready"}.get(status, status), "checks": checks}
+    return body, 200 if status in ("ok", "degraded") else 503
+
+@app.route('/metrics')
+def metrics():
+    return {
+        "event_loop": loop_watchdog.stats(),
+        "idempotency": idempotency_cache.stats(),
+        "members": member_resolver.stats(),
+        "outbound": outbound.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "invoice_messages": invoice_messages.stats(),
+        "customer_fragments": customer_fragments.stats()
+    }
+
+# JSON-API (nur lesend) für Buchhaltung und Economy-Tools
+# Aufruf mit "Authorization: Bearer <API_TOKEN>", ohne API_TOKEN ist die API abgeschaltet.
+# Auf der Event-Loop des Bots werden nur Kunden und Rechnungen eines Servers kopiert, einmal pro
+# Datenstand. Filtern, Sortieren, Summieren, JSON und gzip passieren im Thread des Webservers.
+# Der ETag besteht aus den Änderungszählern der beteiligten Bereiche, unveränderte Abfragen
+# enden deshalb mit 304 ohne die Event-Loop.
+API_TOKEN = os.environ.get('API_TOKEN')
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+API_TIMEOUT = 5
+API_GZIP_MIN_BYTES = 1024
+# Die Zähler beginnen nach jedem Start bei 0, deshalb gehört der Prozessstart zum ETag
+API_ETAG_EPOCH = secrets.token_hex(4)
+
+CUSTOMER_API_FIELDS = (
+    "rp_name", "hbpay_nummer", "economy_id", "versicherungen", "total_monthly_price",
+    "tariff_version", "discord_user_id", "created_at"
+)
+INVOICE_API_FIELDS = (
+    "customer_id", "betrag", "betrag_netto", "steuer", "original_betrag", "tariff_version", "paid",
+    "paid_at", "due_date", "reminder_count", "created_at", "created_by_name", "billing_period"
+)
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def api_response(payload, status=200, etag=None):
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    response = Response(body, status=status, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if etag:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+    if len(body) >= API_GZIP_MIN_BYTES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+class ApiSnapshot:
+    """Kopie von Kunden und Rechnungen eines Servers zu einem Datenstand, nur im Webserver-Thread gelesen"""
+
+    def __init__(self, versions, customers, invoices):
+        self.versions = versions
+        self.customers = customers
+        self.invoices = invoices
+        # (created_at, Rechnungsnummer) aufsteigend, für Zeitfenster und Cursor
+        self.ordered = sorted((invoice['created_at'], invoice_id) for invoice_id, invoice in invoices.items())
+        self.open_keys = [key for key in self.ordered if not invoices[key[1]].get('paid', False)]
+        self.by_customer = {}
+        for key in self.ordered:
+            self.by_customer.setdefault(invoices[key[1]]['customer_id'], []).append(key)
+
+class ApiSnapshots:
+    """Letzte Kopie pro Server; neu kopiert wird erst, wenn sich Kunden oder Rechnungen geändert haben"""
+
+    COLLECTIONS = ("customers", "invoices")
+
+    def __init__(self):
+        self._by_guild = {}
+
+    def _versions(self, guild_id):
+        return tuple(guild_store.collection_version(guild_id, c) for c in self.COLLECTIONS)
+
+    def get(self, guild_id):
+        snapshot = self._by_guild.get(guild_id)
+        if snapshot is not None and snapshot.versions == self._versions(guild_id):
+            return snapshot
+
+        async def copy():
+            # Flache Kopien: die Werte sind Zahlen und Texte, die nur ersetzt werden
+            data = get_data(guild_id)
+            return (
+                self._versions(guild_id),
+                {customer_id: dict(customer) for customer_id, customer in data['customers'].items()},
+                {invoice_id: dict(invoice) for invoice_id, invoice in data['invoices'].items()}
+            )
+
+        future = asyncio.run_coroutine_threadsafe(copy(), bot.loop)
+        try:
+            versions, customers, invoices = future.result(API_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise
+        snapshot = self._by_guild[guild_id] = ApiSnapshot(versions, customers, invoices)
+        return snapshot
+
+api_snapshots = ApiSnapshots()
+
+def api_endpoint(*collections):
+    """Token, Server und ETag prüfen; der Handler liest danach die Kopie des Servers"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def view(guild_id, **kwargs):
+            if not API_TOKEN:
+                return api_response({"error": "API ist nicht aktiviert"}, 404)
+            authorization = request.headers.get('Authorization', '').encode('utf-8')
+            if not secrets.compare_digest(authorization, f"Bearer {API_TOKEN}".encode('utf-8')):
+                return api_response({"error": "Nicht autorisiert"}, 401)
+            if not bot.is_ready() or shutdown_coordinator.draining:
+                return api_response({"error": "Bot ist nicht bereit"}, 503)
+            if bot.get_guild(guild_id) is None or not is_local_guild(guild_id):
+                return api_response({"error": f"Server {guild_id} nicht gefunden"}, 404)
+
+            # Vor dem Lesen bestimmt: eine Änderung währenddessen führt beim nächsten Abruf zu neuen Daten
+            versions = [str(guild_store.collection_version(guild_id, c)) for c in collections]
+            etag = f'W/"{API_ETAG_EPOCH}-{"-".join(versions)}"'
+            if_none_match = request.headers.get('If-None-Match', '')
+            if if_none_match == '*' or etag in (tag.strip() for tag in if_none_match.split(',')):
+                return Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+            try:
+                snapshot = api_snapshots.get(guild_id)
+            except TimeoutError:
+                logger.warning(f"API-Abfrage {request.path} hat länger als {API_TIMEOUT}s gedauert")
+                return api_response({"error": "Zeitüberschreitung"}, 503)
+            try:
+                payload = handler(snapshot, request.args.to_dict(), **kwargs)
+            except ApiError as e:
+                return api_response({"error": e.message}, e.status)
+            return api_response(payload, etag=etag)
+        return view
+    return decorator
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        created_at, invoice_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (str(created_at), str(invoice_id))
+    except (ValueError, TypeError):
+        raise ApiError(400, "Ungültiger Cursor")
+
+def invoice_json(invoice_id, invoice):
+    return {"id": invoice_id, **{key: invoice.get(key) for key in INVOICE_API_FIELDS}}
+
+def surcharge(invoice):
+    return invoice['betrag'] - invoice.get('original_betrag', invoice['betrag'])
+
+def invoice_totals(invoices):
+    """Offene und bezahlte Beträge samt darin enthaltener Mahngebühren"""
+    open_invoices = [invoice for invoice in invoices if not invoice.get('paid', False)]
+    paid_invoices = [invoice for invoice in invoices if invoice.get('paid', False)]
+    return {
+        "open_balance": round(sum(invoice['betrag'] for invoice in open_invoices), 2),
+        "paid_total": round(sum(invoice['betrag'] for invoice in paid_invoices), 2),
+        "surcharges_open": round(sum(surcharge(invoice) for invoice in open_invoices), 2),
+        "surcharges_paid": round(sum(surcharge(invoice) for invoice in paid_invoices), 2)
+    }
+
+@app.route('/api/<int:guild_id>/customers/<customer_id>')
+@api_endpoint("customers", "invoices")
+def api_customer(snapshot, args, customer_id):
+    customer = snapshot.customers.get(customer_id)
+    if not customer:
+        raise ApiError(404, f"Kunde {customer_id} nicht gefunden")
+    keys = snapshot.by_customer.get(customer_id, [])
+    invoices = [snapshot.invoices[invoice_id] for _, invoice_id in keys]
+    return {
+        "id": customer_id,
+        **{key: customer.get(key) for key in CUSTOMER_API_FIELDS},
+        "account": {
+            "invoices": len(keys),
+            "open_invoice_ids": [invoice_id for _, invoice_id in keys if not snapshot.invoices[invoice_id].get('paid', False)],
+            **invoice_totals(invoices)
+        }
+    }
+
+@app.route('/api/<int:guild_id>/invoices')
+@api_endpoint("invoices")
+def api_invoices(snapshot, args):
+    """?status=open|paid|all&since=<ISO-Datum>&customer_id=&limit=&cursor= – älteste zuerst"""
+    status = args.get('status', 'all')
+    if status not in ("open", "paid", "all"):
+        raise ApiError(400, "status muss open, paid oder all sein")
+    try:
+        limit = min(max(int(args.get('limit', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        since = datetime.fromisoformat(args['since']).isoformat() if args.get('since') else None
+    except ValueError:
+        raise ApiError(400, "limit muss eine Zahl und since ein ISO-Datum sein")
+
+    if args.get('customer_id'):
+        keys = snapshot.by_customer.get(args['customer_id'], [])
+    elif status == "open":
+        keys = snapshot.open_keys
+    else:
+        keys = snapshot.ordered
+
+    start = 0
+    if since:
+        start = bisect.bisect_left(keys, (since, ""))
+    if args.get('cursor'):
+        start = max(start, bisect.bisect_right(keys, decode_cursor(args['cursor'])))
+
+    page = []
+    next_cursor = None
+    for key in itertools.islice(keys, start, None):
+        invoice = snapshot.invoices[key[1]]
+        if status != "all" and invoice.get('paid', False) != (status == "paid"):
+            continue
+        if len(page) == limit:
+            next_cursor = encode_cursor((page[-1]['created_at'], page[-1]['id']))
+            break
+        page.append(invoice_json(key[1], invoice))
+    return {"invoices": page, "next_cursor": next_cursor}
+
+@app.route('/api/<int:guild_id>/stats')
+@api_endpoint("customers", "invoices")
+def api_stats(snapshot, args):
+    now = clock.now().isoformat()
+    open_invoices = [snapshot.invoices[invoice_id] for _, invoice_id in snapshot.open_keys]
+    reminder_stages = {}
+    for invoice in open_invoices:
+        stage = str(invoice.get('reminder_count', 0))
+        reminder_stages[stage] = reminder_stages.get(stage, 0) + 1
+    return {
+        "customers": len(snapshot.customers),
+        "invoices": len(snapshot.invoices),
+        "open_invoices": len(open_invoices),
+        "overdue_invoices": sum(1 for invoice in open_invoices if invoice['due_date'] < now),
+        "open_by_reminder_stage": reminder_stages,
+        **invoice_totals(snapshot.invoices.values())
+    }
 
 def run():
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port)
 
 def keep_alive():
-    t = Thread(target=run)
+    # Daemon, damit der Prozess nach dem Herunterfahren des Bots endet
+    t = Thread(target=run, daemon=True)
     t.start()
 
 # Bot starten
@@ -1256,4 +4894,5 @@ if __name__ == "__main__":
         logger.error("DISCORD_TOKEN nicht gefunden! Bitte in Render-Umgebungsvariablen setzen.")
     else:
         logger.info("Bot wird gestartet...")
-        bot.run(token)
\ No newline at end of file
+        # log_handler=None: discord.py soll keinen eigenen, synchronen Handler anhängen
+        bot.run(token, log_handler=None)
\ No newline at end of file
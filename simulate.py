@@ -0,0 +1,299 @@
+"""Simulation des Mahnwesens mit virtueller Uhr.
+
+Spult Wochen von Rechnungsläufen in Sekunden vor: Jeden simulierten Tag werden
+neue Rechnungen über die echten Handler aus main.py ausgestellt, ein Teil der
+Kunden zahlt, und der Mahnlauf (check_invoices) läuft zur eingestellten Stunde.
+Die Zeit kommt aus einer virtuellen Uhr (main.clock), Channels und Discord-API
+sind die Attrappen aus loadtest.py ohne Latenz und Rate-Limits.
+
+Ausgewertet werden Mahnungen pro Tag und Stufe, Mahngebühren und die
+CPU-Zeit der Mahnläufe.
+
+Beispiel:
+    python simulate.py --days 28 --invoices-per-day 300 --pay-rate 0.3
+    python simulate.py --persist   # Daten wie im Betrieb auf die Platte schreiben
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from loadtest import FakeDiscordHTTP, FakeGuild, FakeInteraction, percentile
+
+class VirtualClock:
+    """Ersetzt main.clock; die Zeit steht, bis die Simulation sie weiterstellt"""
+
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def set(self, when):
+        if when < self.current:
+            raise ValueError(f"Die Uhr kann nicht zurückgestellt werden ({when} < {self.current})")
+        self.current = when
+
+class DunningSimulation:
+    def __init__(self, main, args):
+        self.main = main
+        self.args = args
+        self.clock = VirtualClock(args.start)
+        self.http = FakeDiscordHTTP(latency_ms=(0, 0), rate_limits=False)
+        self.guild = FakeGuild(self.http)
+        self.guild.name = "Simulation"
+        self.staff = self.guild.add_member("Buchhaltung")
+        self.channel = self.guild.add_text_channel("rechnungen")
+        self.log_channel = self.guild.add_text_channel("bot-logs")
+        self.writes = 0
+        self.issued = []
+        self.never_pays = set()
+        self.days = []
+        self.run_cpu = []
+        self.errors = Counter()
+
+    def _count_write(self, guild_id, filename, content):
+        self.writes += 1
+
+    def setup(self):
+        main = self.main
+        main.clock = self.clock
+        if not self.args.persist:
+            # Ohne --persist nur zählen: Das komplette data.json nach jeder Mahnung neu zu
+            # schreiben würde die Laufzeit bei tausenden Rechnungen dominieren
+            main.guild_store._write = self._count_write
+        main.invoice_messages.delay = 0
+        main.get_config(self.guild.id)["log_channel_id"] = self.log_channel.id
+        main.bot._connection._add_guild(self.guild)
+
+        data = main.get_data(self.guild.id)
+        tariffs = main.tariff_catalog.at()
+        self.customer_ids = []
+        for i in range(self.args.customers):
+            customer_id = f"VN-SIM{i:06d}"
+            member = self.guild.add_member(f"Kunde {i}")
+            versicherungen = random.sample(list(tariffs.tariffs), k=random.randint(1, 3))
+            data['customers'][customer_id] = {
+                "rp_name": f"Kunde {i}",
+                "hbpay_nummer": f"HB{i:06d}",
+                "economy_id": f"ECO{i:06d}",
+                "versicherungen": versicherungen,
+                "thread_id": None,
+                "discord_user_id": member.id,
+                "created_at": self.clock.now().isoformat(),
+                "created_by": 0,
+                "total_monthly_price": tariffs.total(versicherungen)
+            }
+            self.customer_ids.append(customer_id)
+
+    def day_events(self, day_start):
+        """Alle Ereignisse eines Tages in zeitlicher Reihenfolge"""
+        events = []
+        business_hours = (self.args.open_hour * 3600, self.args.close_hour * 3600)
+        for _ in range(self.args.invoices_per_day):
+            events.append((day_start + timedelta(seconds=random.uniform(*business_hours)), "issue"))
+        data = self.main.get_data(self.guild.id)
+        for invoice_id in self.issued:
+            invoice = data['invoices'].get(invoice_id)
+            if invoice is None or invoice.get('paid') or invoice_id in self.never_pays:
+                continue
+            if random.random() < self.args.pay_rate:
+                events.append((day_start + timedelta(seconds=random.uniform(*business_hours)), "pay", invoice_id))
+        for run in range(self.args.runs_per_day):
+            hour = self.args.check_hour + run * 24 / self.args.runs_per_day
+            events.append((day_start + timedelta(hours=hour % 24), "check"))
+        events.sort(key=lambda event: event[0])
+        return events
+
+    async def issue(self):
+        embed = await self.main.issue_invoice(self.guild, random.choice(self.customer_ids), self.channel, self.staff)
+        if embed.color.value == self.main.COLOR_ERROR:
+            self.errors[f"Rechnung: {embed.title}"] += 1
+            return
+        invoice_id = next(f['value'].strip('`') for f in embed.to_dict()['fields'] if f['name'] == "Rechnungsnummer")
+        self.issued.append(invoice_id)
+        if random.random() < self.args.never_pay:
+            self.never_pays.add(invoice_id)
+
+    async def pay(self, invoice_id):
+        interaction = FakeInteraction(self.http, self.guild, self.staff)
+        embed = await self.main.mark_invoice_paid(interaction, invoice_id)
+        if embed.color.value == self.main.COLOR_ERROR:
+            self.errors[f"Zahlung: {embed.title}"] += 1
+
+    async def check(self):
+        start = time.process_time()
+        await self.main.check_invoices.coro()
+        self.run_cpu.append(time.process_time() - start)
+
+    def surcharges(self):
+        """Mahngebühren (offen, bezahlt) über alle Rechnungen"""
+        outstanding = collected = 0.0
+        for invoice in self.main.get_data(self.guild.id)['invoices'].values():
+            surcharge = invoice['betrag'] - invoice['original_betrag']
+            if invoice.get('paid'):
+                collected += surcharge
+            else:
+                outstanding += surcharge
+        return outstanding, collected
+
+    async def simulate_day(self, day_start):
+        counts = Counter()
+        cpu_before = len(self.run_cpu)
+        log_offset = len(self.main.get_data(self.guild.id)['logs'])
+        outstanding_before, collected_before = self.surcharges()
+
+        for event in self.day_events(day_start):
+            self.clock.set(event[0])
+            self.main.job_scheduler.wake()
+            counts[event[1]] += 1
+            try:
+                await getattr(self, event[1])(*event[2:])
+            except Exception as e:
+                self.errors[f"{event[1]}: {type(e).__name__}"] += 1
+        await self.main.invoice_messages.drain()
+        await self.main.outbound.drain()
+        await self.main.guild_store.saved(self.guild.id)
+
+        data = self.main.get_data(self.guild.id)
+        for entry in data['logs'][log_offset:]:
+            if entry['action'].startswith("MAHNUNG_"):
+                counts[entry['action']] += 1
+        outstanding, collected = self.surcharges()
+        self.days.append({
+            "date": day_start,
+            "issued": counts["issue"],
+            "paid": counts["pay"],
+            "reminders": [counts[f"MAHNUNG_{n}"] for n in (1, 2, 3)],
+            "surcharge": (outstanding + collected) - (outstanding_before + collected_before),
+            "open": sum(1 for invoice in data['invoices'].values() if not invoice.get('paid')),
+            "cpu": sum(self.run_cpu[cpu_before:])
+        })
+
+    def check_invariants(self):
+        main = self.main
+        data = main.get_data(self.guild.id)
+        violations = []
+        factors = {0: 1.0, **{number: factor for number, _, factor in main.REMINDER_STAGES.values()}}
+        last_number = max(factors)
+
+        if len(set(self.issued)) != len(self.issued) or len(data['invoices']) != len(self.issued):
+            duplicates = len(self.issued) - len(data['invoices'])
+            violations.append(f"{duplicates} Rechnungsnummer(n) doppelt vergeben, ältere Rechnungen überschrieben")
+
+        reminders = Counter()
+        for entry in data['logs']:
+            if entry['action'].startswith("MAHNUNG_"):
+                invoice_id = entry['details']['invoice_id']
+                reminders[(invoice_id, entry['action'])] += 1
+                paid_at = data['invoices'].get(invoice_id, {}).get('paid_at')
+                if paid_at and entry['timestamp'] > paid_at:
+                    violations.append(f"{invoice_id}: {entry['action']} nach der Zahlung verschickt")
+        for (invoice_id, action), n in reminders.items():
+            if n > 1:
+                violations.append(f"{invoice_id}: {action} {n}× verschickt")
+
+        # Nach so vielen Tagen muss die letzte Stufe erreicht sein, wenn täglich geprüft wird
+        settled = self.clock.now() - timedelta(days=last_number)
+        for invoice_id, invoice in data['invoices'].items():
+            if invoice.get('paid'):
+                continue
+            expected = invoice['original_betrag'] * factors[invoice['reminder_count']]
+            if abs(invoice['betrag'] - expected) > 0.005:
+                violations.append(f"{invoice_id}: Betrag {invoice['betrag']:.2f} passt nicht zu Mahnstufe {invoice['reminder_count']}")
+            if datetime.fromisoformat(invoice['due_date']) < settled and invoice['reminder_count'] != last_number:
+                violations.append(f"{invoice_id}: Mahnstufe {invoice['reminder_count']} statt {last_number}")
+        return violations
+
+    def report(self, wall_time, violations):
+        args = self.args
+        print(f"\n=== Mahnwesen: {args.days} Tage, {len(self.issued)} Rechnungen in {wall_time:.2f}s ===")
+        print(f"{'Datum':<12}{'neu':>6}{'bezahlt':>9}{'M1':>6}{'M2':>6}{'M3':>6}{'Gebühren €':>13}{'offen':>8}{'CPU ms':>9}")
+        for day in self.days:
+            m1, m2, m3 = day['reminders']
+            print(f"{day['date']:%d.%m.%Y}  {day['issued']:>6}{day['paid']:>9}{m1:>6}{m2:>6}{m3:>6}"
+                  f"{day['surcharge']:>13,.2f}{day['open']:>8}{day['cpu'] * 1000:>9.1f}")
+
+        totals = [sum(day['reminders'][i] for day in self.days) for i in range(3)]
+        outstanding, collected = self.surcharges()
+        print(f"\nMahnungen: {totals[0]} × 1. • {totals[1]} × 2. • {totals[2]} × 3. Stufe")
+        print(f"Mahngebühren: {outstanding + collected:,.2f} € gesamt • {collected:,.2f} € bezahlt • {outstanding:,.2f} € offen")
+
+        cpu_ms = [v * 1000 for v in self.run_cpu] or [0.0]
+        invoices = len(self.main.get_data(self.guild.id)['invoices']) or 1
+        print(f"Mahnläufe: {len(self.run_cpu)} • CPU gesamt {sum(cpu_ms):.1f} ms • p50 {statistics.median(cpu_ms):.1f} ms"
+              f" • p95 {percentile(cpu_ms, 95):.1f} ms • max {max(cpu_ms):.1f} ms"
+              f" • letzter Lauf {cpu_ms[-1] * 1000 / invoices:.1f} µs/Rechnung")
+        print(f"Schreibvorgänge: {self.writes if not args.persist else self.main.guild_store.generations.get(self.guild.id, 0)}"
+              f" • HTTP-Requests: {sum(self.http.requests.values())}")
+
+        if self.errors:
+            print("\nFehler:")
+            for name, n in self.errors.most_common():
+                print(f"  {name}: {n}")
+
+        print(f"\nInvarianten: {len(violations)} Verletzung(en)")
+        for violation in violations[:25]:
+            print(f"  ✗ {violation}")
+        if len(violations) > 25:
+            print(f"  … und {len(violations) - 25} weitere")
+
+    async def run(self):
+        self.setup()
+        start = time.perf_counter()
+        for day in range(self.args.days):
+            await self.simulate_day(self.args.start + timedelta(days=day))
+        wall_time = time.perf_counter() - start
+        violations = self.check_invariants()
+        self.report(wall_time, violations)
+        return 1 if violations else 0
+
+def parse_date(text):
+    try:
+        return datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ungültiges Datum: {text} (erwartet JJJJ-MM-TT)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulation des Mahnwesens mit virtueller Uhr")
+    parser.add_argument("--days", type=int, default=28, help="Anzahl simulierter Tage")
+    parser.add_argument("--start", type=parse_date, default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0),
+                        help="Erster simulierter Tag (JJJJ-MM-TT), Standard: heute")
+    parser.add_argument("--customers", type=int, default=2000, help="Anzahl Kunden")
+    parser.add_argument("--invoices-per-day", type=int, default=150, help="Neue Rechnungen pro Tag")
+    parser.add_argument("--pay-rate", type=float, default=0.3, help="Wahrscheinlichkeit, dass eine offene Rechnung an einem Tag bezahlt wird")
+    parser.add_argument("--never-pay", type=float, default=0.1, help="Anteil der Rechnungen, die nie bezahlt werden")
+    parser.add_argument("--check-hour", type=float, default=12, help="Uhrzeit des (ersten) Mahnlaufs")
+    parser.add_argument("--runs-per-day", type=int, default=1, help="Mahnläufe pro Tag")
+    parser.add_argument("--open-hour", type=float, default=8, help="Beginn der Geschäftszeit (Rechnungen und Zahlungen)")
+    parser.add_argument("--close-hour", type=float, default=20, help="Ende der Geschäftszeit")
+    parser.add_argument("--persist", action="store_true", help="Daten wie im Betrieb nach jeder Änderung schreiben")
+    parser.add_argument("--seed", type=int, default=None, help="Zufalls-Seed für reproduzierbare Läufe")
+    parser.add_argument("--log-level", default="WARNING", help="Log-Level des Bots während der Simulation")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # main.py legt Daten- und Logdateien im Arbeitsverzeichnis an
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo_dir)
+    workdir = tempfile.mkdtemp(prefix="insurance-simulation-")
+    os.chdir(workdir)
+    import main as bot_main
+    logging.getLogger().setLevel(args.log_level.upper())
+    print(f"Arbeitsverzeichnis: {workdir}")
+
+    return asyncio.run(DunningSimulation(bot_main, args).run())
+
+if __name__ == "__main__":
+    sys.exit(main())